@@ -1,10 +1,13 @@
 # app.py
-from assistant import assistant_response
-from flask import Flask, request, jsonify
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
+import assistant
+from assistant import assistant_response, init_services
+from flask import Flask, Response, request, jsonify
 import os
+from tracing import render_metrics, trace_request
+from fairness import SHED_REPLIES, get_scheduler
+from idempotency import get_idempotency_store
+from credentials import get_credential_manager
+from rendering import segment
 
 app = Flask(__name__)
 
@@ -12,43 +15,24 @@ app = Flask(__name__)
 def initialize_services():
     creds = get_credentials()
     
-    calendar_service = build('calendar', 'v3', credentials=creds)
-    gmail_service = build('gmail', 'v1', credentials=creds)
-    
     # Get API keys
     api_key = os.getenv('GOOGLE_API_KEY')
     news_api_key = os.getenv('NEWS_API_KEY')
+
+    # Also starts the outbox worker that delivers queued emails
+    init_services(api_key, news_api_key, creds)
     
     return {
-        'calendar': calendar_service,
-        'gmail': gmail_service,
+        'calendar': assistant.calendar_pool,
+        'gmail': assistant.gmail_pool,
         'google_api_key': api_key,
         'news_api_key': news_api_key
     }
 
 def get_credentials():
-    SCOPES = [
-        'https://www.googleapis.com/auth/calendar',
-        'https://www.googleapis.com/auth/gmail.readonly'
-    ]
-    creds = None
-
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            from google_auth_oauthlib.flow import InstalledAppFlow
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
-    return creds
+    # Loaded from token.json and refreshed before expiry on a background thread;
+    # authorize with `python credentials.py` first
+    return get_credential_manager().get()
 
 # Initialize services at startup
 services = initialize_services()
@@ -58,14 +42,32 @@ services = initialize_services()
 def webhook():
     data = request.get_json()
     user_message = data.get('message', '')
+    sender = data.get('from')
+    # Providers redeliver on timeout; the message id makes a redelivery a replay
+    message_id = data.get('message_id') or data.get('id')
     
-    # Get assistant response
-    assistant_reply = assistant_response(user_message, services)
+    # Every span of this request is tagged with one request id
+    with trace_request(request.headers.get('X-Request-Id'), route='/webhook') as request_id:
+        # Per-sender rate limits and a fair share of the workers for every sender
+        assistant_reply, replayed = get_idempotency_store().run(
+            message_id,
+            lambda: get_scheduler().run(sender, assistant_response, user_message, user_id=sender),
+            cache_if=lambda reply: reply not in SHED_REPLIES)
     
-    return jsonify({
+    response = jsonify({
         'reply': assistant_reply,
-        'status': 'success'
+        # WhatsApp caps a text message at 4096 characters; send these in order
+        'segments': segment(assistant_reply),
+        'status': 'success',
+        'request_id': request_id,
+        'replayed': replayed
     })
+    response.headers['X-Request-Id'] = request_id
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
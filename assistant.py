@@ -1,135 +1,223 @@
-import faiss
-import numpy as np
 import requests
-import enum
 import sqlite3
 from datetime import datetime, timedelta
 import base64
 import dateparser
-from sentence_transformers import SentenceTransformer
-from google.api_core import retry
-import genai
-from genai import types
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-import os.path
-import json
+from google import genai
+import re
+from contacts import match_attendees, start_sync
+from news import NewsClient, NewsPrefetcher
+from news_digest import build_stories, get_interest_profile, queue_profile_update
+from embeddings import get_embedding_service
+from outbox import enqueue_email, get_email_status, list_outbox, start_worker
+from tracing import metrics, traced
+from prompting import assemble_prompt, classify_intent
+from timerange import calendar_time, free_days, parse_time_range, user_timezone
+from extraction import extract
+from model_tiers import generate
+from google_pool import ServicePool
+from composite import Branch, run_composite
+from briefing import BriefingService, invalidate
+from calendar_import import TERM_WEEKS, format_import_result, format_skipped, import_timetable
+from workout_scheduler import (format_plan, format_written_plan, plan_events, plan_week, preferences_for,
+                               write_plan)
+from reminder_sync import ReminderSync
+from drafts import pop_draft, reply_kind, save_draft
+from rendering import (ITEM_SEPARATOR, event_time, render_due_reminders, render_email, render_events, render_news,
+                       render_reminders)
 
 # Initialize services (to be implemented in app.py)
 client = None
-calendar_service = None
-gmail_service = None
+calendar_pool = None
+gmail_pool = None
 news_api_key = None
+news_client = None
+news_prefetcher = None
+briefing_service = None
+reminder_sync = None
 
 
 def init_services(api_key, news_key, credentials):
-    global client, calendar_service, gmail_service, news_api_key
+    global client, calendar_pool, gmail_pool, news_api_key, news_client, news_prefetcher, briefing_service
+    global reminder_sync
     client = genai.Client(api_key=api_key)
-    calendar_service = build('calendar', 'v3', credentials=credentials)
-    gmail_service = build('gmail', 'v1', credentials=credentials)
+    # httplib2 is not thread-safe, so every call checks a service object out of a pool
+    calendar_pool = ServicePool.for_api('calendar', 'v3', credentials)
+    gmail_pool = ServicePool.for_api('gmail', 'v1', credentials)
     news_api_key = news_key
+    news_client = NewsClient(news_key)
+    news_prefetcher = NewsPrefetcher(news_client, NEWS_CATEGORIES, format_news_response,
+                                     digest=build_stories).start()
+    start_worker(deliver_email)
+    briefing_service = BriefingService(lambda user_id: brief_day(user_id=user_id)).start()
+    init_db()
+    reminder_sync = ReminderSync(calendar_pool, on_change=invalidate_briefings).start()
+    start_sync(gmail_pool, ServicePool.for_api('people', 'v1', credentials, size=1))
+    metrics.register_collector(news_client.stats, prefix='news_cache_')
+    metrics.register_collector(calendar_pool.stats, prefix='google_pool_calendar_')
+    metrics.register_collector(gmail_pool.stats, prefix='google_pool_gmail_')
+    metrics.register_collector(get_embedding_service().stats, prefix='embedding_')
 
 ##Get Events
 
+@traced('google.calendar.events.list')
 def get_calendar_events(time_min=None, time_max=None, query=None):
-    events_result = calendar_service.events().list(
-        calendarId='primary',
-        timeMin=time_min,
-        timeMax=time_max,
-        q=query,
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
+    with calendar_pool.checkout() as calendar_service:
+        events_result = calendar_service.events().list(
+            calendarId='primary',
+            timeMin=time_min,
+            timeMax=time_max,
+            q=query,
+            singleEvents=True,
+            orderBy='startTime'
+        ).execute()
     return events_result.get('items', [])
 
-def format_events(events):
+def format_events(events, title="Your Events"):
+    return render_events(events, title)
+
+@traced('handler.calendar_read')
+def handle_calendar_read(time_range):
+    """Answer a calendar read for a locally parsed time range, without a model call"""
+    events = get_calendar_events(time_min=time_range.start, time_max=time_range.end)
+    if time_range.free_days:
+        days = free_days(events, time_range)
+        if not days:
+            return f"You have no off days {time_range.label}."
+        return f"Your off days {time_range.label}:\n\n" + "\n".join(f"• {day}" for day in days)
     if not events:
-        return "No events found."
-
-    formatted = "Your Events:\n\n"
-    for event in events:
-        start = event['start'].get('dateTime', event['start'].get('date'))
-        end = event['end'].get('dateTime', event['end'].get('date'))
-        attendees = ", ".join(
-            [attendee['email'] for attendee in event.get('attendees', [])])
-
-        formatted += (
-            f"• **{event['summary']}**\n"
-            f"  {start} - {end}\n"
-            f"  {event.get('location', 'No location')}\n"
-            f"  Attendees: {attendees}\n"
-            f"  {event.get('htmlLink', 'No link')}\n\n"
-        )
-    return formatted
+        return f"No events found for {time_range.label}."
+    return format_events(events, title=f"Your events for {time_range.label}")
 
 """##Create Events"""
 
-def create_calendar_event(title, start_time, end_time=None, attendees=None, description=""):
+def draft_calendar_event(title, start_time, end_time=None, attendees=None, description=""):
+    """(event body, names that matched no contact, {name: candidates} for names matching several)"""
     if not end_time:
         end_time = (datetime.fromisoformat(start_time) + timedelta(hours=1)).isoformat()
+    emails, unresolved, ambiguous = match_attendees(attendees) if attendees else ([], [], {})
 
     event = {
         'summary': title,
         'description': description,
-        'start': {'dateTime': start_time, 'timeZone': 'UTC'},
-        'end': {'dateTime': end_time, 'timeZone': 'UTC'},
-        'attendees': [{'email': email} for email in attendees] if attendees else [],
+        'start': calendar_time(start_time),
+        'end': calendar_time(end_time),
+        'attendees': [{'email': email} for email in emails],
     }
+    return event, unresolved, ambiguous
 
-    created_event = calendar_service.events().insert(
-        calendarId='primary',
-        body=event
-    ).execute()
+@traced('google.calendar.events.insert')
+def insert_calendar_event(event):
+    with calendar_pool.checkout() as calendar_service:
+        created_event = calendar_service.events().insert(
+            calendarId='primary',
+            body=event
+        ).execute()
 
+    calendar_changed()
     return f"Event created: {created_event['htmlLink']}"
 
+def create_calendar_event(title, start_time, end_time=None, attendees=None, description=""):
+    event, unresolved, ambiguous = draft_calendar_event(title, start_time, end_time, attendees, description)
+    reply = insert_calendar_event(event)
+    if unresolved or ambiguous:
+        reply += f"\nNot invited, no single email address found for: {', '.join([*unresolved, *ambiguous])}"
+    return reply
+
+def _candidates(candidates):
+    return ", ".join(f"{name} ({email})" for name, email in candidates)
+
+def propose_calendar_event(user_id, title, start_time, attendees=None):
+    """Store the event as a draft and ask the user to confirm it"""
+    event, unresolved, ambiguous = draft_calendar_event(title, start_time, attendees=attendees)
+    save_draft(user_id, 'event', event)
+    lines = ["Shall I add this to your calendar?", "", title, event_time(event)]
+    if event['attendees']:
+        lines.append("With: " + ", ".join(attendee['email'] for attendee in event['attendees']))
+    if unresolved:
+        lines.append(f"I couldn't find an email address for {', '.join(unresolved)}, "
+                     "so they won't be invited.")
+    for name, candidates in ambiguous.items():
+        lines.append(f"Several contacts match {name}: {_candidates(candidates)}. "
+                     "To invite one of them, reply no and ask again with their email address.")
+    lines += ["", "Reply yes to add it or no to cancel."]
+    return "\n".join(lines)
+
+GYM_PLAN_WORDS = re.compile(r"\b(plan|schedule|book|organi[sz]e|fit in)\b", re.IGNORECASE)
+
+@traced('handler.workout_plan')
+def handle_workout_plan(request, user_id=None):
+    """Place the week's workouts and cardio days in free slots and propose them for confirmation"""
+    now = datetime.now(user_timezone())
+    time_range = parse_time_range(request, now)
+    start, days = None, 7
+    if time_range is not None:
+        first = datetime.fromisoformat(time_range.start)
+        start = max(first, now.replace(hour=0, minute=0, second=0, microsecond=0))
+        days = max(1, (datetime.fromisoformat(time_range.end) - start).days)
+    plan, _ = plan_week(calendar_pool, start, days, preferences_for(request), now, write=False)
+    if not plan.sessions:
+        return format_plan(plan)
+    save_draft(user_id, 'gym_plan', {'events': plan_events(plan), 'replaces': list(plan.replaces)})
+    return format_plan(plan) + "\n\nReply yes to add these sessions to your calendar or no to cancel."
+
+def write_workout_plan(draft):
+    """Write a confirmed gym plan, replacing the sessions it was planned over"""
+    result = write_plan(calendar_pool, draft['events'], draft['replaces'])
+    if result.created or draft['replaces']:
+        calendar_changed()
+    return format_written_plan(result)
+
+TIMETABLE_KEYWORDS = ["import my timetable", "add my timetable", "import timetable", "add my schedule",
+                      "import my schedule", "import my project plan", "add my project plan"]
+
+@traced('handler.timetable_import')
+def handle_timetable_import(request):
+    """Add a pasted timetable or plan, one line per class, as recurring events"""
+    header, _, source = request.partition("\n")
+    if not source.strip():
+        return ("Send the timetable after the first line, one class per line, e.g.\n"
+                "Import my timetable\nMonday 09:00-11:00 Calculus I @ Room 101")
+    start = parse_time_range(header)
+    term_start = datetime.fromisoformat(start.start).date() if start else None
+    weeks = re.search(r"\bfor (\d+) weeks\b", header, re.IGNORECASE)
+    try:
+        result = import_timetable(calendar_pool, source, term_start, int(weeks.group(1)) if weeks else TERM_WEEKS)
+    except ValueError as e:
+        return f"I couldn't read that timetable: {e}"
+    if not result.created and not result.failed:
+        return f"I couldn't find any classes in that timetable. {format_skipped(result.skipped)}".strip()
+    if result.created:
+        calendar_changed()
+    return format_import_result(result)
+
 """##Fetch Emails"""
 
+@traced('google.gmail.messages.list')
 def get_emails(query="", max_results=5):
-    results = gmail_service.users().messages().list(
-        userId='me',
-        q=query,
-        maxResults=max_results
-    ).execute()
+    with gmail_pool.checkout() as gmail_service:
+        results = gmail_service.users().messages().list(
+            userId='me',
+            q=query,
+            maxResults=max_results
+        ).execute()
     return results.get('messages', [])
 
+@traced('google.gmail.messages.get')
 def format_email_summary(email):
-    msg = gmail_service.users().messages().get(
-        userId='me',
-        id=email['id'],
-        format='metadata'
-    ).execute()
+    with gmail_pool.checkout() as gmail_service:
+        msg = gmail_service.users().messages().get(
+            userId='me',
+            id=email['id'],
+            format='metadata'
+        ).execute()
 
     subject = next(
         h['value'] for h in msg['payload']['headers'] if h['name'] == 'Subject')
     sender = next(
         h['value'] for h in msg['payload']['headers'] if h['name'] == 'From')
 
-    return f"{subject}\n   {sender}\n"
-
-"""#Vector Stores for Emails"""
-
-class ContactStore:
-    def __init__(self):
-        self.index = faiss.IndexFlatL2(128)  # Dummy embedding dimension
-        self.contacts = []
-
-    def add_contact(self, name, email):
-        self.contacts.append((name, email))
-        # In a real app, you'd use a text embedding model here.
-
-    def find_email(self, name):
-        for contact_name, email in self.contacts:
-            if name.lower() in contact_name.lower():
-                return email
-        return None
-
-# Example usage:
-contacts = ContactStore()
-contacts.add_contact("Sarah Thompson", "sarah@example.com")
-contacts.add_contact("John Doe", "john@example.com")
-
-print(contacts.find_email("Sarah"))
+    return render_email(subject, sender)
 
 """##Email Template"""
 
@@ -146,57 +234,71 @@ EMAIL_TEMPLATES = {
     }
 }
 
+@traced('handler.send_email')
 def send_email(to, template_name, **kwargs):
+    """Queue a templated email; delivery happens on the outbox worker"""
     template = EMAIL_TEMPLATES[template_name]
+    subject = template['subject'].format(**kwargs)
     email_body = template["body"].format(**kwargs)
 
-    message = {
-        'raw': base64.urlsafe_b64encode(
-            f"To: {to}\n"
-            f"Subject: {template['subject'].format(**kwargs)}\n\n"
-            f"{email_body}".encode()
-        ).decode()
-    }
-
-    gmail_service.users().messages().send(
-        userId='me',
-        body=message
-    ).execute()
-    return "Email sent successfully."
+    raw = base64.urlsafe_b64encode(
+        f"To: {to}\n"
+        f"Subject: {subject}\n\n"
+        f"{email_body}".encode()
+    ).decode()
+
+    outbox_id = enqueue_email(to, subject, raw)
+    return f"Email queued for sending (ID: {outbox_id})."
+
+@traced('google.gmail.messages.send')
+def deliver_email(raw):
+    """Send an encoded message through Gmail, called by the outbox worker"""
+    with gmail_pool.checkout() as gmail_service:
+        sent = gmail_service.users().messages().send(
+            userId='me',
+            body={'raw': raw}
+        ).execute()
+    return sent.get('id')
+
+def format_email_status(status):
+    line = f"[{status['id']}] {status['subject']} -> {status['recipient']}\n   Status: {status['status']}"
+    if status['status'] == 'sent':
+        line += f" ({status['sent_at']})"
+    elif status['last_error']:
+        line += f" after {status['attempts']} attempt(s): {status['last_error']}"
+    return line + "\n"
+
+@traced('handler.email_status')
+def handle_email_status(request):
+    """Report delivery status of queued emails"""
+    words = request.split()
+    if words and words[-1].isdigit():
+        status = get_email_status(int(words[-1]))
+        if not status:
+            return f"Could not find email {words[-1]}."
+        return format_email_status(status)
+
+    statuses = list_outbox()
+    if not statuses:
+        return "No emails have been queued."
+    return "Your Outbox:\n\n" + "\n".join(format_email_status(s) for s in statuses)
 
 """##News Implementation Code"""
 
-def get_news(category=None, query=None, num_articles=5):
-  base_url = "https://newsapi.org/v2/"
-
-  if query:
-    endpoint = "everything"
-    params = {
-        "q": query,
-        "pageSize": num_articles,
-        "apiKey": news_api_key,
-        "sortBy": "publishedAt",
-        "language": "en"
-    }
-  elif category:
-    endpoint = "top-headlines"
-    params = {
-        "category": category,
-        "pageSize": num_articles,
-        "api_key": news_api_key,
-
-    }
-  else:
-    endpoint = "top-headlines"
-    params = {
-        "pageSize": num_articles,
-        "api_key": news_api_key,
+NEWS_CATEGORIES = {
+    "technology": ["tech", "technology", "ai", "artificial intelligence"],
+    "business": ["business", "economy", "market", "finance"],
+    "sports": ["sports", "football", "basketball", "tennis"],
+    "health": ["health", "medical", "medicine"],
+    "science": ["science", "space", "research"]
+}
 
-    }
+@traced('news.get')
+def get_news(category=None, query=None, num_articles=5):
+  if news_client is None:
+    return "I couldn't retrieve news at the moment. Please try again later or check your API connection."
   try:
-        response = requests.get(base_url + endpoint, params=params)
-        response.raise_for_status()
-        articles = response.json().get('articles', [])
+        articles = news_client.get(category=category, query=query, num_articles=num_articles)
 
         if not articles:
             return "No recent news found on this topic."
@@ -207,24 +309,7 @@ def get_news(category=None, query=None, num_articles=5):
         return f"News API error: {str(e)}"
 
 def format_news_response(articles):
-
-    if isinstance(articles, str):
-        return articles  # Return error message if present
-
-    formatted_news = "Latest News:\n"
-    for i, article in enumerate(articles[:5], 1):
-        title = article.get('title', 'No title')
-        source = article.get('source', {}).get('name', 'Unknown source')
-        description = article.get('description', 'No description available')
-        url = article.get('url', '#')
-
-        formatted_news += (
-            f"{i}. {title} - {source}\n"
-            f"   • {description}\n"
-            f"   • Read more: {url}\n\n"
-        )
-
-    return formatted_news
+    return render_news(articles)
 
 """#Setting Reminders"""
 
@@ -243,6 +328,7 @@ def init_db():
     conn.commit()
     conn.close()
 
+@traced('sqlite.reminders.add')
 def add_reminder_db(text, due_date, priority="medium"):
     """Add a new reminder to database"""
     conn = sqlite3.connect('reminders.db')
@@ -254,8 +340,10 @@ def add_reminder_db(text, due_date, priority="medium"):
     conn.commit()
     reminder_id = c.lastrowid
     conn.close()
+    invalidate_briefings()
     return reminder_id
 
+@traced('sqlite.reminders.get')
 def get_reminders_db(show_completed=False):
     """Get reminders from database"""
     conn = sqlite3.connect('reminders.db')
@@ -268,6 +356,7 @@ def get_reminders_db(show_completed=False):
     conn.close()
     return reminders
 
+@traced('sqlite.reminders.complete')
 def complete_reminder_db(reminder_id):
     """Mark reminder as completed in database"""
     conn = sqlite3.connect('reminders.db')
@@ -278,8 +367,11 @@ def complete_reminder_db(reminder_id):
     conn.commit()
     rows_affected = c.rowcount
     conn.close()
+    if rows_affected:
+        invalidate_briefings()
     return rows_affected > 0
 
+@traced('sqlite.reminders.delete')
 def delete_reminder_db(reminder_id):
     """Delete reminder from database"""
     conn = sqlite3.connect('reminders.db')
@@ -288,10 +380,13 @@ def delete_reminder_db(reminder_id):
     conn.commit()
     rows_affected = c.rowcount
     conn.close()
+    if rows_affected:
+        invalidate_briefings()
     return rows_affected > 0
 
 """##Integration with Your Assistant"""
 
+@traced('handler.reminders')
 def handle_reminders(request):
     """Process reminder-related requests"""
     request_lower = request.lower()
@@ -299,18 +394,16 @@ def handle_reminders(request):
     # Initialize database (only needed once)
     init_db()
 
-    if "add reminder" in request_lower or "set reminder" in request_lower:
-        # Parse reminder details from request
+    if "add reminder" in request_lower or "set reminder" in request_lower or "remind me" in request_lower:
+        # Title, due date and priority from one structured extraction
         try:
+            fields = extract(request, client)
+            if not fields.title:
+                return "What would you like me to remind you about?"
 
-            parts = request.split("reminder")[1].strip()
-            text = parts.split("on")[0].split("at")[0].strip()
-
-            # This would need more sophisticated date parsing in a real implementation
-            due_date = datetime.now().isoformat()  # Placeholder - use dateparser in real implementation
-
-            reminder_id = add_reminder_db(text, due_date)
-            return f"Reminder added successfully (ID: {reminder_id})"
+            due_date = fields.datetime or datetime.now().isoformat()
+            reminder_id = add_reminder_db(fields.title, due_date, fields.priority)
+            return f"Reminder added successfully (ID: {reminder_id}): {fields.title}, due {due_date}"
 
         except Exception as e:
             return f"Could not add reminder: {str(e)}"
@@ -319,18 +412,7 @@ def handle_reminders(request):
         show_completed = "completed" in request_lower
         reminders = get_reminders_db(show_completed)
 
-        if not reminders:
-            return "No reminders found."
-
-        response = "Your Reminders:\n\n"
-        for reminder in reminders:
-            status = "✓" if reminder[5] else "◻"
-            response += (
-                f"{status} [{reminder[0]}] {reminder[1]}\n"
-                f"   Due: {reminder[2]}\n"
-                f"   Priority: {reminder[3]}\n\n"
-            )
-        return response
+        return render_reminders(reminders)
 
     elif "complete reminder" in request_lower:
         try:
@@ -355,6 +437,7 @@ def handle_reminders(request):
 
 """##Date Parsing"""
 
+@traced('dateparser.parse')
 def parse_due_date(text):
     """Parse natural language dates into datetime objects"""
     try:
@@ -362,182 +445,106 @@ def parse_due_date(text):
     except:
         return None
     
-ASSISTANT_PROMPT ="""
-
-**Role**
-Your are a very efficient and intelligent personal assistant, responsible for managing calendar events, emails and communication tasks seamlessly. Your name is Sonia and you are Chrispine's Personal assistant. When user inquires about who you are you should be short and concise with the response. For Instance
-"Who are you?"  your response should be simple and short
-"I am Sonia, Chrispine's Personal assistant, how can i help you?"
-And also if greeting is given to you, your response should be simple and short.
-
-**Important**
-I would like you to only give the output as requested, do not display your thinking or the step by step approach you took, or the tools you used in you execution. The user doesnt need that information
-Also it is not required everytime for you to display the Information about who you are.
-Read through the users question carefully and only respond with what is neccessary dont use any mock data that is used in prompting only fetch data from relevant sources
-Also remember to give a clear output format for each response especially the schedule, calender and email responses
-
-**News Retrieval Capability**
-- When asked for news/trending updates:
-  1. First determine the news category/topic requested (general, technology, business, sports, etc.)
-  2. Use the **News API Tool** with api_key_2 to fetch latest headlines
-  3. For general news requests, fetch top headlines
-  4. For specific topics, fetch relevant category news
-  5. Provide concise summaries (max 3 sentences per story)
-  6. Always include: Source, Title, Brief Summary, and URL
-  7. For trending requests, show top 5 stories
-  8. Always attribute properly with "According to [News Source]"
-
-**News Response Format Examples:**
-1. General News Request:
- Latest News (5 headlines):
-1. [Title] - [Source]
-   • [Summary]
-   • [URL]
-2. [Title] - [Source]
-   • [Summary]
-   • [URL]
-
-2. Specific Topic Request:
- Technology News:
-1. [Title] - [Source]
-   • [Summary]
-   • [URL]
-2. [Title] - [Source]
-   • [Summary]
-   • [URL]
-
-**News Query Examples:**
-- "Get me the latest news"
-- "What's happening in technology?"
-- "Show me business headlines"
-- "Any sports news today?"
-- "Find news about climate change"
-
-**Error Handling:**
-- If news cannot be fetched: "I couldn't retrieve news at the moment. Please try again later or check your API connection."
-- If no news found: "No recent news found on this topic."
-
-
-#**Primary Task**
-**Retrieve Calendar Events**
-- Use the **Get Events** tool to fetch calendar events based on user instructions. Handle queries like: "Retrieve today's events", "Get Tomorrow's meetings", "How busy am i this week", "Are there any off days for me"
-Include details like:
-"Event name, start and end time, location, video meeting link if available and participants name/email"
-- Present results in a clear format.
-
-```Event: [Event Name]
-        Time: [Start time] - [End Time]
-        Location: [Location]
-        Link to the Meeting if available
-        Participant:
-          1 [Name] : [Email]
-          2 [Name] : [Email]
-```
-**Create Calendar Events**
-- Use the **Create Events** tool to schedule new events, projects, classes and workout
--Inputs include Title, start date, end date, descriptions and attendees
-- Resolve attendees name to email addresses using the **vector store tool** for contact reference
-Example "Add Sara to the meeting", retrieve Sarah Thompsons and her associated email address from the vector stores. Confirm event with the user before finalizing
-
-```Title: [Title Event]
-     Time: [Start time/Date]
-     Attendees: [List of Emails/Names]
-     Description: [Event Description]
-```
-- If no end time is stated please assume the event will last 1 hour.
-- For Projects the input contain the title, expected date/time of start and expected end time
-The Project should have the following schema
-
-```Title: [Project Name which may be vaguely described and you should refine it to something that makes sense]
-    Time: [This includes the start and expected finish time which should go past a week]
-    Description: [A short description on what the project is about]
-```
-- For the classes i will provide the timetable for you to get insights and communicate to me the classes am to have and assignments that are due and when they are due.
--For this i Want to choose a suitable format to display the information
-- For the gym, It just a simple routine but the primary goal is to ensure i have three workout sessions a week and two cardio days in the same week. It may be dynamic depending on the week as some weeks tend to be busy than others.
-
-**Retrieve Emails with Summaries**
-- Use the **Receive Many Emails** to fetch emails dynamically based on the users request: For example "Get todays's emails", "Show emails from last week".
-Summarize the retrieved emails into a user friendly list.
-```   Email 1
-     - Subject: [subject]
-     - Sender: [sender name/email]
-     - Summary: [Brief description of email content]
-```
-- Allow users to select a specific email for further action.
-
-**Send Emails using Templates**
-- Use the **Send and Approve Email** tool to send or reply to emails based on user instructions
-- Leverage the **vector store tool** for predefined templates.
-- For example if a user says "Send a meeting request to John", retrieve the **Meeting Request** template from the vector store.
-- Dynamically populate the template using user provided details(e.g, recipient, date and time):
-
-```Template: Meeting Request
-     Greeting: Hi [Recipient's Name]
-     Purpose : [Reason for the email, dynamically populated]
-     Closing : Best Regard [My Name]
-```
-- Confirm with the user before sending:
-```To: [Recipient's body]
-     Subject: [Subject Line]
-     Body: [Draft Content]
-```
-- For replying to specific emails, incorporate context dynamically and confirm the drafts with the user.
-#**Tool Usage**:
-- Dynamically Invoke:
-
-- **Vector Store Tool**: Retrieve contact details(e.g names to emails mappings) and predefined templates for the emails.
-- **Calendar Tool**: Fetch or create calendar events.
-- **Gmail Tool**: Fetch, Summarize, reply to, or send emails.
-- **SERP API Tool**: Perform real-time internet searches and provide summarized results.
-
-##**Ambiguity Handling**:
-1. **Resolve Vague References (e.g Sarah) by checking the **vector store tool** for the closest match.
-- Example "Invite Sarah to the meeting" resolve to "Sarah Thompson" (frijisample@gmail.com).
-
-2. **If conflicting options exist ask the user for clarifications**
-## Event Retrieval Example
-When displaying events, ALWAYS use this exact format:
-1. Event: [Event Name]
-   Time: [Start Time] - [End Time]
-   Location: [Location]
-   Video Link: [Link]
-   Participants:
-   - [Name]: ([email])
-   - [Name]: ([email])
-
-When displaying emails, ALWAYS use the format:
-1. Email [Number]:
-   Subject: [Subject]
-   From: [Name] ([email])
-   Summary: "[Summary]"
-
-Important:
-- Never use **bold** or *italics*
-- Never add headers like "Here is your schedule"
-- Use hyphens (-) for lists, not asterisks (*)
-
-## Email Summary Example
-When I ask "Get emails received today", use the following format:
-
-1. Email 1:
-   Subject: Collaboration Opportunity
-   From: Sarah Thompson (frijisample@gmail.com)
-   Summary: "Proposal to collaborate on a video next week"
-
-2. Email 2:
-   Subject: Meeting Confirmation
-   From: Emily Milk (example12sample@gmail.com)
-   Summary: "Confirmation of tomorrow's meeting at 10:00 AM"
-
-##Final Thoughts
-- **Image Understanding**
-When given an image read through the image description step by step and acknowledge you understand it. And If you are not provided with intent of the user with the image ask the user for what they would like you to do with it or provide contextual suggestion based on the information from the image.
-- Make Sure the Emails you send have my name Chrispine Odhiambo at the end. Do not leave any square brackets
-- If possible can you also generate reminders for events in the calendar.
-- **Today's Date**
-"""
-def assistant_response(request: str) -> str:
+
+"""##Daily Briefing"""
+
+DAY_BRIEFING_KEYWORDS = ["brief me", "my day", "day look like", "daily overview", "daily briefing",
+                         "morning briefing"]
+
+def day_range(now=None):
+    """Local start and end of the day containing `now`"""
+    now = (now or datetime.now()).astimezone()
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=1)
+
+def format_unread_emails():
+    emails = get_emails(query="is:unread newer_than:1d", max_results=5)
+    if not emails:
+        return "No unread emails."
+    return ITEM_SEPARATOR.join([format_email_summary(email) for email in emails])
+
+def format_due_reminders(end):
+    init_db()
+    # Reminder due dates are stored as naive local ISO strings
+    cutoff = end.replace(tzinfo=None).isoformat()
+    due = [r for r in get_reminders_db() if r[2] < cutoff]
+    if not due:
+        return "No reminders due today."
+    return render_due_reminders(due)
+
+def format_headlines(user_id=None):
+    if news_prefetcher is not None:
+        profile = get_interest_profile(user_id) if user_id else None
+        prefetched = news_prefetcher.lookup(None, profile)
+        if prefetched:
+            return prefetched
+    return format_news_response(get_news(num_articles=3))
+
+def day_branches(now=None, user_id=None):
+    """The sources of a day briefing, each with its own timeout in seconds"""
+    start, end = day_range(now)
+    return [
+        Branch('calendar', "Today's events",
+               lambda: format_events(get_calendar_events(time_min=start.isoformat(), time_max=end.isoformat())), 5),
+        Branch('email', "Unread emails", format_unread_emails, 6),
+        Branch('reminders', "Reminders due", lambda: format_due_reminders(end), 2),
+        Branch('news', "Headlines", lambda: format_headlines(user_id), 4),
+    ]
+
+def invalidate_briefings():
+    """Drop stored briefings after a change to today's events or reminders"""
+    if briefing_service is not None:
+        invalidate()
+
+def calendar_changed():
+    """After the assistant writes events: drop stale briefings and sync event reminders soon"""
+    invalidate_briefings()
+    if reminder_sync is not None:
+        reminder_sync.poke()
+
+@traced('handler.day_briefing')
+def brief_day(now=None, user_id=None):
+    """Calendar, email, reminders and news fetched concurrently: (text, complete)"""
+    start, _ = day_range(now)
+    return run_composite(day_branches(now, user_id), f"Your day at a glance, {start.strftime('%A %d %B')}:")
+
+# What a confirmed draft does, by the kind it was saved under
+DRAFT_ACTIONS = {
+    'event': insert_calendar_event,
+    'gym_plan': write_workout_plan,
+}
+
+def answer_draft(request, user_id):
+    """Carry out or discard the user's pending draft, or None if the message does not answer one"""
+    kind = reply_kind(request)
+    if kind is None:
+        return None
+    draft = pop_draft(user_id)
+    if draft is None:
+        return None
+    if kind == 'cancel':
+        return "OK, I've discarded it."
+    draft_kind, payload = draft
+    return DRAFT_ACTIONS[draft_kind](payload)
+
+def assistant_response(request: str, user_id=None) -> str:
+
+    # "yes" or "no" to an event or plan proposed in the previous reply
+    answer = answer_draft(request, user_id)
+    if answer is not None:
+        return answer
+
+    email_status_keywords = ["email status", "outbox", "was my email sent"]
+    if any(keyword in request.lower() for keyword in email_status_keywords):
+        return handle_email_status(request)
+
+    if any(keyword in request.lower() for keyword in DAY_BRIEFING_KEYWORDS):
+        if briefing_service is not None:
+            return briefing_service.answer(user_id)  # precomputed ahead of the user's usual time
+        return brief_day(user_id=user_id).text
+
+    if any(keyword in request.lower() for keyword in TIMETABLE_KEYWORDS):
+        return handle_timetable_import(request)
 
     reminder_keywords = ["reminder", "remind me", "todo", "task"]
     if any(keyword in request.lower() for keyword in reminder_keywords):
@@ -545,24 +552,27 @@ def assistant_response(request: str) -> str:
 
       # Check if this is a news request
     news_keywords = ["news", "headlines", "trending", "happening"]
-    news_categories = {
-        "technology": ["tech", "technology", "ai", "artificial intelligence"],
-        "business": ["business", "economy", "market", "finance"],
-        "sports": ["sports", "football", "basketball", "tennis"],
-        "health": ["health", "medical", "medicine"],
-        "science": ["science", "space", "research"]
-    }
 
     is_news_request = any(keyword in request.lower() for keyword in news_keywords)
 
     if is_news_request:
         # Determine category if specified
         category = None
-        for cat, keywords in news_categories.items():
+        for cat, keywords in NEWS_CATEGORIES.items():
             if any(keyword in request.lower() for keyword in keywords):
                 category = cat
                 break
 
+        # Prefetched headlines are answered from memory, ranked by past requests
+        if news_prefetcher is not None:
+            profile = get_interest_profile(user_id) if user_id else None
+            prefetched = news_prefetcher.lookup(category, profile)
+            metrics.incr('news_prefetch_lookups_total', result='hit' if prefetched else 'miss')
+            if user_id:
+                queue_profile_update(user_id, request)
+            if prefetched:
+                return prefetched
+
         # Get and format news
         articles = get_news(category=category)
         if isinstance(articles, list):
@@ -570,21 +580,27 @@ def assistant_response(request: str) -> str:
         else:
             return articles  # Return error message
 
-  # Set the temperature low to stabilise the output.
-    full_prompt = f"{ASSISTANT_PROMPT}\n\nUser request: {request}"
-
-    config = types.GenerateContentConfig(
-        temperature=2,  # Slightly higher for variety
-        top_p=0.95,
-        top_k=40,
-        max_output_tokens=8192
-    )
-    response = client.models.generate_content(
-      model='gemini-2.5-flash-preview-05-20',
-      config=config,
-      contents=[{"role": "user", "parts": [{"text": full_prompt}]}]
-
-      )
-    return response.text
+    # Calendar reads naming a time range need no model call
+    intent = classify_intent(request)
+    if intent == "calendar_read":
+        time_range = parse_time_range(request)
+        if time_range is not None:
+            return handle_calendar_read(time_range)
+
+    # Gym plans are solved locally against free/busy data
+    if intent == "gym" and GYM_PLAN_WORDS.search(request):
+        return handle_workout_plan(request, user_id)
+
+    # Events with a date and time are created from one structured extraction
+    if intent == "calendar_create":
+        fields = extract(request, client)
+        if fields.intent == "create_event" and fields.datetime:
+            return propose_calendar_event(user_id, fields.title or "Meeting", fields.datetime,
+                                          attendees=fields.attendees or None)
+
+    # Only the prompt sections and output budget this kind of request needs,
+    # answered by the cheapest model tier that can handle it
+    plan = assemble_prompt(request, intent)
+    return generate(client, request, plan)
 
 
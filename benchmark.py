@@ -0,0 +1,371 @@
+"""End-to-end latency benchmark for `assistant_response`.
+
+Replays a corpus of representative WhatsApp messages against recorded
+fixtures for NewsAPI, Google Calendar, Gmail and a fake Gemini client, with
+configurable injected latency for each upstream. Time is attributed to the
+upstream stages and to SQLite; whatever is left is routing and formatting.
+Results are reported as p50/p95/p99 per intent and requests per second per
+worker, and can be compared against a stored baseline.
+
+    python benchmark.py --iterations 20 --workers 4 --save-baseline benchmark_baseline.json
+    python benchmark.py --iterations 20 --workers 4 --baseline benchmark_baseline.json
+"""
+import argparse
+import contextvars
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from evaluate import FakeClient, percentiles
+
+CORPUS = [
+    ("greeting", "Hi Sonia"),
+    ("greeting", "Good morning!"),
+    ("identity", "Who are you?"),
+    ("reminder_add", "Add reminder to call home at 14:00 today"),
+    ("reminder_add", "Set reminder submit the assignment on Friday"),
+    ("reminder_list", "Show reminders"),
+    ("reminder_list", "List reminders including completed"),
+    ("news", "Get me the latest news"),
+    ("news", "What's happening in technology?"),
+    ("news", "Any sports news today?"),
+    ("email_status", "Email status"),
+    ("calendar_read", "Retrieve today's events"),
+    ("calendar_read", "How busy am I this week?"),
+    ("calendar_create", "Schedule a meeting with Sarah tomorrow at 10am about the budget"),
+    ("email_read", "Get today's emails"),
+    ("email_send", "Send a meeting request to John for Thursday at 3pm"),
+    ("planning", "Plan my gym sessions for this week, three workouts and two cardio days"),
+    ("briefing", "Brief me on my day"),
+    ("planning", "Create a project plan for the website redesign over the next three weeks"),
+]
+
+FIXTURE_ARTICLES = [
+    {"source": {"name": f"Source {i}"}, "title": f"Headline number {i}",
+     "description": f"Short description of story {i}.", "url": f"https://news.example.com/{i}",
+     "publishedAt": "2025-06-01T08:00:00Z"}
+    for i in range(20)
+]
+
+FIXTURE_EVENTS = [
+    {"id": f"evt{i}", "summary": f"Meeting {i}", "htmlLink": f"https://calendar.example.com/{i}",
+     "location": "Room 1", "start": {"dateTime": f"2025-06-02T{9 + i:02d}:00:00Z"},
+     "end": {"dateTime": f"2025-06-02T{9 + i:02d}:30:00Z"},
+     "attendees": [{"email": "sarah@example.com"}, {"email": "john@example.com"}]}
+    for i in range(6)
+]
+
+FIXTURE_MESSAGES = [
+    {"id": f"msg{i}", "threadId": f"thr{i}", "internalDate": "1748764800000",
+     "payload": {"headers": [{"name": "Subject", "value": f"Subject {i}"},
+                             {"name": "From", "value": "Sarah Thompson <sarah@example.com>"},
+                             {"name": "To", "value": "me@example.com"}]}}
+    for i in range(5)
+]
+
+
+"""##Stage Timing"""
+
+# The current request's stage timings. A context variable rather than a
+# thread-local, so branches that run on executor threads through
+# `contextvars.copy_context().run` add to the request that started them.
+_stage_timings = contextvars.ContextVar('benchmark_stage_timings', default=None)
+_stage_lock = threading.Lock()
+
+
+class timed_stage:
+    """Add the time spent inside the block to a stage of the current request"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        timings = _stage_timings.get()
+        if timings is not None:
+            with _stage_lock:
+                timings[self.name] += time.perf_counter() - self.start
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        with timed_stage('sqlite'):
+            return super().execute(*args)
+
+    def fetchall(self):
+        with timed_stage('sqlite'):
+            return super().fetchall()
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        with timed_stage('sqlite'):
+            return super().execute(*args)
+
+    def commit(self):
+        with timed_stage('sqlite'):
+            return super().commit()
+
+
+_connect = sqlite3.connect
+
+
+def timed_connect(*args, **kwargs):
+    kwargs.setdefault('factory', TimedConnection)
+    with timed_stage('sqlite'):
+        return _connect(*args, **kwargs)
+
+
+"""##Fake Upstreams"""
+
+class Latency:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def wait(self, stage):
+        with timed_stage(stage):
+            if self.seconds:
+                time.sleep(self.seconds)
+
+
+class FakeRequest:
+    def __init__(self, latency, stage, result):
+        self.latency = latency
+        self.stage = stage
+        self.result = result
+
+    def execute(self):
+        self.latency.wait(self.stage)
+        return self.result
+
+
+class FakeBatch:
+    """One round trip for all the requests added to it"""
+
+    def __init__(self, latency, callback):
+        self.latency = latency
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.latency.wait('google')
+        for request_id, request in self.requests:
+            self.callback(request_id, request.result, None)
+
+
+class FakeResource:
+    """Answers any chain like service.users().messages().list(...).execute()"""
+
+    def __init__(self, latency, handlers, path=()):
+        self.latency = latency
+        self.handlers = handlers
+        self.path = path
+
+    def __getattr__(self, name):
+        if name == 'new_batch_http_request':
+            return lambda callback: FakeBatch(self.latency, callback)
+
+        def call(*args, **kwargs):
+            path = self.path + (name,)
+            handler = self.handlers.get('.'.join(path))
+            if handler is not None:
+                return FakeRequest(self.latency, 'google', handler(**kwargs))
+            return FakeResource(self.latency, self.handlers, path)
+        return call
+
+
+def fake_calendar_service(latency):
+    return FakeResource(latency, {
+        'events.list': lambda **kwargs: {'items': [] if kwargs.get('privateExtendedProperty') else FIXTURE_EVENTS},
+        'events.insert': lambda body, **kwargs: dict(body, id='new', htmlLink='https://calendar.example.com/new'),
+        'events.delete': lambda **kwargs: '',
+        'freebusy.query': lambda body, **kwargs: {'calendars': {'primary': {'busy': [
+            {'start': e['start']['dateTime'], 'end': e['end']['dateTime']} for e in FIXTURE_EVENTS]}}},
+    })
+
+
+def fake_gmail_service(latency):
+    by_id = {m['id']: m for m in FIXTURE_MESSAGES}
+    return FakeResource(latency, {
+        'users.messages.list': lambda **kwargs: {'messages': [{'id': m['id']} for m in FIXTURE_MESSAGES]},
+        'users.messages.get': lambda id, **kwargs: by_id[id],
+        'users.messages.send': lambda body, **kwargs: {'id': 'sent'},
+        'users.getProfile': lambda **kwargs: {'emailAddress': 'me@example.com'},
+    })
+
+
+class FakeNewsResponse:
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'status': 'ok', 'articles': FIXTURE_ARTICLES}
+
+
+class TimedFakeClient(FakeClient):
+    def sleep(self):
+        with timed_stage('gemini'):
+            super().sleep()
+
+    def structured(self, contents, schema):
+        """Extraction answers as the model would give them, taken from the local parser"""
+        from extraction import local_extract
+        from timerange import user_timezone
+
+        prompt = contents[0]['parts'][0]['text']
+        request = prompt.rpartition("Message: ")[2]
+        fields = local_extract(request, datetime.now(user_timezone()))._asdict()
+        return {name: fields[name] for name in schema['properties']}
+
+
+def install_fakes(assistant, gemini_latency, google_latency, news_latency):
+    """Point the assistant's globals at fakes with the given latencies"""
+    from google_pool import ServicePool
+    from news import NewsClient
+
+    assistant.client = TimedFakeClient(latency=gemini_latency, jitter=gemini_latency / 5)
+    assistant.calendar_pool = ServicePool(lambda: fake_calendar_service(Latency(google_latency)), 'calendar')
+    assistant.gmail_pool = ServicePool(lambda: fake_gmail_service(Latency(google_latency)), 'gmail')
+    news_client = NewsClient('benchmark')
+
+    def fake_get(url, params=None, timeout=None):
+        time.sleep(news_latency)
+        return FakeNewsResponse()
+
+    # Upstream fetches run on the client's own threads, so time the wait in the caller
+    cached_get = news_client.get
+
+    def timed_get(*args, **kwargs):
+        with timed_stage('newsapi'):
+            return cached_get(*args, **kwargs)
+
+    news_client.session.get = fake_get
+    news_client.get = timed_get
+    assistant.news_client = news_client
+    assistant.news_prefetcher = None
+
+
+"""##Running the Benchmark"""
+
+def run_request(assistant, intent, message):
+    timings = defaultdict(float)
+    token = _stage_timings.set(timings)
+    try:
+        start = time.perf_counter()
+        assistant.assistant_response(message, user_id='benchmark')
+        total = time.perf_counter() - start
+    finally:
+        _stage_timings.reset(token)
+    with _stage_lock:
+        stages = dict(timings)
+    stages['routing'] = max(0.0, total - sum(stages.values()))
+    return intent, total, stages
+
+
+def run_benchmark(assistant, corpus, iterations, workers):
+    requests = [item for _ in range(iterations) for item in corpus]
+    latencies = defaultdict(list)
+    stages = defaultdict(lambda: defaultdict(float))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for intent, total, timings in pool.map(lambda item: run_request(assistant, *item), requests):
+            latencies[intent].append(total)
+            for stage, seconds in timings.items():
+                stages[intent][stage] += seconds
+    elapsed = time.perf_counter() - start
+
+    report = {'workers': workers, 'requests': len(requests),
+              'requests_per_second_per_worker': len(requests) / elapsed / workers,
+              'intents': {}}
+    for intent, values in sorted(latencies.items()):
+        report['intents'][intent] = {
+            'count': len(values),
+            **{k: v * 1000 for k, v in percentiles(values, (50, 95, 99)).items()},
+            'stages_ms': {stage: seconds / len(values) * 1000 for stage, seconds in sorted(stages[intent].items())},
+        }
+    return report
+
+
+def compare(report, baseline, tolerance, min_delta_ms):
+    """Intents whose p95 got slower than the baseline by more than the tolerance"""
+    regressions = []
+    for intent, current in report['intents'].items():
+        previous = baseline['intents'].get(intent)
+        if previous is None:
+            continue
+        limit = max(previous['p95'] * (1 + tolerance), previous['p95'] + min_delta_ms)
+        if current['p95'] > limit:
+            regressions.append(f"{intent}: p95 {current['p95']:.1f} ms vs baseline {previous['p95']:.1f} ms")
+    base_rps = baseline.get('requests_per_second_per_worker')
+    if base_rps and report['requests_per_second_per_worker'] < base_rps / (1 + tolerance):
+        regressions.append(f"throughput: {report['requests_per_second_per_worker']:.1f} req/s/worker "
+                           f"vs baseline {base_rps:.1f}")
+    return regressions
+
+
+def print_report(report):
+    print(f"{report['requests']} requests, {report['workers']} workers, "
+          f"{report['requests_per_second_per_worker']:.1f} req/s per worker")
+    print(f"{'intent':<16}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  stages (mean ms)")
+    for intent, row in report['intents'].items():
+        stages = ", ".join(f"{stage} {ms:.1f}" for stage, ms in row['stages_ms'].items() if ms >= 0.05)
+        print(f"{intent:<16}{row['count']:>5}{row['p50']:>10.1f}{row['p95']:>10.1f}{row['p99']:>10.1f}  {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark assistant_response against recorded fixtures")
+    parser.add_argument('--iterations', type=int, default=10, help="passes over the corpus")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--gemini-latency', type=float, default=0.8, help="seconds per model call")
+    parser.add_argument('--google-latency', type=float, default=0.15, help="seconds per Google API call")
+    parser.add_argument('--news-latency', type=float, default=0.3, help="seconds per NewsAPI call")
+    parser.add_argument('--baseline', help="baseline JSON to compare against")
+    parser.add_argument('--save-baseline', help="write this run's report to a baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative p95 slowdown")
+    parser.add_argument('--min-delta-ms', type=float, default=2.0, help="ignore p95 changes below this")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    save_path = os.path.abspath(args.save_baseline) if args.save_baseline else None
+
+    import assistant
+    install_fakes(assistant, args.gemini_latency, args.google_latency, args.news_latency)
+    sqlite3.connect = timed_connect
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)  # keep the SQLite files of the run out of the repository
+        report = run_benchmark(assistant, CORPUS, args.iterations, args.workers)
+    report['settings'] = {k: getattr(args, k) for k in ('gemini_latency', 'google_latency', 'news_latency')}
+    print_report(report)
+
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    if baseline:
+        regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
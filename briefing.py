@@ -0,0 +1,180 @@
+"""Precomputed morning briefings.
+
+Every briefing request is recorded, and a user's usual briefing time is the
+median time of day of their recent requests. A background job builds each
+user's briefing ahead of that time and stores it, so the morning request is
+answered from SQLite. Build times are staggered per user, so upstream calls
+are spread out instead of all landing at 7am.
+
+Anything that changes the day's data (a new event, a reminder added or
+completed) calls `invalidate`. Stale briefings are rebuilt by the job while
+there is still time before the user's usual time; otherwise the next request
+builds one live and stores it. A briefing with a section that timed out or
+failed is kept for `PARTIAL_MAX_AGE` only, so the next request or job run
+builds it again instead of serving the gap for hours.
+"""
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from statistics import median
+
+from tracing import metrics
+
+BRIEFING_DB = 'briefings.db'
+
+LEAD_MINUTES = 30      # build this long before the usual time at the latest
+SPREAD_MINUTES = 60    # extra per-user offset so builds do not coincide
+HISTORY_DAYS = 14      # requests considered for the usual time
+MIN_REQUESTS = 2       # requests needed before a user gets precomputed briefings
+MAX_AGE = timedelta(hours=3)
+PARTIAL_MAX_AGE = timedelta(minutes=2)  # for briefings with a missing section
+CHECK_INTERVAL = 60    # seconds between scheduler passes
+
+
+def init_briefing_db():
+    """Initialize the briefing tables"""
+    conn = sqlite3.connect(BRIEFING_DB)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS briefing_requests
+                 (user_id TEXT NOT NULL,
+                  requested_at TEXT NOT NULL)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS briefing_requests_user
+                 ON briefing_requests (user_id, requested_at)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS briefings
+                 (user_id TEXT PRIMARY KEY,
+                  day TEXT NOT NULL,
+                  text TEXT NOT NULL,
+                  built_at TEXT NOT NULL,
+                  stale INTEGER DEFAULT 0,
+                  expires_at TEXT)''')
+    if 'expires_at' not in [row[1] for row in c.execute('PRAGMA table_info(briefings)')]:
+        c.execute('ALTER TABLE briefings ADD COLUMN expires_at TEXT')
+    conn.commit()
+    conn.close()
+
+
+def record_request(user_id, now=None):
+    now = now or datetime.now()
+    conn = sqlite3.connect(BRIEFING_DB)
+    conn.execute('INSERT INTO briefing_requests (user_id, requested_at) VALUES (?, ?)',
+                 (user_id, now.isoformat()))
+    conn.execute('DELETE FROM briefing_requests WHERE requested_at < ?',
+                 ((now - timedelta(days=HISTORY_DAYS)).isoformat(),))
+    conn.commit()
+    conn.close()
+
+
+def usual_times(now=None):
+    """{user_id: minutes after midnight} for users with enough recent requests"""
+    now = now or datetime.now()
+    conn = sqlite3.connect(BRIEFING_DB)
+    rows = conn.execute('SELECT user_id, requested_at FROM briefing_requests WHERE requested_at >= ?',
+                        ((now - timedelta(days=HISTORY_DAYS)).isoformat(),)).fetchall()
+    conn.close()
+    minutes = {}
+    for user_id, requested_at in rows:
+        at = datetime.fromisoformat(requested_at)
+        minutes.setdefault(user_id, []).append(at.hour * 60 + at.minute)
+    return {user_id: int(median(values)) for user_id, values in minutes.items() if len(values) >= MIN_REQUESTS}
+
+
+def build_minute(user_id, usual):
+    """When a user's briefing is built, in minutes after midnight"""
+    offset = int(hashlib.sha1(str(user_id).encode()).hexdigest(), 16) % SPREAD_MINUTES
+    return max(0, usual - LEAD_MINUTES - offset)
+
+
+def get_briefing(user_id, now=None):
+    """Today's stored briefing for a user if it is still current, else None"""
+    now = now or datetime.now()
+    conn = sqlite3.connect(BRIEFING_DB)
+    row = conn.execute('SELECT day, text, built_at, stale, expires_at FROM briefings WHERE user_id = ?',
+                       (user_id,)).fetchone()
+    conn.close()
+    if row is None or row[3] or row[0] != now.date().isoformat():
+        return None
+    expires_at = datetime.fromisoformat(row[4]) if row[4] else datetime.fromisoformat(row[2]) + MAX_AGE
+    if now > expires_at:
+        return None
+    return row[1]
+
+
+def store_briefing(user_id, text, now=None, complete=True):
+    """Store a briefing; one missing a section expires after PARTIAL_MAX_AGE"""
+    now = now or datetime.now()
+    expires_at = now + (MAX_AGE if complete else PARTIAL_MAX_AGE)
+    conn = sqlite3.connect(BRIEFING_DB)
+    conn.execute('''INSERT OR REPLACE INTO briefings (user_id, day, text, built_at, stale, expires_at)
+                    VALUES (?, ?, ?, ?, 0, ?)''',
+                 (user_id, now.date().isoformat(), text, now.isoformat(), expires_at.isoformat()))
+    conn.commit()
+    conn.close()
+
+
+def invalidate(user_id=None):
+    """Mark stored briefings stale, for one user or everyone"""
+    conn = sqlite3.connect(BRIEFING_DB)
+    if user_id is None:
+        conn.execute('UPDATE briefings SET stale = 1')
+    else:
+        conn.execute('UPDATE briefings SET stale = 1 WHERE user_id = ?', (user_id,))
+    conn.commit()
+    conn.close()
+    metrics.incr('briefing_invalidations_total')
+
+
+class BriefingService:
+    """Answers briefing requests and precomputes them ahead of each user's usual time"""
+
+    def __init__(self, build, interval=CHECK_INTERVAL):
+        self.build = build  # build(user_id) -> (text, complete), e.g. a composite.Composite
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        init_briefing_db()
+
+    def answer(self, user_id):
+        """The stored briefing when current, otherwise one built now"""
+        user_id = user_id or 'default'
+        record_request(user_id)
+        text = get_briefing(user_id)
+        metrics.incr('briefing_requests_total', result='precomputed' if text else 'live')
+        if text is None:
+            text, complete = self.build(user_id)
+            store_briefing(user_id, text, complete=complete)
+        return text
+
+    def due(self, now=None):
+        """Users whose briefing should be built now"""
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        return [user_id for user_id, usual in usual_times(now).items()
+                if build_minute(user_id, usual) <= minute < usual and get_briefing(user_id, now) is None]
+
+    def run_once(self, now=None):
+        for user_id in self.due(now):
+            try:
+                text, complete = self.build(user_id)
+                store_briefing(user_id, text, complete=complete)
+                metrics.incr('briefing_builds_total', outcome='ok' if complete else 'partial')
+            except Exception as e:
+                metrics.incr('briefing_builds_total', outcome='error')
+                print(f"Briefing for {user_id} failed: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Briefing scheduler failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='briefings', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,290 @@
+"""Bulk import of timetables and plans into Google Calendar.
+
+A timetable comes as CSV, JSON or plain text lines. Classes that repeat
+every week become one recurring event with an RRULE instead of one event
+per occurrence, and all events are inserted through Google batch requests
+of up to 50 calls each. Each insert succeeds or fails on its own; failures
+are reported per event and the rest of the import goes ahead.
+
+Rows have a title, a day (a weekday for weekly classes or a date for
+one-off events such as deadlines), start and end times, and optionally a
+location and description:
+
+    title,day,start,end,location
+    Calculus I,Monday,09:00,11:00,Room 101
+    Calculus I,Wednesday,09:00,11:00,Room 101
+    Project report due,2026-11-20,17:00,17:30,
+
+    Monday 09:00-11:00 Calculus I @ Room 101
+    Tuesday 14:00-15:00 Seminar in Economics in Room 5
+
+In text lines the place follows "@" or ",", or a trailing "in" that names a
+room ("in Room 5", "in B12"), so "in" inside a title stays in the title.
+Text lines in any other form are skipped and their numbers reported.
+
+From the command line, with credentials from `python credentials.py`:
+
+    python calendar_import.py timetable.csv --start 2026-09-07 --weeks 15
+"""
+import argparse
+import csv
+import io
+import json
+import re
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, time, timedelta, timezone
+
+from timerange import DEFAULT_TIMEZONE, WEEKDAYS, user_timezone, user_timezone_name
+from tracing import metrics, span
+
+BATCH_SIZE = 50   # Calendar API limit for calls per batch
+TERM_WEEKS = 15
+
+Entry = namedtuple("Entry", "title day start end location description")
+Timetable = namedtuple("Timetable", "entries skipped")
+ImportResult = namedtuple("ImportResult", "created failed skipped", defaults=((),))
+
+RRULE_DAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+TEXT_LINE = re.compile(
+    r"^\s*(?P<day>[A-Za-z]+|\d{4}-\d{2}-\d{2})[\s,]+"
+    r"(?P<start>\d{1,2}[:.]\d{2})\s*(?:-|–|to)\s*(?P<end>\d{1,2}[:.]\d{2})[\s,:-]+"
+    r"(?P<title>.+?)(?:\s*[@,]\s*(?P<location>[^,]+)"
+    r"|\s+in\s+(?P<room>(?i:room|hall|lab|building|theatre|auditorium)\b[^,@]*|[A-Za-z]{0,3}-?\d[\w.-]*))?\s*$")
+REQUIRED = ("title", "day", "start", "end")
+
+
+"""##Parsing Timetables"""
+
+def _time(value):
+    match = re.fullmatch(r"(\d{1,2})[:.](\d{2})", value.strip())
+    if not match:
+        raise ValueError(f"Unknown time {value!r}")
+    return time(int(match.group(1)), int(match.group(2))).strftime("%H:%M")  # rejects 25:00
+
+
+def _day(value):
+    """A weekday index for weekly entries or a date for one-off entries"""
+    value = value.strip()
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+        return date.fromisoformat(value)
+    for index, name in enumerate(WEEKDAYS):
+        if name.startswith(value.lower()[:3]):
+            return index
+    raise ValueError(f"Unknown day {value!r}")
+
+
+def _entry(row, number):
+    """An Entry for one row; ValueError naming the row when a field is missing or unreadable"""
+    if not isinstance(row, dict):
+        raise ValueError(f"row {number} is not a table row")
+    row = {str(key).strip().lower(): str(value if value is not None else "").strip()
+           for key, value in row.items() if key}
+    fields = {
+        'title': row.get('title') or row.get('summary') or row.get('class') or row.get('subject'),
+        'day': row.get('day') or row.get('date'),
+        'start': row.get('start'),
+        'end': row.get('end'),
+    }
+    missing = [name for name in REQUIRED if not fields[name]]
+    if missing:
+        raise ValueError(f"row {number} has no {' or '.join(missing)}")
+    try:
+        return Entry(
+            title=fields['title'],
+            day=_day(fields['day']),
+            start=_time(fields['start']),
+            end=_time(fields['end']),
+            location=row.get('location') or row.get('room') or "",
+            description=row.get('description') or row.get('notes') or "",
+        )
+    except ValueError as e:
+        raise ValueError(f"row {number}: {e}") from None
+
+
+def parse_timetable(source, format=None):
+    """A Timetable of entries from CSV, JSON or text and the numbers of unreadable text lines
+
+    The format is guessed when not given.
+    """
+    text = source.strip()
+    if format is None:
+        if text.startswith(('[', '{')):
+            format = 'json'
+        elif text.splitlines()[0].count(',') >= 3 and 'title' in text.splitlines()[0].lower():
+            format = 'csv'
+        else:
+            format = 'text'
+
+    if format == 'json':
+        data = json.loads(text)
+        rows = data.get('events', data.get('classes', [])) if isinstance(data, dict) else data
+        return Timetable([_entry(row, n) for n, row in enumerate(rows, 1)], [])
+    if format == 'csv':
+        return Timetable([_entry(row, n) for n, row in enumerate(csv.DictReader(io.StringIO(text)), 1)], [])
+
+    entries, skipped = [], []
+    for n, line in enumerate(text.splitlines(), 1):
+        match = TEXT_LINE.match(line)
+        if match:
+            entries.append(_entry(match.groupdict(), n))
+        elif line.strip():
+            skipped.append(n)
+    return Timetable(entries, skipped)
+
+
+"""##Building Events"""
+
+def _first_on_or_after(start, weekday):
+    return start + timedelta(days=(weekday - start.weekday()) % 7)
+
+
+def _until(term_end, tz):
+    """RRULE UNTIL for the end of the term's last day in the user's timezone, in UTC"""
+    last = datetime.combine(term_end, time(23, 59, 59), tz)
+    return last.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def build_events(entries, term_start, weeks=TERM_WEEKS, timezone=None):
+    """Calendar event bodies; weekly entries sharing title, times and place become one recurring event
+
+    Times carry the UTC offset of the user's timezone, and its IANA name,
+    which the API needs to expand recurrences, falls back to DEFAULT_TIMEZONE.
+    """
+    timezone = timezone or user_timezone_name() or DEFAULT_TIMEZONE
+    tz = user_timezone(timezone)
+    term_end = term_start + timedelta(weeks=weeks) - timedelta(days=1)
+    until = _until(term_end, tz)
+
+    weekly = OrderedDict()
+    events = []
+    for entry in entries:
+        if isinstance(entry.day, int):
+            key = (entry.title, entry.start, entry.end, entry.location, entry.description)
+            weekly.setdefault(key, set()).add(entry.day)
+        else:
+            events.append(_event(entry.title, entry.day, entry.start, entry.end, entry.location,
+                                 entry.description, tz, timezone))
+
+    for (title, start, end, location, description), days in weekly.items():
+        first = min(_first_on_or_after(term_start, day) for day in days)
+        event = _event(title, first, start, end, location, description, tz, timezone)
+        byday = ",".join(RRULE_DAYS[day] for day in sorted(days))
+        event['recurrence'] = [f"RRULE:FREQ=WEEKLY;BYDAY={byday};UNTIL={until}"]
+        events.append(event)
+    return events
+
+
+def _moment(day, clock, tz, timezone):
+    return {'dateTime': datetime.combine(day, time.fromisoformat(clock), tz).isoformat(), 'timeZone': timezone}
+
+
+def _event(title, day, start, end, location, description, tz, timezone):
+    event = {
+        'summary': title,
+        'start': _moment(day, start, tz, timezone),
+        'end': _moment(day, end, tz, timezone),
+    }
+    if location:
+        event['location'] = location
+    if description:
+        event['description'] = description
+    return event
+
+
+"""##Batch Insert"""
+
+def insert_events(calendar_service, events, calendar_id='primary'):
+    """Insert events in batches; one failure does not stop the others"""
+    created, failed = [], []
+
+    def collect(request_id, response, exception):
+        event = events[int(request_id)]
+        if exception is not None:
+            failed.append((event, str(exception)))
+        else:
+            created.append(response)
+
+    for start in range(0, len(events), BATCH_SIZE):
+        batch = calendar_service.new_batch_http_request(callback=collect)
+        for n in range(start, min(start + BATCH_SIZE, len(events))):
+            batch.add(calendar_service.events().insert(calendarId=calendar_id, body=events[n]),
+                      request_id=str(n))
+        with span('google.calendar.batch_insert', events=min(BATCH_SIZE, len(events) - start)):
+            batch.execute()
+
+    metrics.incr('calendar_import_events_total', len(created), outcome='created')
+    metrics.incr('calendar_import_events_total', len(failed), outcome='failed')
+    return ImportResult(created, failed)
+
+
+def delete_events(calendar_service, event_ids, calendar_id='primary'):
+    """Delete events by id in batches; ids that could not be deleted, with the error"""
+    failed = []
+
+    def collect(request_id, response, exception):
+        if exception is not None:
+            failed.append((event_ids[int(request_id)], str(exception)))
+
+    for start in range(0, len(event_ids), BATCH_SIZE):
+        batch = calendar_service.new_batch_http_request(callback=collect)
+        for n in range(start, min(start + BATCH_SIZE, len(event_ids))):
+            batch.add(calendar_service.events().delete(calendarId=calendar_id, eventId=event_ids[n]),
+                      request_id=str(n))
+        with span('google.calendar.batch_delete', events=min(BATCH_SIZE, len(event_ids) - start)):
+            batch.execute()
+    return failed
+
+
+def import_timetable(calendar_pool, source, term_start=None, weeks=TERM_WEEKS, format=None):
+    """Parse a timetable and insert it
+
+    An ImportResult of created events, (event, error) failures and skipped text lines.
+    """
+    term_start = term_start or date.today()
+    timetable = parse_timetable(source, format)
+    events = build_events(timetable.entries, term_start, weeks)
+    with calendar_pool.checkout() as calendar_service:
+        result = insert_events(calendar_service, events) if events else ImportResult([], [])
+    return result._replace(skipped=timetable.skipped)
+
+
+def format_skipped(skipped):
+    if not skipped:
+        return ""
+    return (f"Skipped line{'s' if len(skipped) > 1 else ''} {', '.join(map(str, skipped))}: "
+            "write them as \"Monday 09:00-11:00 Calculus I @ Room 101\".")
+
+
+def format_import_result(result):
+    lines = [f"Added {len(result.created)} event(s) to your calendar."]
+    for event in result.created:
+        rule = " (weekly)" if event.get('recurrence') else ""
+        lines.append(f"• {event['summary']}{rule}: {event['start']['dateTime'][:16].replace('T', ' ')}")
+    if result.failed:
+        lines.append(f"\n{len(result.failed)} event(s) could not be added:")
+        for event, error in result.failed:
+            lines.append(f"• {event['summary']}: {error}")
+    if result.skipped:
+        lines.append("\n" + format_skipped(result.skipped))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a timetable into Google Calendar")
+    parser.add_argument('file', help="CSV, JSON or text timetable")
+    parser.add_argument('--format', choices=['csv', 'json', 'text'])
+    parser.add_argument('--start', type=date.fromisoformat, default=date.today(), help="first day of term")
+    parser.add_argument('--weeks', type=int, default=TERM_WEEKS, help="length of term in weeks")
+    args = parser.parse_args()
+
+    from credentials import get_credential_manager
+    from google_pool import ServicePool
+
+    pool = ServicePool.for_api('calendar', 'v3', get_credential_manager().get(), size=1)
+    with open(args.file) as f:
+        result = import_timetable(pool, f.read(), args.start, args.weeks, args.format)
+    print(format_import_result(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Concurrent fan-out for requests that need several sources at once.
+
+A composite request such as "brief me on my day" is split into branches
+(calendar, email, reminders, news). All branches start together on a shared
+thread pool and each has its own timeout, so the reply takes as long as the
+slowest branch rather than the sum of them. A branch that fails or runs out
+of time is reported as unavailable and the other sections are still sent;
+the result says whether every branch answered, so callers can avoid keeping
+a degraded reply.
+"""
+import contextvars
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from tracing import metrics, span
+
+# fetch() returns the formatted text of one section
+Branch = namedtuple("Branch", "name title fetch timeout")
+# complete is False when any branch timed out or failed
+Composite = namedtuple("Composite", "text complete")
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="composite")
+
+
+def _run_branch(branch):
+    with span(f'composite.{branch.name}'):
+        return branch.fetch()
+
+
+def fan_out(branches):
+    """(branch, text, outcome) for every branch, in the given order"""
+    start = time.monotonic()
+    futures = [_executor.submit(contextvars.copy_context().run, _run_branch, branch) for branch in branches]
+
+    results = []
+    for branch, future in zip(branches, futures):
+        # Every branch is measured from the common start, so the waits overlap
+        remaining = branch.timeout - (time.monotonic() - start)
+        try:
+            text, outcome = future.result(timeout=max(0.0, remaining)), 'ok'
+        except TimeoutError:
+            text, outcome = None, 'timeout'
+        except Exception as e:
+            print(f"{branch.name} branch failed: {e}")
+            text, outcome = None, 'error'
+        metrics.incr('composite_branch_total', branch=branch.name, outcome=outcome)
+        results.append((branch, text, outcome))
+    return results
+
+
+def merge(results, header):
+    """One reply with a section per branch"""
+    sections = [header]
+    for branch, text, outcome in results:
+        if outcome == 'timeout':
+            text = f"{branch.title} are taking too long to load, ask me again in a moment."
+        elif outcome == 'error':
+            text = f"{branch.title} are not available right now."
+        sections.append(f"{branch.title}\n{text.strip()}")
+    return "\n\n".join(sections)
+
+
+def run_composite(branches, header):
+    """The merged reply, and whether every branch answered"""
+    results = fan_out(branches)
+    return Composite(merge(results, header), all(outcome == 'ok' for _, _, outcome in results))
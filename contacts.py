@@ -0,0 +1,619 @@
+"""Vector store for resolving contact names to email addresses.
+
+Every contact is indexed under several aliases: the full name, each part of
+the name, nicknames and the email local-part. A trigram index answers most
+lookups ("Sara" -> "Sarah Thompson") without touching the embedding model;
+queries with no close trigram match fall back to a FAISS search over
+embeddings of the aliases from the shared embedding service.
+
+Trigram matches are scored by the Dice similarity of the trigram sets and
+embedding matches by cosine similarity, each with its own threshold, so an
+unknown name does not resolve to an unrelated contact. Several contacts
+matching about equally well ("John" with three Johns) are reported as
+ambiguous rather than settled by insertion order, so the assistant can ask.
+
+Contacts are harvested from Gmail correspondents and the People API by
+`sync_contacts` and stored in SQLite next to a FAISS index saved through
+`index_store`, which is memory-mapped on first use instead of being
+re-embedded.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from email.utils import getaddresses
+
+import faiss
+import numpy as np
+
+from embeddings import get_embedding_service
+from index_store import get_index_manager, writable_copy
+
+CONTACTS_DB = 'contacts.db'
+CONTACTS_INDEX = 'contacts'  # name under the shared index manager
+
+ALIAS_SLOTS = 16  # alias vector ids are contact_id * ALIAS_SLOTS + n
+
+STRONG_MATCH = 0.75      # trigram score that is trusted without embedding the query
+TRIGRAM_MIN = 0.6        # Dice similarity of trigram sets below which an alias is no match
+VECTOR_MIN = 0.7         # cosine similarity below which an embedding match is no match
+AMBIGUITY_MARGIN = 0.1   # matches this close to the best one make a lookup ambiguous
+MAX_CANDIDATES = 3       # contacts offered for an ambiguous name
+FALLBACK_CACHE_SIZE = 1024
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def normalize(text):
+    return _NON_ALNUM.sub(' ', text.lower()).strip()
+
+
+def trigrams(text):
+    padded = f" {normalize(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def contact_aliases(name, email, nicknames=()):
+    """Strings a contact may be referred to by"""
+    aliases = [name]
+    parts = normalize(name).split()
+    if len(parts) > 1:
+        aliases.extend(parts)
+    aliases.extend(nicknames)
+    if email:
+        aliases.append(email.split('@')[0].replace('.', ' ').replace('_', ' '))
+    seen = set()
+    unique = []
+    for alias in aliases:
+        key = normalize(alias)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(key)
+    return unique
+
+
+class ContactStore:
+    def __init__(self, embedder=None):
+        self._embedder = embedder
+        self.index = None
+        self.contacts = {}          # contact id -> (name, email)
+        self._by_email = {}         # email -> contact id
+        self._alias_owner = {}      # alias id -> contact id
+        self._alias_trigrams = {}   # alias id -> trigram set
+        self._alias_sizes = np.zeros(ALIAS_SLOTS * 64, dtype='int32')  # alias id -> trigram count
+        self._contact_aliases = defaultdict(list)
+        self._postings = defaultdict(set)  # trigram -> alias ids
+        self._posting_arrays = {}          # trigram -> alias ids as an array, built on demand
+        self._fallback_cache = OrderedDict()  # normalized query -> embedding matches
+        self._next_contact = 0
+        self._mapped = False
+        self.version = None  # file version of the index this store was loaded from
+        self.lock = threading.RLock()
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = get_embedding_service()
+        return self._embedder
+
+    def _encode(self, texts):
+        return self.embedder.encode(texts)
+
+    def _writable_index(self, dim):
+        if self.index is None:
+            # 8-bit codes over [-1, 1] for unit vectors: a quarter of the memory
+            # of float32 vectors and about half the scan time, still mappable
+            codes = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit_uniform,
+                                               faiss.METRIC_INNER_PRODUCT)
+            codes.train(np.array([[-1.0] * dim, [1.0] * dim], dtype='float32'))
+            self.index = faiss.IndexIDMap2(codes)
+        elif self._mapped:
+            # Copy the memory-mapped index before the first modification
+            self.index = writable_copy(self.index)
+            self._mapped = False
+        return self.index
+
+    def _register(self, contact_id, name, email, aliases):
+        """Add a contact to the lookup tables and return its alias ids"""
+        if email in self._by_email:
+            self._remove(self._by_email[email])
+        self.contacts[contact_id] = (name, email)
+        self._by_email[email] = contact_id
+        self._next_contact = max(self._next_contact, contact_id + 1)
+        alias_ids = []
+        for n, alias in enumerate(aliases[:ALIAS_SLOTS]):
+            alias_id = contact_id * ALIAS_SLOTS + n
+            grams = trigrams(alias)
+            self._alias_owner[alias_id] = contact_id
+            self._alias_trigrams[alias_id] = grams
+            if alias_id >= len(self._alias_sizes):
+                self._alias_sizes = np.resize(self._alias_sizes, max(alias_id + 1, 2 * len(self._alias_sizes)))
+            self._alias_sizes[alias_id] = len(grams)
+            self._contact_aliases[contact_id].append(alias_id)
+            for gram in grams:
+                self._postings[gram].add(alias_id)
+                self._posting_arrays.pop(gram, None)
+            alias_ids.append(alias_id)
+        self._fallback_cache.clear()
+        return alias_ids
+
+    def add_contact(self, name, email, nicknames=(), contact_id=None):
+        """Add a contact, replacing any existing contact with the same email"""
+        return self.add_contacts([(name, email, nicknames)],
+                                 None if contact_id is None else [contact_id])[0]
+
+    def add_contacts(self, contacts, contact_ids=None):
+        """Add many (name, email[, nicknames]) contacts with one encode call"""
+        pending = []
+        for contact in contacts:
+            name, email = contact[0], contact[1]
+            nicknames = contact[2] if len(contact) > 2 else ()
+            aliases = contact_aliases(name, email, nicknames)[:ALIAS_SLOTS]
+            pending.append((name, email, aliases))
+
+        all_aliases = [alias for _, _, aliases in pending for alias in aliases]
+        vectors = self._encode(all_aliases) if all_aliases else None
+
+        added = []
+        with self.lock:
+            alias_ids = []
+            for i, (name, email, aliases) in enumerate(pending):
+                if contact_ids is not None:
+                    contact_id = contact_ids[i]
+                elif email in self._by_email:
+                    contact_id = self._by_email[email]
+                else:
+                    contact_id = self._next_contact
+                alias_ids.extend(self._register(contact_id, name, email, aliases))
+                added.append(contact_id)
+            if vectors is not None:
+                index = self._writable_index(vectors.shape[1])
+                index.add_with_ids(vectors, np.asarray(alias_ids, dtype='int64'))
+        return added
+
+    def remove_contact(self, email):
+        """Remove a contact by email; False if it was not stored"""
+        with self.lock:
+            contact_id = self._by_email.get(email)
+            if contact_id is None:
+                return False
+            self._remove(contact_id)
+            return True
+
+    def _remove(self, contact_id):
+        alias_ids = self._contact_aliases.pop(contact_id, [])
+        for alias_id in alias_ids:
+            for gram in self._alias_trigrams.pop(alias_id):
+                self._postings[gram].discard(alias_id)
+                self._posting_arrays.pop(gram, None)
+                if not self._postings[gram]:
+                    del self._postings[gram]
+            del self._alias_owner[alias_id]
+        self._fallback_cache.clear()
+        if alias_ids and self.index is not None:
+            index = self._writable_index(self.index.d)
+            index.remove_ids(np.asarray(alias_ids, dtype='int64'))
+        name, email = self.contacts.pop(contact_id)
+        del self._by_email[email]
+
+    def _posting_array(self, gram):
+        array = self._posting_arrays.get(gram)
+        if array is None:
+            postings = self._postings.get(gram)
+            if not postings:
+                return None
+            array = self._posting_arrays[gram] = np.fromiter(postings, dtype='int64', count=len(postings))
+        return array
+
+    def _trigram_scores(self, query_grams):
+        """Dice similarity of query and alias trigrams, best alias per contact, for scores >= TRIGRAM_MIN"""
+        arrays = [array for array in map(self._posting_array, query_grams) if array is not None]
+        if not arrays:
+            return {}
+        # Shared trigram counts and scores for all aliases at once; only the
+        # aliases over the threshold are looked at one by one
+        n = len(query_grams)
+        hits = np.concatenate(arrays)
+        if len(hits) * 16 > len(self._alias_sizes):
+            counts = np.bincount(hits)  # common trigrams: one pass, no sort
+            alias_ids = np.flatnonzero(counts)
+            counts = counts[alias_ids]
+        else:
+            alias_ids, counts = np.unique(hits, return_counts=True)
+        similarity = 2 * counts / (n + self._alias_sizes[alias_ids])
+        keep = similarity >= TRIGRAM_MIN
+        scores = {}
+        for alias_id, score in zip(alias_ids[keep].tolist(), similarity[keep].tolist()):
+            contact_id = self._alias_owner[alias_id]
+            if score > scores.get(contact_id, 0):
+                scores[contact_id] = score
+        return scores
+
+    def _vector_scores(self, query, k):
+        """Cosine similarity of the best alias per contact, for scores >= VECTOR_MIN
+
+        The query is encoded outside the lock; only the cache and the FAISS search hold it.
+        """
+        key = (normalize(query), k)
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                return {}
+            cached = self._fallback_cache.get(key)
+            if cached is not None:
+                self._fallback_cache.move_to_end(key)
+                return cached
+        vector = self._encode([key[0]])
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                return {}
+            distances, ids = self.index.search(vector, min(k, self.index.ntotal))
+            scores = {}
+            for score, alias_id in zip(distances[0], ids[0]):
+                if alias_id < 0 or score < VECTOR_MIN:
+                    continue
+                contact_id = self._alias_owner.get(int(alias_id))
+                if contact_id is not None and score > scores.get(contact_id, -1):
+                    scores[contact_id] = float(score)
+            self._fallback_cache[key] = scores
+            while len(self._fallback_cache) > FALLBACK_CACHE_SIZE:
+                self._fallback_cache.popitem(last=False)
+        return scores
+
+    def search(self, query, k=5):
+        """Ranked (name, email, score) matches for a name, nickname or email
+
+        Only matches above the threshold of their source (TRIGRAM_MIN or
+        VECTOR_MIN) are returned.
+        """
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        with self.lock:
+            scores = self._trigram_scores(query_grams)
+        if not scores or max(scores.values()) < STRONG_MATCH:
+            for contact_id, score in self._vector_scores(query, k * 4).items():
+                if score > scores.get(contact_id, 0):
+                    scores[contact_id] = score
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        with self.lock:
+            # A contact may have been removed while the query was encoded
+            return [(*self.contacts[contact_id], score) for contact_id, score in ranked
+                    if contact_id in self.contacts][:k]
+
+    def lookup(self, name):
+        """(email, []) for a clear match, (None, [(name, email), ...]) when several
+        contacts match about as well, (None, []) when none does"""
+        matches = self.search(name, k=MAX_CANDIDATES + 1)
+        if not matches:
+            return None, []
+        close = [(match_name, email) for match_name, email, score in matches
+                 if score >= matches[0][2] - AMBIGUITY_MARGIN]
+        if len(close) > 1:
+            return None, close[:MAX_CANDIDATES]
+        return matches[0][1], []
+
+    def find_email(self, name):
+        """The email of the one contact matching a name, or None when there is none or several"""
+        return self.lookup(name)[0]
+
+    def save_index(self, name=CONTACTS_INDEX, build_seconds=None):
+        """Save the FAISS index through the shared index manager"""
+        with self.lock:
+            if self.index is None:
+                return
+            manager = get_index_manager()
+            manager.save(name, self.index, build_seconds)
+            self.version = manager.version(name)
+
+    @classmethod
+    def load(cls, rows, name=CONTACTS_INDEX):
+        """Build a store from contact rows, using the saved index when it matches"""
+        store = cls()
+        manager = get_index_manager()
+        expected = set()
+        with store.lock:
+            for contact_id, contact_name, email, nicknames in rows:
+                aliases = contact_aliases(contact_name, email, nicknames)
+                expected.update(store._register(contact_id, contact_name, email, aliases))
+            index = manager.get(name)
+            if index is not None and set(faiss.vector_to_array(index.id_map).tolist()) == expected:
+                store.index = index
+                store._mapped = True
+                store.version = manager.version(name)
+                return store
+        # The saved index is missing or stale, embed everything once and save it
+        if rows:
+            start = time.perf_counter()
+            store.add_contacts([(contact_name, email, nicknames) for _, contact_name, email, nicknames in rows],
+                               [contact_id for contact_id, _, _, _ in rows])
+            store.save_index(name, time.perf_counter() - start)
+        return store
+
+    def __len__(self):
+        return len(self.contacts)
+
+
+
+"""##Contact Database"""
+
+def init_contacts_db():
+    """Initialize the contacts database"""
+    conn = sqlite3.connect(CONTACTS_DB)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS contacts
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  name TEXT NOT NULL,
+                  email TEXT NOT NULL UNIQUE,
+                  nicknames TEXT DEFAULT '[]',
+                  source TEXT NOT NULL,
+                  message_count INTEGER DEFAULT 0,
+                  last_seen TEXT,
+                  updated_at TEXT NOT NULL)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_state
+                 (key TEXT PRIMARY KEY,
+                  value TEXT NOT NULL)''')
+    conn.commit()
+    conn.close()
+
+
+def get_contacts_db():
+    """Get (id, name, email, nicknames) for every stored contact"""
+    init_contacts_db()
+    conn = sqlite3.connect(CONTACTS_DB)
+    c = conn.cursor()
+    c.execute('SELECT id, name, email, nicknames FROM contacts ORDER BY id')
+    rows = [(contact_id, name, email, json.loads(nicknames))
+            for contact_id, name, email, nicknames in c.fetchall()]
+    conn.close()
+    return rows
+
+
+def upsert_contacts_db(records):
+    """Insert or merge harvested contacts, returning the rows that changed"""
+    init_contacts_db()
+    conn = sqlite3.connect(CONTACTS_DB)
+    c = conn.cursor()
+    now = datetime.now().isoformat()
+    changed = []
+    for record in records:
+        email = record['email'].lower()
+        c.execute('SELECT id, name, nicknames FROM contacts WHERE email = ?', (email,))
+        existing = c.fetchone()
+        nicknames = sorted(set(record.get('nicknames', [])))
+        if existing is None:
+            c.execute('''INSERT INTO contacts
+                         (name, email, nicknames, source, message_count, last_seen, updated_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                      (record['name'], email, json.dumps(nicknames), record['source'],
+                       record.get('message_count', 0), record.get('last_seen'), now))
+            changed.append((c.lastrowid, record['name'], email, nicknames))
+            continue
+
+        contact_id, name, old_nicknames = existing
+        old_nicknames = json.loads(old_nicknames)
+        # Names from the address book win over display names in mail headers
+        if record['source'] == 'people' or name == email.split('@')[0]:
+            new_name = record['name'] or name
+        else:
+            new_name = name
+        nicknames = sorted(set(old_nicknames) | set(nicknames))
+        c.execute('''UPDATE contacts SET name = ?, nicknames = ?,
+                            message_count = message_count + ?,
+                            last_seen = MAX(COALESCE(last_seen, ''), COALESCE(?, '')),
+                            updated_at = ?
+                     WHERE id = ?''',
+                  (new_name, json.dumps(nicknames), record.get('message_count', 0),
+                   record.get('last_seen'), now, contact_id))
+        if new_name != name or nicknames != old_nicknames:
+            changed.append((contact_id, new_name, email, nicknames))
+    conn.commit()
+    conn.close()
+    return changed
+
+
+def get_sync_state(key, default=None):
+    init_contacts_db()
+    conn = sqlite3.connect(CONTACTS_DB)
+    row = conn.execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+    conn.close()
+    return row[0] if row else default
+
+
+def set_sync_state(key, value):
+    init_contacts_db()
+    conn = sqlite3.connect(CONTACTS_DB)
+    conn.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, str(value)))
+    conn.commit()
+    conn.close()
+
+
+"""##Harvesting Contacts"""
+
+IGNORED_SENDERS = ('noreply', 'no-reply', 'donotreply', 'do-not-reply', 'notifications', 'mailer-daemon')
+
+
+def _is_person(email):
+    local = email.split('@')[0].lower()
+    return '@' in email and not any(word in local for word in IGNORED_SENDERS)
+
+
+def harvest_gmail_correspondents(gmail_service, max_messages=500):
+    """Collect senders and recipients from message headers since the last sync
+
+    Gmail lists the newest messages first. When more than `max_messages` are
+    new, the run takes the newest of them and records how far back it got
+    (`gmail_before`); the next runs carry on from there. `gmail_after` only
+    moves forward once everything up to the newest message has been read.
+    """
+    after = get_sync_state('gmail_after')
+    before = get_sync_state('gmail_before')
+    query = " ".join(term for term in (after and f"after:{after}", before and f"before:{before}") if term)
+
+    message_ids = []
+    request = gmail_service.users().messages().list(
+        userId='me', q=query, maxResults=min(max_messages, 500))
+    while request is not None and len(message_ids) < max_messages:
+        response = request.execute()
+        message_ids.extend(m['id'] for m in response.get('messages', []))
+        request = gmail_service.users().messages().list_next(request, response)
+    capped = request is not None or len(message_ids) > max_messages
+    message_ids = message_ids[:max_messages]
+
+    own_address = gmail_service.users().getProfile(userId='me').execute().get('emailAddress', '').lower()
+    people = {}
+    newest = int(get_sync_state('gmail_newest') or after or 0)
+    oldest = None
+
+    def collect(request_id, response, exception):
+        nonlocal newest, oldest
+        if exception is not None:
+            return
+        seen = datetime.fromtimestamp(int(response['internalDate']) / 1000).isoformat()
+        second = int(response['internalDate']) // 1000
+        newest = max(newest, second)
+        oldest = second if oldest is None else min(oldest, second)
+        headers = [h['value'] for h in response['payload']['headers']
+                   if h['name'] in ('From', 'To', 'Cc')]
+        for name, email in getaddresses(headers):
+            email = email.lower()
+            if not _is_person(email) or email == own_address:
+                continue
+            person = people.setdefault(email, {
+                'name': name or email.split('@')[0], 'email': email,
+                'source': 'gmail', 'message_count': 0, 'last_seen': seen})
+            person['message_count'] += 1
+            person['last_seen'] = max(person['last_seen'], seen)
+            if name and person['name'] == email.split('@')[0]:
+                person['name'] = name
+
+    # Gmail allows up to 100 calls per batch but throttles large batches
+    for start in range(0, len(message_ids), 50):
+        batch = gmail_service.new_batch_http_request(callback=collect)
+        for message_id in message_ids[start:start + 50]:
+            batch.add(gmail_service.users().messages().get(
+                userId='me', id=message_id, format='metadata',
+                metadataHeaders=['From', 'To', 'Cc']))
+        batch.execute()
+
+    if capped and oldest is not None:
+        # Older messages are still unread; the next run reads up to (and
+        # including) the oldest second read in this one
+        set_sync_state('gmail_before', oldest + 1)
+        set_sync_state('gmail_newest', newest)
+    else:
+        if newest:
+            set_sync_state('gmail_after', newest)
+        set_sync_state('gmail_before', '')
+        set_sync_state('gmail_newest', '')
+    return list(people.values())
+
+
+def harvest_people(people_service):
+    """Collect saved and other contacts from the People API, if it is authorized"""
+    records = []
+    try:
+        request = people_service.people().connections().list(
+            resourceName='people/me', pageSize=1000,
+            personFields='names,emailAddresses,nicknames')
+        while request is not None:
+            response = request.execute()
+            for person in response.get('connections', []):
+                records.extend(_person_records(person))
+            request = people_service.people().connections().list_next(request, response)
+
+        request = people_service.otherContacts().list(
+            pageSize=1000, readMask='names,emailAddresses')
+        while request is not None:
+            response = request.execute()
+            for person in response.get('otherContacts', []):
+                records.extend(_person_records(person))
+            request = people_service.otherContacts().list_next(request, response)
+    except Exception as e:
+        # The contacts scopes are optional; keep whatever was collected
+        print(f"People API unavailable: {e}")
+    return records
+
+
+def _person_records(person):
+    names = person.get('names', [])
+    name = names[0].get('displayName', '') if names else ''
+    nicknames = [n['value'] for n in person.get('nicknames', []) if n.get('value')]
+    return [{'name': name or e['value'].split('@')[0], 'email': e['value'].lower(),
+             'nicknames': nicknames, 'source': 'people'}
+            for e in person.get('emailAddresses', []) if e.get('value')]
+
+
+def sync_contacts(gmail_service, people_service=None, max_messages=500):
+    """Harvest contacts into SQLite and update the saved index incrementally"""
+    records = harvest_people(people_service) if people_service is not None else []
+    records.extend(harvest_gmail_correspondents(gmail_service, max_messages))
+    changed = upsert_contacts_db(records)
+    if changed:
+        store = get_contact_store()
+        store.add_contacts([(name, email, nicknames) for _, name, email, nicknames in changed],
+                           [contact_id for contact_id, _, _, _ in changed])
+        store.save_index()
+    return len(changed)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_contact_store():
+    """The process-wide contact store, loaded from disk on first use"""
+    global _store
+    with _store_lock:
+        if _store is None or _store.version != get_index_manager().version(CONTACTS_INDEX):
+            # Another process saved a newer index; reload the rows and map it
+            _store = ContactStore.load(get_contacts_db())
+    return _store
+
+
+def match_attendees(names):
+    """(email addresses, names that matched no contact, {name: candidates} for ambiguous names)
+
+    Addresses are kept as they are. Candidates are (name, email) pairs.
+    """
+    store = get_contact_store()
+    resolved, unresolved, ambiguous = [], [], {}
+    for name in names:
+        email, candidates = (name, []) if '@' in name else store.lookup(name)
+        if email:
+            resolved.append(email)
+        elif candidates:
+            ambiguous[name] = candidates
+        else:
+            unresolved.append(name)
+    return resolved, unresolved, ambiguous
+
+
+def resolve_attendees(names):
+    """Map attendee names to email addresses, dropping names that match no contact or several"""
+    return match_attendees(names)[0]
+
+
+def start_sync(gmail_pool, people_pool=None, interval=3600):
+    """Refresh contacts on a background thread every `interval` seconds
+
+    Takes `ServicePool`s and holds one service of each for the length of a sync.
+    """
+    def run():
+        while True:
+            try:
+                with gmail_pool.checkout() as gmail_service:
+                    if people_pool is None:
+                        sync_contacts(gmail_service)
+                    else:
+                        with people_pool.checkout() as people_service:
+                            sync_contacts(gmail_service, people_service)
+            except Exception as e:
+                print(f"Contact sync failed: {e}")
+            stop.wait(interval)
+
+    stop = threading.Event()
+    threading.Thread(target=run, name='contact-sync', daemon=True).start()
+    return stop
@@ -0,0 +1,257 @@
+"""Google OAuth credentials with proactive background refresh.
+
+`CredentialManager` loads authorized-user tokens from disk, one set per user,
+and refreshes each one `REFRESH_MARGIN` seconds before it expires on a
+background thread, so request paths never pay for a refresh round trip.
+Refreshed tokens are written atomically (temporary file and `os.replace`).
+The refresh happens in place on the shared `Credentials` object, so services
+built from it pick up the new token without being rebuilt.
+
+A failed refresh is retried with exponential backoff (`RETRY_BASE` doubling
+up to `RETRY_MAX`), reset by the next success. `invalid_grant` and
+`invalid_scope` are not retried at all: the token was revoked or lacks a
+scope added since it was granted, and only a new consent can fix that.
+
+The interactive consent flow never runs inside the server. Authorize once
+from a terminal:
+
+    python credentials.py            # the default user, written to token.json
+    python credentials.py alice      # written to tokens/alice.json
+"""
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from tracing import metrics
+
+SCOPES = [
+    'https://www.googleapis.com/auth/calendar',
+    'https://www.googleapis.com/auth/gmail.readonly',
+    'https://www.googleapis.com/auth/gmail.send',
+    'https://www.googleapis.com/auth/contacts.readonly',
+    'https://www.googleapis.com/auth/contacts.other.readonly'
+]
+
+DEFAULT_TOKEN = 'token.json'
+TOKEN_DIR = 'tokens'
+CLIENT_SECRETS = 'credentials.json'
+REFRESH_MARGIN = 300  # seconds before expiry to refresh
+MAX_SLEEP = 60        # seconds between checks at most
+RETRY_BASE = 30       # seconds before retrying a failed refresh, doubled per failure
+RETRY_MAX = 3600      # longest wait between retries
+UNRECOVERABLE = ('invalid_grant', 'invalid_scope')  # refresh errors that need a new consent
+
+
+class CredentialsMissing(Exception):
+    """No usable token is stored for a user"""
+
+
+def _unrecoverable(error):
+    """The OAuth error code of a refresh failure that retrying cannot fix, or None"""
+    text = str(error)
+    return next((code for code in UNRECOVERABLE if code in text), None)
+
+
+def _utcnow():
+    # google-auth keeps expiry as a naive UTC datetime
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class CredentialManager:
+    def __init__(self, scopes=SCOPES, default_path=DEFAULT_TOKEN, directory=TOKEN_DIR,
+                 refresh_margin=REFRESH_MARGIN):
+        self.scopes = scopes
+        self.default_path = default_path
+        self.directory = directory
+        self.refresh_margin = refresh_margin
+        self.credentials = {}  # user_id -> Credentials
+        self.locks = {}        # user_id -> Lock serialising refreshes
+        self.failures = {}     # user_id -> (failed refreshes in a row, monotonic time of the next try)
+        self.revoked = {}      # user_id -> error code; not refreshed until re-authorized
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def path(self, user_id=None):
+        if user_id is None:
+            return self.default_path
+        safe = re.sub(r'[^A-Za-z0-9_.+-]', '_', str(user_id))
+        return os.path.join(self.directory, f"{safe}.json")
+
+    def _user_lock(self, user_id):
+        with self.lock:
+            return self.locks.setdefault(user_id, threading.Lock())
+
+    def _reauthorize_message(self, user_id, code):
+        return (f"The Google token for {user_id or 'the default user'} can no longer be refreshed ({code}). "
+                f"Delete {self.path(user_id)} and run `python credentials.py"
+                f"{'' if user_id is None else ' ' + str(user_id)}` to authorize again")
+
+    def get(self, user_id=None):
+        """The user's credentials, loaded on first use; never starts an OAuth flow"""
+        with self.lock:
+            creds = self.credentials.get(user_id)
+            code = self.revoked.get(user_id)
+        if code is not None:
+            raise CredentialsMissing(self._reauthorize_message(user_id, code))
+        if creds is None:
+            path = self.path(user_id)
+            if not os.path.exists(path):
+                raise CredentialsMissing(f"No token at {path}; run `python credentials.py"
+                                         f"{'' if user_id is None else ' ' + str(user_id)}` to authorize")
+            creds = Credentials.from_authorized_user_file(path, self.scopes)
+            with self.lock:
+                creds = self.credentials.setdefault(user_id, creds)
+        if not creds.valid:
+            # Only when the background refresh fell behind, e.g. right after startup
+            self.refresh(user_id)
+        return creds
+
+    def save(self, user_id, creds):
+        """Write a token atomically, readable by the owner only"""
+        path = self.path(user_id)
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.token-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(creds.to_json())
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def seconds_left(self, creds):
+        if creds.expiry is None:
+            return float('inf')
+        return (creds.expiry - _utcnow()).total_seconds()
+
+    def refresh(self, user_id=None, force=False):
+        """Refresh a user's token if it is within the margin of expiry
+
+        Does nothing while a failed refresh is backing off (unless forced) or
+        after an unrecoverable error.
+        """
+        with self.lock:
+            creds = self.credentials.get(user_id)
+            failure = self.failures.get(user_id)
+            if creds is None or not creds.refresh_token or user_id in self.revoked:
+                return False
+        if not force and failure is not None and time.monotonic() < failure[1]:
+            return False
+        with self._user_lock(user_id):
+            # Another thread may have refreshed it while this one waited
+            if not force and creds.valid and self.seconds_left(creds) > self.refresh_margin:
+                return False
+            try:
+                creds.refresh(Request())
+            except Exception as e:
+                self._failed(user_id, e)
+                raise
+            self.save(user_id, creds)
+        with self.lock:
+            self.failures.pop(user_id, None)
+        metrics.incr('credential_refresh_total', outcome='ok')
+        return True
+
+    def _failed(self, user_id, error):
+        code = _unrecoverable(error)
+        with self.lock:
+            if code is not None:
+                self.revoked[user_id] = code
+                self.failures.pop(user_id, None)
+            else:
+                count = self.failures.get(user_id, (0, 0))[0] + 1
+                delay = min(RETRY_MAX, RETRY_BASE * 2 ** (count - 1))
+                self.failures[user_id] = (count, time.monotonic() + delay)
+        metrics.incr('credential_refresh_total', outcome='revoked' if code else 'error')
+        if code is not None:
+            print(self._reauthorize_message(user_id, code))
+
+    def _next_check(self):
+        with self.lock:
+            users = [(user_id, creds) for user_id, creds in self.credentials.items()
+                     if user_id not in self.revoked]
+            failures = dict(self.failures)
+        wait = MAX_SLEEP
+        now = time.monotonic()
+        for user_id, creds in users:
+            if user_id in failures:
+                wait = min(wait, failures[user_id][1] - now)
+            else:
+                wait = min(wait, self.seconds_left(creds) - self.refresh_margin)
+        return max(1.0, wait)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            with self.lock:
+                users = list(self.credentials)
+            for user_id in users:
+                try:
+                    self.refresh(user_id)
+                except Exception as e:
+                    if _unrecoverable(e) is None:
+                        print(f"Token refresh for {user_id or 'default user'} failed, "
+                              f"retrying in {self._retry_in(user_id):.0f} s: {e}")
+            self.stop_event.wait(self._next_check())
+
+    def _retry_in(self, user_id):
+        with self.lock:
+            failure = self.failures.get(user_id)
+        return max(0.0, failure[1] - time.monotonic()) if failure else 0.0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='credential-refresh', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def stats(self):
+        with self.lock:
+            users = list(self.credentials.values())
+        left = [self.seconds_left(creds) for creds in users if creds.expiry is not None]
+        return {'users': len(users), 'min_seconds_to_expiry': min(left) if left else 0}
+
+    def authorize(self, user_id=None, client_secrets=CLIENT_SECRETS):
+        """Run the browser consent flow and store the token; for the command line only"""
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        flow = InstalledAppFlow.from_client_secrets_file(client_secrets, self.scopes)
+        creds = flow.run_local_server(port=0)
+        self.save(user_id, creds)
+        with self.lock:
+            self.credentials[user_id] = creds
+            self.failures.pop(user_id, None)
+            self.revoked.pop(user_id, None)
+        return creds
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_credential_manager():
+    """The process-wide credential manager, with its refresh thread started"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = CredentialManager().start()
+            metrics.register_collector(_manager.stats, prefix='credentials_')
+        return _manager
+
+
+if __name__ == '__main__':
+    user = sys.argv[1] if len(sys.argv) > 1 else None
+    manager = CredentialManager()
+    manager.authorize(user)
+    print(f"Token stored at {manager.path(user)}")
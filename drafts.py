@@ -0,0 +1,75 @@
+"""Actions waiting for the user's confirmation.
+
+Requests that write to the calendar on the user's behalf (an extracted event,
+a gym plan) are not carried out straight away. The handler stores a draft of
+what it would do and replies with a summary; a following "yes" carries the
+draft out and "no" discards it. Each user has at most one draft, a new one
+replaces the old, and drafts expire after `DRAFT_TTL` so a stray "yes" hours
+later does nothing. Drafts live in SQLite so any worker can confirm them.
+"""
+import json
+import re
+import sqlite3
+from datetime import datetime, timedelta
+
+DRAFTS_DB = 'drafts.db'
+
+DRAFT_TTL = timedelta(minutes=30)
+
+CONFIRM_WORDS = re.compile(r"^\s*(yes|yeah|yep|y|ok|okay|sure|confirm|go ahead|do it|add it)\b[\s.!]*$",
+                           re.IGNORECASE)
+CANCEL_WORDS = re.compile(r"^\s*(no|nope|n|cancel|don'?t|stop|never mind)\b[\s.!]*$", re.IGNORECASE)
+
+
+def init_drafts_db():
+    """Initialize the drafts table"""
+    conn = sqlite3.connect(DRAFTS_DB)
+    conn.execute('''CREATE TABLE IF NOT EXISTS drafts
+                    (user_id TEXT PRIMARY KEY,
+                     kind TEXT NOT NULL,
+                     payload TEXT NOT NULL,
+                     expires_at TEXT NOT NULL)''')
+    conn.commit()
+    conn.close()
+
+
+def save_draft(user_id, kind, payload, now=None):
+    """Store `payload` (JSON-serialisable) as the user's pending action, replacing any other"""
+    now = now or datetime.now()
+    init_drafts_db()
+    conn = sqlite3.connect(DRAFTS_DB)
+    conn.execute('INSERT OR REPLACE INTO drafts (user_id, kind, payload, expires_at) VALUES (?, ?, ?, ?)',
+                 (str(user_id), kind, json.dumps(payload), (now + DRAFT_TTL).isoformat()))
+    conn.commit()
+    conn.close()
+
+
+def pop_draft(user_id, now=None):
+    """(kind, payload) of the user's unexpired draft, removed so it runs once, or None"""
+    now = now or datetime.now()
+    init_drafts_db()
+    conn = sqlite3.connect(DRAFTS_DB, timeout=30, isolation_level=None)
+    c = conn.cursor()
+    try:
+        c.execute('BEGIN IMMEDIATE')
+        row = c.execute('SELECT kind, payload, expires_at FROM drafts WHERE user_id = ?',
+                        (str(user_id),)).fetchone()
+        c.execute('DELETE FROM drafts WHERE user_id = ?', (str(user_id),))
+        c.execute('COMMIT')
+    except Exception:
+        c.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    if row is None or row[2] < now.isoformat():
+        return None
+    return row[0], json.loads(row[1])
+
+
+def reply_kind(text):
+    """'confirm', 'cancel' or None for a message answering a draft"""
+    if CONFIRM_WORDS.match(text):
+        return 'confirm'
+    if CANCEL_WORDS.match(text):
+        return 'cancel'
+    return None
@@ -0,0 +1,221 @@
+"""Shared sentence embedding service.
+
+The SentenceTransformer model is loaded once per process on first use.
+Concurrent `encode` calls are gathered for a few milliseconds and encoded as
+one batch, and vectors are cached in an LRU keyed by a hash of the text, with
+an optional float16 cache in SQLite that survives restarts.
+"""
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+
+BATCH_WINDOW = 0.005  # seconds to wait for more texts before encoding
+MAX_BATCH = 64
+CACHE_SIZE = 10000
+# Optional SQLite file for a float16 vector cache that survives restarts
+EMBEDDING_CACHE_DB = os.getenv('EMBEDDING_CACHE_DB')
+
+
+class EmbeddingService:
+    def __init__(self, model_name=EMBEDDING_MODEL, batch_window=BATCH_WINDOW,
+                 max_batch=MAX_BATCH, cache_size=CACHE_SIZE, disk_cache=EMBEDDING_CACHE_DB):
+        self.model_name = model_name
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.disk_cache = disk_cache
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._inflight = {}  # text -> Future shared by concurrent callers
+        self._stats = {'requests': 0, 'cache_hits': 0, 'disk_hits': 0,
+                       'encoded': 0, 'batches': 0, 'encode_seconds': 0.0}
+        self._stats_lock = threading.Lock()
+        if disk_cache:
+            self._init_disk_cache()
+
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                # Imported here so that importing this module does not load torch
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def _key(self, text):
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode()).hexdigest()
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for name, value in counts.items():
+                self._stats[name] += value
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+            return vector
+
+    def _cache_put(self, key, vector):
+        with self._cache_lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _init_disk_cache(self):
+        conn = sqlite3.connect(self.disk_cache)
+        conn.execute('''CREATE TABLE IF NOT EXISTS embeddings
+                        (key TEXT PRIMARY KEY,
+                         vector BLOB NOT NULL)''')
+        conn.commit()
+        conn.close()
+
+    def _disk_get(self, keys):
+        if not self.disk_cache or not keys:
+            return {}
+        conn = sqlite3.connect(self.disk_cache, timeout=30)
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype='float16').astype('float32')
+        conn.close()
+        return found
+
+    def _disk_put(self, items):
+        if not self.disk_cache or not items:
+            return
+        conn = sqlite3.connect(self.disk_cache, timeout=30)
+        conn.executemany('INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)',
+                         [(key, vector.astype('float16').tobytes()) for key, vector in items])
+        conn.commit()
+        conn.close()
+
+    def _encode_now(self, texts):
+        start = time.perf_counter()
+        vectors = self.model.encode(list(texts), batch_size=self.max_batch,
+                                    normalize_embeddings=True)
+        self._count(encoded=len(texts), batches=1, encode_seconds=time.perf_counter() - start)
+        return np.asarray(vectors, dtype='float32')
+
+    def encode(self, texts):
+        """Normalized float32 embeddings for a list of texts, one row per text"""
+        texts = list(texts)
+        self._count(requests=len(texts))
+        keys = [self._key(text) for text in texts]
+        vectors = [self._cache_get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        self._count(cache_hits=len(texts) - len(missing))
+
+        if missing and self.disk_cache:
+            stored = self._disk_get([keys[i] for i in missing])
+            self._count(disk_hits=len(stored))
+            for i in missing:
+                if keys[i] in stored:
+                    vectors[i] = stored[keys[i]]
+                    self._cache_put(keys[i], vectors[i])
+            missing = [i for i in missing if vectors[i] is None]
+
+        if missing:
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            if len(unique) >= self.max_batch:
+                # Bulk requests are already a full batch, skip the batching window
+                encoded = dict(zip(unique, self._encode_now(unique)))
+            else:
+                futures = {text: self._submit(text) for text in unique}
+                encoded = {text: future.result() for text, future in futures.items()}
+            new_items = []
+            for i in missing:
+                vectors[i] = encoded[texts[i]]
+                self._cache_put(keys[i], vectors[i])
+                new_items.append((keys[i], vectors[i]))
+            self._disk_put(new_items)
+
+        if not vectors:
+            return np.zeros((0, self.dimension), dtype='float32')
+        return np.vstack(vectors).astype('float32', copy=False)
+
+    def _submit(self, text):
+        with self._worker_lock:
+            future = self._inflight.get(text)
+            if future is not None:
+                return future
+            future = self._inflight[text] = Future()
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+                self._worker.start()
+        self._queue.put((text, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                vectors = self._encode_now([text for text, _ in batch])
+            except Exception as e:
+                vectors = None
+                error = e
+            with self._worker_lock:
+                for text, _ in batch:
+                    self._inflight.pop(text, None)
+            for i, (_, future) in enumerate(batch):
+                if vectors is None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(vectors[i])
+
+    def stats(self):
+        """Counters plus throughput in sentences per second of model time"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['sentences_per_second'] = (
+            stats['encoded'] / stats['encode_seconds'] if stats['encode_seconds'] else 0.0)
+        stats['cache_hit_rate'] = (
+            (stats['cache_hits'] + stats['disk_hits']) / stats['requests'] if stats['requests'] else 0.0)
+        stats['cache_entries'] = len(self._cache)
+        return stats
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service(**kwargs):
+    """The process-wide embedding service, created on first use"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EmbeddingService(**kwargs)
+    return _service
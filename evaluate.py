@@ -0,0 +1,311 @@
+"""Offline evaluation of assistant responses.
+
+Reads test cases from a JSONL file, one {"id": ..., "request": ...} object per
+line, runs the assistant and the `eval_summary` judge on them concurrently
+under a shared rate limit, and appends each result to a checkpoint file so an
+interrupted run resumes where it stopped. Use --fake to run without any model
+calls.
+
+Calendar, Gmail and NewsAPI answer from the benchmark fixtures, and the run
+works in a temporary directory, so reminders, drafts and other SQLite state
+it creates never touch the live databases.
+
+    python evaluate.py eval_cases.jsonl --output eval_results.jsonl --concurrency 8
+"""
+import argparse
+import enum
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from ratelimit import TokenBucket
+
+EVAL_MODEL = "gemini-2.5-flash-preview-05-20"
+
+ASSISTANT_EVAL_PROMPT = """\
+# Instruction
+You are an expert evaluator of AI assistant behavior. Your task is to assess the quality of the AI-generated response based on how well it fulfills the user’s request.
+
+# Evaluation
+## Metric Definition
+You are assessing assistant task performance. The assistant is expected to act like a helpful personal assistant named Sonia. The response should follow the instruction in the prompt, present the information clearly, and avoid hallucination (i.e., inventing facts not in the available data). Use the assistant's role and capabilities as defined in the system prompt or tool outputs to evaluate accuracy.
+
+## Criteria
+Instruction following: Did the assistant fulfill the task described in the prompt?
+Correctness: Is the information factually accurate and grounded in available data or tools?
+Completeness: Did the assistant provide all relevant information needed to satisfy the request?
+Formatting: Is the response well-organized and professional in tone?
+Fluency: Is the language grammatically correct and easy to follow?
+
+## Rating Rubric
+5: (Very good). Response is fully correct, follows all instructions, and is well-formatted and fluent.
+4: (Good). Mostly correct and complete, minor issues in tone or format.
+3: (Okay). Task is partially fulfilled; some issues in content or clarity.
+2: (Poor). Task is mostly unfulfilled or incorrect.
+1: (Very bad). Response is irrelevant or incorrect.
+
+# Evaluation Steps
+STEP 1: Assess the response for correctness, completeness, and formatting.
+STEP 2: Assign a score based on the rubric.
+
+# User Input
+{prompt}
+
+# Assistant Response
+{response}
+"""
+
+
+# Define a structured enum class to capture the result.
+class SummaryRating(enum.Enum):
+    VERY_GOOD = '5'
+    GOOD = '4'
+    OK = '3'
+    BAD = '2'
+    VERY_BAD = '1'
+
+
+def eval_summary(prompt, ass_response, client):
+    from google.genai import types
+
+    chat = client.chats.create(model=EVAL_MODEL)
+
+    response = chat.send_message(
+        message=ASSISTANT_EVAL_PROMPT.format(prompt=prompt, response=ass_response))
+    verbose_eval = response.text
+
+    # Coerce into the desired structure.
+    structured_output_config = types.GenerateContentConfig(
+        response_mime_type="text/x.enum",
+        response_schema=SummaryRating,
+    )
+    response = chat.send_message(
+        message="Convert the final score.",
+        config=structured_output_config,
+    )
+    structured_eval = response.parsed
+
+    return verbose_eval, structured_eval
+
+
+"""##Fake Model Backend"""
+
+class FakeResponse:
+    def __init__(self, text, parsed=None):
+        self.text = text
+        self.parsed = parsed
+
+
+class FakeChat:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def send_message(self, message, config=None):
+        self.backend.sleep()
+        if config is not None and getattr(config, 'response_mime_type', None) == "text/x.enum":
+            rating = self.backend.random.choice(list(SummaryRating))
+            return FakeResponse(rating.value, rating)
+        return FakeResponse("The response follows the instructions. Score: 4")
+
+
+def schema_example(schema):
+    """A value of the shape a JSON response schema describes: first enum values, empty strings and lists"""
+    kind = schema.get('type', 'STRING').upper()
+    if kind == 'OBJECT':
+        return {name: schema_example(field) for name, field in schema.get('properties', {}).items()}
+    if kind == 'ARRAY':
+        return []
+    if kind in ('INTEGER', 'NUMBER'):
+        return 0
+    if kind == 'BOOLEAN':
+        return False
+    return schema['enum'][0] if schema.get('enum') else ""
+
+
+class FakeClient:
+    """Stands in for genai.Client with canned replies and simulated latency"""
+
+    def __init__(self, latency=0.05, jitter=0.02, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.models = self
+        self.chats = self
+        self.calls = 0
+
+    def sleep(self):
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.random.gauss(self.latency, self.jitter))
+        time.sleep(delay)
+
+    def generate_content(self, model, contents, config=None):
+        self.sleep()
+        schema = getattr(config, 'response_schema', None)
+        if getattr(config, 'response_mime_type', None) == "application/json" and isinstance(schema, dict):
+            return FakeResponse(json.dumps(self.structured(contents, schema)))
+        return FakeResponse(f"Fake reply from {model}.")
+
+    def structured(self, contents, schema):
+        """The answer to a JSON schema request; subclasses can fill it from the prompt"""
+        return schema_example(schema)
+
+    def create(self, model):
+        return FakeChat(self)
+
+
+"""##Running the Evaluation"""
+
+def percentiles(values, points=(50, 90, 95, 99)):
+    """Nearest-rank percentiles of a list of numbers"""
+    if not values:
+        return {f"p{p}": None for p in points}
+    ordered = sorted(values)
+    result = {}
+    for p in points:
+        rank = max(1, math.ceil(p / 100 * len(ordered)))
+        result[f"p{p}"] = ordered[rank - 1]
+    return result
+
+
+def load_cases(path):
+    cases = []
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            case = json.loads(line)
+            case.setdefault('id', str(n))
+            cases.append(case)
+    return cases
+
+
+def load_checkpoint(path):
+    """Completed results by case id from an earlier run"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by an interrupted run
+            if 'error' not in result:
+                done[str(result['id'])] = result
+    return done
+
+
+def evaluate_case(case, assistant, client, limiter):
+    """Run the assistant (unless the case has a response) and the judge on one case"""
+    from prompting import ASSISTANT_PROMPT
+
+    result = {'id': case['id'], 'request': case['request']}
+    if case.get('response') is None:
+        limiter.acquire()
+        start = time.perf_counter()
+        result['response'] = assistant(case['request'])
+        result['assistant_seconds'] = time.perf_counter() - start
+    else:
+        result['response'] = case['response']
+
+    limiter.acquire(2)  # the judge makes two chat calls
+    start = time.perf_counter()
+    verbose, rating = eval_summary([case['request'], ASSISTANT_PROMPT], result['response'], client)
+    result['judge_seconds'] = time.perf_counter() - start
+    result['evaluation'] = verbose
+    result['rating'] = rating.value if isinstance(rating, SummaryRating) else rating
+    return result
+
+
+def summarize(results):
+    ratings = Counter(r.get('rating') for r in results)
+    scores = [int(r['rating']) for r in results if r.get('rating') in {s.value for s in SummaryRating}]
+    return {
+        'cases': len(results),
+        'ratings': {s.name: ratings.get(s.value, 0) for s in SummaryRating},
+        'mean_rating': sum(scores) / len(scores) if scores else None,
+        'assistant_latency': percentiles([r['assistant_seconds'] for r in results if 'assistant_seconds' in r]),
+        'judge_latency': percentiles([r['judge_seconds'] for r in results if 'judge_seconds' in r]),
+    }
+
+
+def run_evaluation(cases, output, client, assistant, concurrency=4, rate=2.0):
+    """Evaluate every case not already in the checkpoint file and summarize all results"""
+    done = load_checkpoint(output)
+    pending = [case for case in cases if str(case['id']) not in done]
+    limiter = TokenBucket(rate, max(2, concurrency))
+    write_lock = threading.Lock()
+    print(f"{len(done)} cases already evaluated, {len(pending)} to go")
+
+    with open(output, 'a') as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(evaluate_case, case, assistant, client, limiter): case for case in pending}
+        for n, future in enumerate(as_completed(futures), 1):
+            case = futures[future]
+            try:
+                result = future.result()
+                done[str(case['id'])] = result
+            except Exception as e:
+                result = {'id': case['id'], 'request': case['request'], 'error': str(e)}
+            with write_lock:
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+            print(f"[{n}/{len(pending)}] {case['id']}: {result.get('rating', result.get('error'))}")
+
+    return summarize([done[str(case['id'])] for case in cases if str(case['id']) in done])
+
+
+@contextmanager
+def sandboxed(assistant, client):
+    """The assistant on fixture services and throwaway SQLite files, answering with `client`"""
+    from benchmark import install_fakes
+
+    install_fakes(assistant, 0, 0, 0)
+    assistant.client = client
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            yield assistant
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate assistant responses with the eval_summary judge")
+    parser.add_argument('cases', help="JSONL file of {\"id\", \"request\"[, \"response\"]} test cases")
+    parser.add_argument('--output', default='eval_results.jsonl', help="checkpoint file, appended to and resumed from")
+    parser.add_argument('--summary', help="also write the summary as JSON to this file")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=2.0, help="model calls per second")
+    parser.add_argument('--fake', action='store_true', help="use the fake model backend, no API calls")
+    args = parser.parse_args()
+
+    import assistant
+    if args.fake:
+        client = FakeClient()
+    else:
+        from google import genai
+        client = genai.Client(api_key=os.getenv('GOOGLE_API_KEY'))
+
+    cases, output = load_cases(args.cases), os.path.abspath(args.output)
+    with sandboxed(assistant, client):
+        summary = run_evaluation(cases, output, client, assistant.assistant_response,
+                                 args.concurrency, args.rate)
+    print(json.dumps(summary, indent=2))
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""Structured extraction of reminders and events from a request.
+
+One model call with a JSON response schema returns the intent, title, date
+and time, attendees and priority of a request. Results are cached by the
+normalized utterance and the day, since "tomorrow" changes meaning at
+midnight, or the minute for requests such as "in 2 hours" that count from
+now. When the model is slow or its answer does not parse, the local
+parser below produces the same fields from regexes and `timerange`, so the
+reminder and event handlers always get an answer within `EXTRACTION_TIMEOUT`.
+"""
+import contextvars
+import json
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import datetime, timedelta
+
+from google.genai import types
+
+from model_tiers import TIERS_BY_NAME
+from timerange import MONTHS, RANGE_PATTERN, WEEKDAYS, parse_time_range, user_timezone
+from tracing import metrics, span
+
+EXTRACTION_MODEL = TIERS_BY_NAME["lite"].model
+EXTRACTION_TIMEOUT = 2.0  # seconds before the local parser answers instead
+CACHE_SIZE = 1000
+
+Extraction = namedtuple("Extraction", "intent title datetime attendees priority source")
+
+INTENTS = ["add_reminder", "create_event", "other"]
+PRIORITIES = ["low", "medium", "high"]
+
+EXTRACTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "intent": {"type": "STRING", "enum": INTENTS},
+        "title": {"type": "STRING", "description": "What to be reminded of, or the event title, without the date or time"},
+        "datetime": {"type": "STRING", "description": "Local date and time as YYYY-MM-DDTHH:MM, or empty if none is given"},
+        "attendees": {"type": "ARRAY", "items": {"type": "STRING"}, "description": "Names or email addresses of people to invite"},
+        "priority": {"type": "STRING", "enum": PRIORITIES},
+    },
+    "required": ["intent", "title", "datetime", "attendees", "priority"],
+}
+
+EXTRACTION_PROMPT = """\
+Extract the reminder or calendar event from the user's message.
+The current local date and time is {now} ({weekday}).
+Resolve relative dates such as "tomorrow" or "next friday" against it.
+Use priority "medium" unless the message says otherwise.
+
+Message: {request}"""
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="extraction")
+
+
+def normalize(request):
+    return re.sub(r"\s+", " ", request.lower()).strip(" .!?")
+
+
+"""##Local Parser"""
+
+COMMAND_PATTERN = re.compile(
+    r"^\s*(?:please\s+)?(?:(?:can|could)\s+you\s+)?"
+    r"(?:(?:add|set|create)\s+(?:a\s+)?reminder(?:\s+(?:to|for|that|about))?"
+    r"|remind\s+me(?:\s+(?:to|about|that))?"
+    r"|(?:schedule|book|set\s+up|create|add|arrange)(?:\s+(?:a|an|the))?)\s*", re.IGNORECASE)
+TIME_PATTERN = re.compile(
+    r"\b(?:at\s+)?(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<ampm>[ap]\.?m\.?)(?!\w)"
+    r"|\bat\s+(?P<hour24>\d{1,2}):(?P<minute24>\d{2})\b"
+    r"|\b(?:at\s+)?(?P<named>noon|midnight)\b", re.IGNORECASE)
+# Words that follow "with" but are not names, and capitalised words that end a name
+NOT_NAMES = ["the", "my", "our", "your", "his", "her", "their", "team", "everyone", "everybody",
+             "them", "him", "us", "me", "you", "a", "an", "today", "tomorrow", "tonight"] + WEEKDAYS + MONTHS
+_NAME_WORD = r"(?!(?i:" + "|".join(NOT_NAMES) + r")\b)[A-Z][\w'-]*"
+NAME = r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+|" + _NAME_WORD + r"(?:\s+" + _NAME_WORD + r")*"
+ATTENDEES_PATTERN = re.compile(
+    r"\b(?i:with)\s+(?P<names>(?:" + NAME + r")(?:(?:\s*,\s*(?:(?i:and)\s+)?|\s+(?i:and)\s+)(?:" + NAME + r"))*)")
+RELATIVE_PATTERN = re.compile(
+    r"\b(?:in\s+(?:an?|\d+|a\s+few|half\s+an)\s+(?:min(?:ute)?s?|hours?|hrs?)|right\s+now|now)\b",
+    re.IGNORECASE)
+PRIORITY_PATTERN = re.compile(
+    r"\b(?:(?P<high>urgent|urgently|asap|important|high[\s-]priority)|(?P<low>low[\s-]priority|whenever))\b",
+    re.IGNORECASE)
+EVENT_WORDS = re.compile(r"\b(meeting|event|call|appointment|session|interview|lunch|dinner)\b", re.IGNORECASE)
+STOP_WORDS = {"about", "on", "at", "by", "for", "to", "the", "a", "an", "this", "next", "and"}
+
+
+def _time_of_day(match):
+    if match.group('named'):
+        return (12, 0) if match.group('named').lower() == 'noon' else (0, 0)
+    if match.group('hour24'):
+        return int(match.group('hour24')), int(match.group('minute24'))
+    hour, minute = int(match.group('hour')) % 12, int(match.group('minute') or 0)
+    if match.group('ampm').lower().startswith('p'):
+        hour += 12
+    return hour, minute
+
+
+def _clean_title(text):
+    words = text.split()
+    while words and words[0].lower() in STOP_WORDS:
+        words.pop(0)
+    while words and words[-1].lower() in STOP_WORDS:
+        words.pop()
+    title = " ".join(words).strip(" ,.;:!?")
+    return title[:1].upper() + title[1:]
+
+
+def local_extract(request, now=None):
+    """The extraction fields from regexes alone"""
+    now = now or datetime.now(user_timezone())
+    text = request
+    spans = []
+
+    time_match = TIME_PATTERN.search(text)
+    day_match = RANGE_PATTERN.search(text.lower())
+    moment = None
+    if day_match or time_match:
+        day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if day_match:
+            spans.append(day_match.span())
+            time_range = parse_time_range(day_match.group(0), now)
+            if time_range is not None:
+                day = datetime.fromisoformat(time_range.start).replace(hour=0, minute=0)
+        hour, minute = 9, 0  # a reminder for a day without a time
+        if time_match:
+            spans.append(time_match.span())
+            hour, minute = _time_of_day(time_match)
+        moment = day.replace(hour=hour, minute=minute)
+        if not day_match and moment < now:
+            moment += timedelta(days=1)  # "at 3pm" after 3pm means tomorrow
+
+    attendees = []
+    attendees_match = ATTENDEES_PATTERN.search(text)
+    if attendees_match:
+        spans.append(attendees_match.span())
+        attendees = re.findall(NAME, attendees_match.group('names'))
+
+    priority = "medium"
+    priority_match = PRIORITY_PATTERN.search(text)
+    if priority_match:
+        spans.append(priority_match.span())
+        priority = "high" if priority_match.group('high') else "low"
+
+    # Cut the recognised parts out of the text; what is left is the title
+    for start, end in sorted(spans, reverse=True):
+        text = text[:start] + " " + text[end:]
+    command = COMMAND_PATTERN.match(text)
+    if command:
+        text = text[command.end():]
+
+    lowered = request.lower()
+    if "remind" in lowered:
+        intent = "add_reminder"
+    elif EVENT_WORDS.search(request) and moment is not None:
+        intent = "create_event"
+    else:
+        intent = "other"
+    return Extraction(intent, _clean_title(text), moment.strftime("%Y-%m-%dT%H:%M") if moment else "",
+                      attendees, priority, "local")
+
+
+"""##Model Extraction"""
+
+def _parse(text):
+    data = json.loads(text)
+    moment = data.get("datetime") or ""
+    if moment:
+        moment = datetime.fromisoformat(moment).strftime("%Y-%m-%dT%H:%M")  # rejects malformed values
+    return Extraction(
+        data.get("intent") if data.get("intent") in INTENTS else "other",
+        (data.get("title") or "").strip(),
+        moment,
+        [a for a in data.get("attendees") or [] if isinstance(a, str) and a.strip()],
+        data.get("priority") if data.get("priority") in PRIORITIES else "medium",
+        "model",
+    )
+
+
+def _model_extract(client, request, now):
+    config = types.GenerateContentConfig(
+        temperature=0,
+        max_output_tokens=256,
+        response_mime_type="application/json",
+        response_schema=EXTRACTION_SCHEMA,
+    )
+    prompt = EXTRACTION_PROMPT.format(now=now.strftime("%Y-%m-%dT%H:%M"), weekday=now.strftime("%A"),
+                                      request=request)
+    with span('gemini.extract', model=EXTRACTION_MODEL):
+        response = client.models.generate_content(
+            model=EXTRACTION_MODEL,
+            config=config,
+            contents=[{"role": "user", "parts": [{"text": prompt}]}],
+        )
+    return _parse(response.text)
+
+
+def extract(request, client=None, now=None, timeout=EXTRACTION_TIMEOUT):
+    """Intent, title, datetime, attendees and priority of a request
+
+    Uses the model when a client is given, the local parser when there is
+    none or the model does not answer in time.
+    """
+    now = now or datetime.now(user_timezone())
+    # "in 2 hours" resolves differently every minute; other phrases only change with the day
+    moment = now.strftime("%Y-%m-%dT%H:%M") if RELATIVE_PATTERN.search(request) else now.date().isoformat()
+    key = (moment, normalize(request))
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            metrics.incr('extraction_total', source='cache')
+            return cached._replace(source='cache')
+
+    result = None
+    if client is not None:
+        future = _executor.submit(contextvars.copy_context().run, _model_extract, client, request, now)
+        try:
+            result = future.result(timeout=timeout)
+        except TimeoutError:
+            metrics.incr('extraction_fallbacks_total', reason='timeout')
+        except Exception as e:
+            print(f"Extraction failed, using the local parser: {e}")
+            metrics.incr('extraction_fallbacks_total', reason='error')
+    if result is None:
+        result = local_extract(request, now)
+    elif not result.datetime:
+        # The model found no time; keep one the local parser can see
+        result = result._replace(datetime=local_extract(request, now).datetime)
+    metrics.incr('extraction_total', source=result.source)
+
+    if result.source == 'model' or client is None:
+        # A fallback after a slow model call is not cached, so the next one can use the model
+        with _cache_lock:
+            _cache[key] = result
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return result
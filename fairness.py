@@ -0,0 +1,277 @@
+"""Per-sender rate limiting and fair scheduling in front of the assistant.
+
+Every sender has a token bucket, so one chatty user cannot use up the Gemini
+quota. Requests that pass wait for one of `MAX_CONCURRENT` execution slots,
+which are handed out by a weighted fair queue across senders (start-time fair
+queuing: each request is tagged with a virtual finish time and the smallest
+tag runs next). When the backlog is full, or a request waits too long, it is
+shed with a short canned reply instead of tying up a worker.
+
+The in-memory backend is enough for a single process. Set
+`FAIRNESS_DB=fairness.db` to share buckets and the queue between gunicorn
+workers through SQLite.
+"""
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+from ratelimit import TokenBucket
+from tracing import metrics
+
+FAIRNESS_DB = os.getenv('FAIRNESS_DB')
+
+SENDER_RATE = 0.2     # messages per second each sender may sustain
+SENDER_BURST = 5      # messages a sender may send back to back
+MAX_CONCURRENT = 4    # requests running the assistant at once
+MAX_BACKLOG = 32      # waiting requests before new ones are shed
+MAX_WAIT = 20.0       # seconds a request may wait for a slot
+LEASE_SECONDS = 120   # a running SQLite entry older than this is assumed abandoned
+POLL_INTERVAL = 0.02  # seconds between SQLite queue checks
+
+RATE_LIMITED_REPLY = "You're sending messages faster than I can keep up with. Please wait a moment and try again."
+BUSY_REPLY = "I'm handling a lot of requests right now. Please try again in a minute."
+SHED_REPLIES = (RATE_LIMITED_REPLY, BUSY_REPLY)
+
+
+class MemoryBackend:
+    """Buckets and queue for a single process"""
+
+    def __init__(self, rate=SENDER_RATE, burst=SENDER_BURST, max_concurrent=MAX_CONCURRENT):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.buckets = {}
+        self.finish = {}  # sender -> virtual finish time of their last request
+        self.virtual_time = 0.0
+        self.waiting = []  # heap of [finish, seq, sender, start]
+        self.running = 0
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+
+    def allow(self, sender):
+        with self.cond:
+            bucket = self.buckets.get(sender)
+            if bucket is None:
+                bucket = self.buckets[sender] = TokenBucket(self.rate, self.burst)
+        return bucket.try_acquire()
+
+    def enter(self, sender, weight, max_backlog):
+        """Queue a request; None when the backlog is full"""
+        with self.cond:
+            if len(self.waiting) >= max_backlog:
+                return None
+            start = max(self.virtual_time, self.finish.get(sender, 0.0))
+            ticket = [start + 1.0 / weight, next(self.seq), sender, start]
+            self.finish[sender] = ticket[0]
+            heapq.heappush(self.waiting, ticket)
+            return ticket
+
+    def wait_turn(self, ticket, timeout):
+        """Block until the ticket holds a slot; False if the timeout runs out first"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.running >= self.max_concurrent or self.waiting[0] is not ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.waiting.remove(ticket)
+                    heapq.heapify(self.waiting)
+                    self.cond.notify_all()
+                    return False
+                self.cond.wait(remaining)
+            heapq.heappop(self.waiting)
+            self.running += 1
+            self.virtual_time = max(self.virtual_time, ticket[3])
+            return True
+
+    def leave(self, ticket):
+        with self.cond:
+            self.running -= 1
+            if not self.waiting:
+                # Idle senders need no finish tags once everything has drained
+                self.finish = {s: f for s, f in self.finish.items() if f > self.virtual_time}
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {'backlog': len(self.waiting), 'running': self.running, 'senders': len(self.buckets)}
+
+
+class SQLiteBackend:
+    """Buckets and queue shared by every worker process through one SQLite file"""
+
+    def __init__(self, path, rate=SENDER_RATE, burst=SENDER_BURST, max_concurrent=MAX_CONCURRENT):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS buckets
+                        (sender TEXT PRIMARY KEY,
+                         tokens REAL NOT NULL,
+                         updated REAL NOT NULL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS senders
+                        (sender TEXT PRIMARY KEY,
+                         finish REAL NOT NULL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS queue
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         sender TEXT NOT NULL,
+                         start REAL NOT NULL,
+                         finish REAL NOT NULL,
+                         state TEXT NOT NULL DEFAULT 'waiting',
+                         heartbeat REAL NOT NULL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS fair_state
+                        (key TEXT PRIMARY KEY,
+                         value REAL NOT NULL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS queue_order ON queue (state, finish, id)')
+        conn.close()
+
+    def allow(self, sender):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE sender = ?', (sender,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + max(0.0, now - row[1]) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO buckets (sender, tokens, updated) VALUES (?, ?, ?)',
+                         (sender, tokens, now))
+            conn.execute('COMMIT')
+            return allowed
+        finally:
+            conn.close()
+
+    def _virtual_time(self, conn):
+        row = conn.execute("SELECT value FROM fair_state WHERE key = 'virtual_time'").fetchone()
+        return row[0] if row else 0.0
+
+    def enter(self, sender, weight, max_backlog):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Entries of workers that died without leaving
+            conn.execute("DELETE FROM queue WHERE state = 'running' AND heartbeat < ?", (now - LEASE_SECONDS,))
+            conn.execute("DELETE FROM queue WHERE state = 'waiting' AND heartbeat < ?", (now - MAX_WAIT,))
+            backlog = conn.execute("SELECT COUNT(*) FROM queue WHERE state = 'waiting'").fetchone()[0]
+            if backlog >= max_backlog:
+                conn.execute('ROLLBACK')
+                return None
+            row = conn.execute('SELECT finish FROM senders WHERE sender = ?', (sender,)).fetchone()
+            start = max(self._virtual_time(conn), row[0] if row else 0.0)
+            finish = start + 1.0 / weight
+            conn.execute('INSERT OR REPLACE INTO senders (sender, finish) VALUES (?, ?)', (sender, finish))
+            cursor = conn.execute('INSERT INTO queue (sender, start, finish, heartbeat) VALUES (?, ?, ?, ?)',
+                                  (sender, start, finish, now))
+            conn.execute('COMMIT')
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def wait_turn(self, ticket, timeout):
+        deadline = time.monotonic() + timeout
+        conn = self._connect()
+        try:
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                running = conn.execute("SELECT COUNT(*) FROM queue WHERE state = 'running'").fetchone()[0]
+                head = conn.execute("""SELECT id, start FROM queue WHERE state = 'waiting'
+                                       ORDER BY finish, id LIMIT 1""").fetchone()
+                if running < self.max_concurrent and head is not None and head[0] == ticket:
+                    conn.execute("UPDATE queue SET state = 'running', heartbeat = ? WHERE id = ?",
+                                 (time.time(), ticket))
+                    conn.execute("""INSERT INTO fair_state (key, value) VALUES ('virtual_time', ?)
+                                    ON CONFLICT(key) DO UPDATE SET value = max(value, excluded.value)""",
+                                 (head[1],))
+                    conn.execute('COMMIT')
+                    return True
+                if time.monotonic() >= deadline:
+                    conn.execute('DELETE FROM queue WHERE id = ?', (ticket,))
+                    conn.execute('COMMIT')
+                    return False
+                conn.execute('UPDATE queue SET heartbeat = ? WHERE id = ?', (time.time(), ticket))
+                conn.execute('COMMIT')
+                time.sleep(POLL_INTERVAL)
+        finally:
+            conn.close()
+
+    def leave(self, ticket):
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM queue WHERE id = ?', (ticket,))
+            conn.execute('''DELETE FROM senders WHERE finish <= (SELECT COALESCE(MAX(value), 0)
+                            FROM fair_state WHERE key = 'virtual_time')''')
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute('SELECT state, COUNT(*) FROM queue GROUP BY state').fetchall())
+            senders = conn.execute('SELECT COUNT(*) FROM buckets').fetchone()[0]
+        finally:
+            conn.close()
+        return {'backlog': counts.get('waiting', 0), 'running': counts.get('running', 0), 'senders': senders}
+
+
+class FairScheduler:
+    """Run callables per sender under rate limits, fair queuing and load shedding"""
+
+    def __init__(self, backend=None, weights=None, max_backlog=MAX_BACKLOG, max_wait=MAX_WAIT):
+        self.backend = backend or MemoryBackend()
+        self.weights = weights or {}  # sender -> share of the slots relative to 1.0
+        self.max_backlog = max_backlog
+        self.max_wait = max_wait
+
+    def run(self, sender, func, *args, **kwargs):
+        """func(*args, **kwargs), or a canned reply when the request is limited or shed"""
+        sender = sender or 'anonymous'
+        if not self.backend.allow(sender):
+            metrics.incr('fairness_shed_total', reason='rate_limited')
+            return RATE_LIMITED_REPLY
+
+        ticket = self.backend.enter(sender, self.weights.get(sender, 1.0), self.max_backlog)
+        if ticket is None:
+            metrics.incr('fairness_shed_total', reason='backlog')
+            return BUSY_REPLY
+
+        start = time.perf_counter()
+        admitted = self.backend.wait_turn(ticket, self.max_wait)
+        metrics.observe('fairness_wait_seconds', time.perf_counter() - start)
+        if not admitted:
+            metrics.incr('fairness_shed_total', reason='timeout')
+            return BUSY_REPLY
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.backend.leave(ticket)
+
+    def stats(self):
+        return self.backend.stats()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The process-wide scheduler, SQLite-backed when FAIRNESS_DB is set"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            backend = SQLiteBackend(FAIRNESS_DB) if FAIRNESS_DB else MemoryBackend()
+            _scheduler = FairScheduler(backend)
+            metrics.register_collector(_scheduler.stats, prefix='fairness_')
+        return _scheduler
@@ -0,0 +1,189 @@
+"""Deduplication of webhook deliveries.
+
+WhatsApp providers redeliver a webhook when the first delivery times out, so
+the same message can arrive several times. Replies are stored by the
+provider's message id: a replay gets the stored reply without calling the
+assistant again (no second reminder, event or email), and a duplicate that
+arrives while the first is still being answered waits for that answer.
+Recent keys live in an in-memory LRU in front of a SQLite table shared by
+all workers; keys expire after `KEY_TTL`. The process lock only guards the
+LRU and the in-flight map; SQLite transactions run outside it, so a slow
+write for one key does not hold up the others.
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from tracing import metrics
+
+IDEMPOTENCY_DB = 'idempotency.db'
+
+KEY_TTL = 24 * 3600    # seconds a reply is kept for replays
+PENDING_LEASE = 120    # a pending key older than this is assumed abandoned
+CACHE_SIZE = 10000
+POLL_INTERVAL = 0.05   # seconds between checks on a duplicate in flight elsewhere
+PURGE_INTERVAL = 600   # seconds between deletes of expired keys
+
+
+class IdempotencyStore:
+    def __init__(self, path=IDEMPOTENCY_DB, cache_size=CACHE_SIZE, ttl=KEY_TTL):
+        self.path = path
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.cache = OrderedDict()  # key -> (reply, expires_at)
+        self.inflight = {}          # key -> Event set once this process finishes it
+        self.lock = threading.Lock()
+        self.last_purge = 0.0
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS idempotency_keys
+                        (key TEXT PRIMARY KEY,
+                         state TEXT NOT NULL,
+                         reply TEXT,
+                         created_at REAL NOT NULL,
+                         expires_at REAL NOT NULL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idempotency_expiry ON idempotency_keys (expires_at)')
+        conn.close()
+
+    def _cached(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self.cache[key]
+                return None
+            self.cache.move_to_end(key)
+            return entry[0]
+
+    def _remember(self, key, reply, expires_at):
+        with self.lock:
+            self.cache[key] = (reply, expires_at)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _claim(self, key):
+        """('done', reply), ('pending', None) or ('claimed', None) for a new key"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT state, reply, created_at, expires_at FROM idempotency_keys WHERE key = ?',
+                               (key,)).fetchone()
+            if row is not None and row[3] >= now:
+                if row[0] == 'done':
+                    conn.execute('COMMIT')
+                    return 'done', row[1]
+                if row[2] >= now - PENDING_LEASE:
+                    conn.execute('COMMIT')
+                    return 'pending', None
+            conn.execute('''INSERT OR REPLACE INTO idempotency_keys (key, state, created_at, expires_at)
+                            VALUES (?, 'pending', ?, ?)''', (key, now, now + self.ttl))
+            conn.execute('COMMIT')
+            return 'claimed', None
+        finally:
+            conn.close()
+
+    def _release(self, key, event):
+        """Drop this thread's in-flight entry for a key and wake the duplicates waiting on it"""
+        with self.lock:
+            if self.inflight.get(key) is event:
+                del self.inflight[key]
+        event.set()
+
+    def _finish(self, key, reply):
+        conn = self._connect()
+        try:
+            if reply is None:
+                conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND state = 'pending'", (key,))
+            else:
+                expires_at = time.time() + self.ttl
+                conn.execute("UPDATE idempotency_keys SET state = 'done', reply = ?, expires_at = ? WHERE key = ?",
+                             (reply, expires_at, key))
+                self._remember(key, reply, expires_at)
+        finally:
+            conn.close()
+
+    def purge(self):
+        """Delete expired keys"""
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM idempotency_keys WHERE expires_at < ?', (time.time(),))
+        finally:
+            conn.close()
+        self.last_purge = time.time()
+
+    def run(self, key, func, cache_if=None, timeout=PENDING_LEASE):
+        """(reply, replayed): the stored reply for a seen key, otherwise func()
+
+        Replies for which `cache_if(reply)` is false are returned but not
+        stored, so a redelivery computes them again.
+        """
+        if not key:
+            return func(), False
+        if time.time() - self.last_purge > PURGE_INTERVAL:
+            self.purge()
+
+        deadline = time.monotonic() + timeout
+        while True:
+            reply = self._cached(key)
+            if reply is not None:
+                metrics.incr('idempotency_replays_total', source='memory')
+                return reply, True
+
+            # Take the key in memory first so duplicates in this process wait
+            # on the event instead of queueing on SQLite
+            with self.lock:
+                event = self.inflight.get(key)
+                claiming = event is None
+                if claiming:
+                    event = self.inflight[key] = threading.Event()
+            if not claiming:
+                # A duplicate of a request this process is still answering
+                event.wait(max(0.0, deadline - time.monotonic()))
+            else:
+                try:
+                    state, reply = self._claim(key)
+                except Exception:
+                    self._release(key, event)
+                    raise
+                if state == 'claimed':
+                    break
+                if state == 'done':
+                    self._remember(key, reply, time.time() + self.ttl)
+                self._release(key, event)
+                if state == 'done':
+                    metrics.incr('idempotency_replays_total', source='sqlite')
+                    return reply, True
+                time.sleep(POLL_INTERVAL)  # being answered by another worker
+            if time.monotonic() >= deadline:
+                metrics.incr('idempotency_wait_timeouts_total')
+                return func(), False
+
+        reply = None
+        try:
+            reply = func()
+            return reply, False
+        finally:
+            self._finish(key, reply if reply is not None and (cache_if is None or cache_if(reply)) else None)
+            self._release(key, event)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_idempotency_store():
+    """The process-wide idempotency store, created on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = IdempotencyStore()
+        return _store
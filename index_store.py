@@ -0,0 +1,140 @@
+"""Shared loader for FAISS indexes saved on disk.
+
+Indexes are written atomically with `faiss.write_index` and opened with
+`READ_FLAGS`. `IO_FLAG_MMAP_IFC` maps the codes of flat-code indexes
+(`IndexFlat`, `IndexScalarQuantizer`) straight from the file, so every
+gunicorn worker shares the same page cache pages instead of holding its own
+copy (plain `IO_FLAG_MMAP` still copies an `IndexIDMap2(IndexFlatIP)` into
+each process). A mapped index is read-only; copy it with `writable_copy`
+before adding or removing vectors. When a newer file is saved (by this or
+another process) the next `get` swaps it in; readers still holding the old
+index keep using it until they drop their reference.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import faiss
+
+INDEX_DIR = 'indexes'
+CHECK_INTERVAL = 1.0  # seconds between checks for a newer file on disk
+READ_FLAGS = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_MMAP
+
+
+def writable_copy(index):
+    """An in-memory copy of a mapped index; `clone_index` would keep viewing the file"""
+    return faiss.deserialize_index(faiss.serialize_index(index))
+
+
+class IndexManager:
+    def __init__(self, directory=INDEX_DIR):
+        self.directory = directory
+        self._loaded = {}   # name -> (index, file version, loaded_at)
+        self._checked = {}  # name -> monotonic time of the last stat
+        self._reloads = {}
+        self.lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.faiss")
+
+    def _meta_path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _file_version(self, name):
+        try:
+            st = os.stat(self.path(name))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def version(self, name):
+        """Identifies the file currently on disk; None if it was never saved"""
+        return self._file_version(name)
+
+    def save(self, name, index, build_seconds=None):
+        """Write an index atomically and swap it in for this process"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        faiss.write_index(index, tmp_path)
+        meta = {
+            'ntotal': int(index.ntotal),
+            'dimension': int(index.d),
+            'build_seconds': build_seconds,
+            'saved_at': datetime.now().isoformat(),
+        }
+        with open(f"{tmp_path}.json", 'w') as f:
+            json.dump(meta, f)
+        os.replace(f"{tmp_path}.json", self._meta_path(name))
+        os.replace(tmp_path, path)
+        with self.lock:
+            self._checked.pop(name, None)
+        return self.get(name)
+
+    def build(self, name, builder):
+        """Build an index with `builder()`, record how long it took and save it"""
+        start = time.perf_counter()
+        index = builder()
+        return self.save(name, index, build_seconds=time.perf_counter() - start)
+
+    def get(self, name):
+        """The memory-mapped index, reopened if a newer file was saved; None if missing"""
+        now = time.monotonic()
+        with self.lock:
+            loaded = self._loaded.get(name)
+            if loaded is not None and now - self._checked.get(name, 0) < CHECK_INTERVAL:
+                return loaded[0]
+            self._checked[name] = now
+            version = self._file_version(name)
+            if version is None:
+                self._loaded.pop(name, None)
+                return None
+            if loaded is not None and loaded[1] == version:
+                return loaded[0]
+            index = faiss.read_index(self.path(name), READ_FLAGS)
+            if loaded is not None:
+                self._reloads[name] = self._reloads.get(name, 0) + 1
+            self._loaded[name] = (index, version, datetime.now().isoformat())
+            return index
+
+    def stats(self, name):
+        """Size and build statistics for one index"""
+        meta = {}
+        if os.path.exists(self._meta_path(name)):
+            with open(self._meta_path(name)) as f:
+                meta = json.load(f)
+        version = self._file_version(name)
+        with self.lock:
+            loaded = self._loaded.get(name)
+            reloads = self._reloads.get(name, 0)
+        return {
+            'name': name,
+            'ntotal': int(loaded[0].ntotal) if loaded else meta.get('ntotal'),
+            'dimension': meta.get('dimension'),
+            'file_bytes': version[2] if version else 0,
+            'build_seconds': meta.get('build_seconds'),
+            'saved_at': meta.get('saved_at'),
+            'loaded_at': loaded[2] if loaded else None,
+            'reloads': reloads,
+        }
+
+    def all_stats(self):
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(f[:-len('.faiss')] for f in os.listdir(self.directory) if f.endswith('.faiss'))
+        return [self.stats(name) for name in names]
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_index_manager():
+    """The process-wide index manager"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = IndexManager()
+    return _manager
@@ -0,0 +1,177 @@
+"""Model selection for the Gemini fallback.
+
+Requests are scored for complexity locally, from their intent and a few
+planning markers, and sent to the cheapest tier that should handle them:
+canned replies for bare greetings and "who are you", a lite model for short
+lookups and "what can you do", the default flash model, and a pro model for
+multi-step planning such as project plans and gym schedules. An empty or
+truncated reply is retried one tier up. Errors are not: rate limits and
+transport failures are retried on the same tier with backoff, and anything
+else is raised, so a quota error on a cheap tier never turns into pro calls. Latency, tokens and estimated cost are recorded per
+tier on `/metrics` so the thresholds can be tuned.
+"""
+import re
+import time
+from collections import namedtuple
+
+import httpx
+from google.genai import errors, types
+
+from prompting import count_tokens
+from tracing import metrics, span
+
+Tier = namedtuple("Tier", "name model temperature input_price output_price thinking")
+
+# Prices are USD per million tokens (list prices; update when they change).
+# Only the flash tier takes a thinking budget: lite has no thinking and pro
+# cannot turn it off.
+TIERS = [
+    Tier("canned", None, None, 0.0, 0.0, False),
+    Tier("lite", "gemini-2.0-flash-lite", 1.0, 0.075, 0.30, False),
+    Tier("flash", "gemini-2.5-flash-preview-05-20", 2, 0.15, 3.50, True),
+    Tier("pro", "gemini-2.5-pro-preview-05-06", 1.0, 1.25, 10.0, False),
+]
+TIERS_BY_NAME = {tier.name: tier for tier in TIERS}
+
+CANNED_REPLIES = {
+    "greeting": "Hello! How can I help you today?",
+    "identity": "I am Sonia, Chrispine's Personal assistant, how can i help you?",
+}
+CANNED_MAX_WORDS = 6
+
+RETRY_ATTEMPTS = 3     # calls per tier when rate limited or the connection fails
+RETRY_BACKOFF = 1.0    # seconds before the first retry, doubled for each one after
+RETRY_CODES = {429, 500, 503, 504}
+
+# Complexity before planning markers and length are added
+INTENT_COMPLEXITY = {
+    "greeting": 0.0,
+    "identity": 0.0,
+    "capabilities": 0.1,
+    "news": 0.2,
+    "calendar_read": 0.2,
+    "email_read": 0.2,
+    "image": 0.4,
+    "calendar_create": 0.4,
+    "email_send": 0.4,
+    "general": 0.4,
+    "classes": 0.6,
+    "project": 0.7,
+    "gym": 0.7,
+}
+PLANNING_MARKERS = re.compile(
+    r"\b(plan|planning|break (it )?down|steps?|milestones?|timetable|every|each|weekly|"
+    r"over the next|for (the|this|next) (week|month)|and then|prioriti[sz]e)\b")
+
+LITE_BELOW = 0.35  # scores below this go to the lite tier
+PRO_FROM = 0.65    # scores from this go to the pro tier
+
+
+def score_complexity(request, intent):
+    """A rough 0-1 estimate of how much reasoning a request needs"""
+    words = len(request.split())
+    markers = len(PLANNING_MARKERS.findall(request.lower()))
+    score = INTENT_COMPLEXITY.get(intent, INTENT_COMPLEXITY["general"])
+    score += min(0.3, 0.1 * markers) + min(0.2, words / 200)
+    return min(1.0, score)
+
+
+def choose_tier(request, intent):
+    if intent in CANNED_REPLIES and len(request.split()) <= CANNED_MAX_WORDS:
+        return TIERS_BY_NAME["canned"]
+    score = score_complexity(request, intent)
+    if score < LITE_BELOW:
+        return TIERS_BY_NAME["lite"]
+    if score < PRO_FROM:
+        return TIERS_BY_NAME["flash"]
+    return TIERS_BY_NAME["pro"]
+
+
+def record_token_usage(record, model, response):
+    """Add the token counts of a Gemini response to its span and the metrics"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return
+    for kind, field in (('prompt', 'prompt_token_count'), ('output', 'candidates_token_count'),
+                        ('thoughts', 'thoughts_token_count')):
+        count = getattr(usage, field, None) or 0
+        record[f"{kind}_tokens"] = count
+        metrics.incr('gemini_tokens_total', count, model=model, kind=kind)
+
+
+def _truncated(response):
+    candidates = getattr(response, 'candidates', None) or []
+    reason = getattr(candidates[0], 'finish_reason', None) if candidates else None
+    return str(reason).endswith('MAX_TOKENS')
+
+
+def _config(tier, plan):
+    thinking = None
+    if tier.thinking and plan.thinking_budget is not None:
+        thinking = types.ThinkingConfig(thinking_budget=plan.thinking_budget)
+    return types.GenerateContentConfig(
+        temperature=tier.temperature,
+        top_p=0.95,
+        top_k=40,
+        max_output_tokens=plan.max_output_tokens,
+        thinking_config=thinking,
+    )
+
+
+def _record(tier, plan, seconds, record, text, outcome):
+    # Fall back to the local estimate when the response carries no usage metadata
+    prompt_tokens = record.get('prompt_tokens') or plan.prompt_tokens
+    output_tokens = (record.get('output_tokens') or count_tokens(text or "")) + record.get('thoughts_tokens', 0)
+    cost = 0.0
+    if outcome != 'error':  # failed calls are not billed
+        cost = (prompt_tokens * tier.input_price + output_tokens * tier.output_price) / 1e6
+    metrics.observe('model_tier_seconds', seconds, tier=tier.name)
+    metrics.incr('model_tier_calls_total', tier=tier.name, intent=plan.intent, outcome=outcome)
+    metrics.incr('model_tier_cost_usd_total', cost, tier=tier.name)
+
+
+def _retriable(error):
+    if isinstance(error, errors.APIError):
+        return error.code in RETRY_CODES
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+def generate(client, request, plan):
+    """Answer a request at the cheapest suitable tier, escalating on an empty or truncated reply"""
+    tier = choose_tier(request, plan.intent)
+    if tier.model is None:
+        metrics.incr('model_tier_calls_total', tier=tier.name, intent=plan.intent, outcome='ok')
+        return CANNED_REPLIES[plan.intent]
+
+    fallback = None
+    for tier in TIERS[TIERS.index(tier):]:
+        for attempt in range(RETRY_ATTEMPTS):
+            start = time.perf_counter()
+            try:
+                with span('gemini.generate_content', model=tier.model, tier=tier.name, intent=plan.intent,
+                          prompt_tokens_estimate=plan.prompt_tokens, attempt=attempt) as record:
+                    response = client.models.generate_content(
+                        model=tier.model,
+                        config=_config(tier, plan),
+                        contents=[{"role": "user", "parts": [{"text": plan.text}]}],
+                    )
+                    record_token_usage(record, tier.model, response)
+                break
+            except Exception as e:
+                _record(tier, plan, time.perf_counter() - start, record, None, 'error')
+                if _retriable(e) and attempt < RETRY_ATTEMPTS - 1:
+                    time.sleep(RETRY_BACKOFF * 2 ** attempt)
+                    continue
+                if fallback:
+                    return fallback  # a truncated reply from the tier below beats none
+                raise
+        text = response.text
+        if text and not _truncated(response):
+            _record(tier, plan, time.perf_counter() - start, record, text, 'ok')
+            return text
+        _record(tier, plan, time.perf_counter() - start, record, text, 'escalated')
+        fallback = text or fallback
+
+    if fallback:
+        return fallback  # a truncated reply beats none
+    return "Sorry, I couldn't come up with an answer to that. Please try rephrasing it."
@@ -0,0 +1,328 @@
+"""Cached client for NewsAPI.
+
+Requests share a pooled `requests.Session` and results are cached per
+(endpoint, category, query) for `NEWS_TTL` seconds. Concurrent requests for
+the same key wait on a single upstream fetch, and results older than the TTL
+but within `STALE_TTL` are served immediately while a background fetch
+refreshes them (stale-while-revalidate).
+
+`NewsPrefetcher` refreshes top headlines for general news and each category
+in the background, at a cadence set by how often each is requested, and keeps
+the formatted replies in memory. Only one process prefetches at a time, the
+holder of a lease in SQLite, and it stops for the day once it has made
+`PREFETCH_DAILY_BUDGET` upstream requests, so idle servers cannot use up the
+NewsAPI quota.
+"""
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from tracing import metrics, span
+
+NEWS_BASE_URL = "https://newsapi.org/v2/"
+NEWS_COUNTRY = "us"  # top-headlines needs a country, category or query
+PAGE_SIZE = 100      # fetched once per key, sliced per request
+
+NEWS_TTL = 300       # seconds a result is fresh
+STALE_TTL = 3600     # seconds a stale result may still be served
+REQUEST_TIMEOUT = (3, 10)  # connect, read
+
+
+def news_request(category=None, query=None):
+    """The endpoint and parameters for a category or query request"""
+    if query:
+        return "everything", {"q": query, "sortBy": "publishedAt", "language": "en"}
+    params = {"country": NEWS_COUNTRY}
+    if category:
+        params["category"] = category
+    return "top-headlines", params
+
+
+class NewsClient:
+    def __init__(self, api_key, ttl=NEWS_TTL, stale_ttl=STALE_TTL, timeout=REQUEST_TIMEOUT):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["X-Api-Key"] = api_key or ""
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=16,
+            max_retries=Retry(total=2, backoff_factor=0.3,
+                              status_forcelist=[502, 503, 504], allowed_methods=["GET"]))
+        self.session.mount("https://", adapter)
+        self._cache = {}     # key -> (fetched_at, articles)
+        self._inflight = {}  # key -> Future of the upstream fetch
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="news")
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0,
+                       "coalesced": 0, "upstream_calls": 0, "upstream_errors": 0}
+
+    def _fetch_upstream(self, key):
+        endpoint, category, query = key
+        _, params = news_request(category, query)
+        params["pageSize"] = PAGE_SIZE
+        with self._lock:
+            self._stats["upstream_calls"] += 1
+        try:
+            with span('newsapi.fetch', endpoint=endpoint, category=category):
+                response = self.session.get(NEWS_BASE_URL + endpoint, params=params, timeout=self.timeout)
+                response.raise_for_status()
+                articles = response.json().get("articles", [])
+        except Exception:
+            with self._lock:
+                self._stats["upstream_errors"] += 1
+                self._inflight.pop(key, None)
+            raise
+        with self._lock:
+            self._cache[key] = (time.monotonic(), articles)
+            self._inflight.pop(key, None)
+        return articles
+
+    def _refresh(self, key):
+        """Start an upstream fetch for `key`, or join the one in flight"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                return future
+            # Run in the caller's context so the fetch shows up in its request trace
+            context = contextvars.copy_context()
+            future = self._inflight[key] = self._executor.submit(context.run, self._fetch_upstream, key)
+            return future
+
+    def get(self, category=None, query=None, num_articles=5):
+        """Articles for a category or query; raises requests exceptions on failure"""
+        endpoint, _ = news_request(category, query)
+        key = (endpoint, category, query)
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            age = time.monotonic() - cached[0]
+            if age < self.ttl:
+                with self._lock:
+                    self._stats["hits"] += 1
+                return cached[1][:num_articles]
+            if age < self.stale_ttl:
+                with self._lock:
+                    self._stats["stale_hits"] += 1
+                self._refresh(key)
+                return cached[1][:num_articles]
+        with self._lock:
+            self._stats["misses"] += 1
+        return self._refresh(key).result()[:num_articles]
+
+    def refresh(self, category=None, query=None, num_articles=5):
+        """Fetch from upstream regardless of the cache, joining any fetch in flight"""
+        endpoint, _ = news_request(category, query)
+        return self._refresh((endpoint, category, query)).result()[:num_articles]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached_keys"] = len(self._cache)
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["stale_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+"""##Prefetching"""
+
+MIN_PREFETCH_INTERVAL = 120    # seconds, for the most requested categories
+MAX_PREFETCH_INTERVAL = 1800   # seconds, for categories nobody asked for
+DEMAND_WINDOW = 3600           # seconds of request history used to set the cadence
+
+PREFETCH_DB = 'news.db'
+PREFETCH_LEASE = 300           # seconds before a lease left by a stopped process is taken over
+PREFETCH_DAILY_BUDGET = int(os.getenv('NEWS_PREFETCH_BUDGET', '50'))  # NewsAPI's free plan allows 100 a day
+
+
+def init_prefetch_db(path=PREFETCH_DB):
+    """Initialize the prefetch lease and request budget tables"""
+    conn = sqlite3.connect(path, timeout=30)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS prefetch_locks
+                 (name TEXT PRIMARY KEY,
+                  owner TEXT NOT NULL,
+                  expires_at REAL NOT NULL)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS prefetch_budget
+                 (day TEXT PRIMARY KEY,
+                  requests INTEGER NOT NULL)''')
+    conn.commit()
+    conn.close()
+
+
+def acquire_prefetch_lease(owner, path=PREFETCH_DB, lease=PREFETCH_LEASE):
+    """Take or renew the prefetch lease unless another owner holds an unexpired one"""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute("SELECT owner, expires_at FROM prefetch_locks WHERE name = 'news'").fetchone()
+        if row is not None and row[0] != owner and row[1] > time.time():
+            conn.execute('ROLLBACK')
+            return False
+        conn.execute("INSERT OR REPLACE INTO prefetch_locks (name, owner, expires_at) VALUES ('news', ?, ?)",
+                     (owner, time.time() + lease))
+        conn.execute('COMMIT')
+        return True
+    finally:
+        conn.close()
+
+
+def release_prefetch_lease(owner, path=PREFETCH_DB):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("DELETE FROM prefetch_locks WHERE name = 'news' AND owner = ?", (owner,))
+    conn.commit()
+    conn.close()
+
+
+def spend_prefetch_request(path=PREFETCH_DB, budget=PREFETCH_DAILY_BUDGET, day=None):
+    """Count one upstream request against today's budget; False once it is used up"""
+    day = (day or date.today()).isoformat()
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT requests FROM prefetch_budget WHERE day = ?', (day,)).fetchone()
+        used = row[0] if row else 0
+        if used >= budget:
+            conn.execute('ROLLBACK')
+            return False
+        conn.execute('INSERT OR REPLACE INTO prefetch_budget (day, requests) VALUES (?, ?)', (day, used + 1))
+        conn.execute('DELETE FROM prefetch_budget WHERE day < ?', (day,))
+        conn.execute('COMMIT')
+        return True
+    finally:
+        conn.close()
+
+
+class NewsPrefetcher:
+    """Keep formatted top headlines ready for general news and each category"""
+
+    def __init__(self, client, categories, formatter, num_articles=5, digest=None,
+                 path=PREFETCH_DB, daily_budget=PREFETCH_DAILY_BUDGET):
+        self.client = client
+        self.path = path
+        self.daily_budget = daily_budget
+        self.owner = f"{os.getpid()}:{id(self)}"
+        self._out_of_budget = None  # the day the budget ran out, so it is reported once
+        self.categories = [None] + list(categories)
+        self.formatter = formatter
+        self.num_articles = num_articles
+        self.digest = digest  # optional articles -> Stories deduplication stage
+        self._ready = {}     # category -> formatted reply
+        self._stories = {}   # category -> Stories, when a digest stage is set
+        self._next_due = {}  # category -> monotonic time of the next refresh
+        self._requests = {category: deque() for category in self.categories}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        init_prefetch_db(path)
+
+    def record_request(self, category):
+        now = time.monotonic()
+        with self._lock:
+            history = self._requests.setdefault(category, deque())
+            history.append(now)
+            while history and history[0] < now - DEMAND_WINDOW:
+                history.popleft()
+
+    def interval(self, category):
+        """Refresh more often the more a category is asked for"""
+        now = time.monotonic()
+        with self._lock:
+            history = self._requests.get(category, ())
+            recent = sum(1 for t in history if t >= now - DEMAND_WINDOW)
+        return max(MIN_PREFETCH_INTERVAL, min(MAX_PREFETCH_INTERVAL, DEMAND_WINDOW / (recent + 1)))
+
+    def lookup(self, category, profile=None):
+        """The prefetched reply for a category, or None if it is not ready yet.
+
+        With an interest profile vector the deduplicated stories are ranked for
+        that user instead of returning the shared reply.
+        """
+        self.record_request(category)
+        with self._lock:
+            reply = self._ready.get(category)
+            stories = self._stories.get(category)
+            if category not in self._next_due:
+                self._next_due[category] = 0  # unseen category, fetch it on the next pass
+                self._wakeup.set()
+        if profile is not None and stories:
+            return self.formatter(stories.ranked(profile, self.num_articles))
+        return reply
+
+    def refresh(self, category):
+        limit = PAGE_SIZE if self.digest else self.num_articles
+        try:
+            articles = self.client.refresh(category=category, num_articles=limit)
+            stories = self.digest(articles) if self.digest and articles else None
+        except Exception as e:
+            print(f"News prefetch failed for {category or 'general'}: {e}")
+            return
+        if stories is not None:
+            with self._lock:
+                self._stories[category] = stories
+                self._ready[category] = self.formatter(stories.top(self.num_articles))
+        elif articles:
+            with self._lock:
+                self._ready[category] = self.formatter(articles)
+
+    def run_once(self):
+        """Refresh every category that is due; seconds until the next one is
+
+        Does nothing in a process that does not hold the prefetch lease, and
+        checks again well before a holder's lease would expire.
+        """
+        if not acquire_prefetch_lease(self.owner, self.path):
+            metrics.incr('news_prefetch_runs_total', outcome='follower')
+            return PREFETCH_LEASE / 3
+        now = time.monotonic()
+        with self._lock:
+            categories = list(dict.fromkeys(self.categories + list(self._next_due)))
+            due = [c for c in categories if self._next_due.get(c, 0) <= now]
+        for category in due:
+            if not spend_prefetch_request(self.path, self.daily_budget):
+                if self._out_of_budget != date.today():
+                    self._out_of_budget = date.today()
+                    print(f"News prefetch used its {self.daily_budget} requests for today; "
+                          f"news is fetched on demand until tomorrow")
+                metrics.incr('news_prefetch_runs_total', outcome='out_of_budget')
+                retry = time.monotonic() + MAX_PREFETCH_INTERVAL
+                with self._lock:
+                    self._next_due.update({c: retry for c in due if self._next_due.get(c, 0) <= now})
+                break
+            self.refresh(category)
+            next_due = time.monotonic() + self.interval(category)
+            with self._lock:
+                self._next_due[category] = next_due
+        else:
+            metrics.incr('news_prefetch_runs_total', outcome='ok')
+        with self._lock:
+            next_due = min(self._next_due.values(), default=now + MIN_PREFETCH_INTERVAL)
+        return min(PREFETCH_LEASE / 3, max(0.0, next_due - time.monotonic()))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.run_once())
+            self._wakeup.clear()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='news-prefetch', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        release_prefetch_lease(self.owner, self.path)
@@ -0,0 +1,162 @@
+"""Deduplication and personal ranking of news articles.
+
+Each prefetch cycle embeds every article's title and description in one
+batch, groups near-duplicate stories from different sources with a FAISS
+range search and keeps one representative per story. At reply time the
+stories are ranked against the user's interest profile, an exponential
+moving average of the embeddings of their past news requests. Profile
+updates run on one shared background thread (`queue_profile_update`), so a
+news request never waits for them and they never overlap.
+"""
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import faiss
+import numpy as np
+
+from embeddings import get_embedding_service
+
+NEWS_DB = 'news.db'
+
+DUPLICATE_THRESHOLD = 0.82  # cosine similarity above which two articles are one story
+PROFILE_DECAY = 0.8         # weight kept by the old profile on every update
+COVERAGE_WEIGHT = 0.05      # bonus per extra source covering a story
+
+# One worker: updates are read-modify-write, so running them in order keeps none from being lost
+_profile_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="interest-profile")
+
+
+def article_text(article):
+    return f"{article.get('title') or ''}. {article.get('description') or ''}"
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class Stories:
+    """Deduplicated stories of one prefetch cycle, in default order"""
+
+    def __init__(self, articles, vectors):
+        self.articles = articles  # representative article per story
+        self.vectors = vectors    # normalized centroid per story, one row each
+
+    def __len__(self):
+        return len(self.articles)
+
+    def top(self, n):
+        return self.articles[:n]
+
+    def ranked(self, profile, n):
+        """The n stories closest to a profile vector"""
+        if profile is None or not self.articles:
+            return self.top(n)
+        coverage = np.array([len(a.get('related_sources', [])) for a in self.articles], dtype='float32')
+        scores = self.vectors @ profile + COVERAGE_WEIGHT * coverage
+        order = np.argsort(-scores)[:n]
+        return [self.articles[i] for i in order]
+
+
+def cluster_duplicates(vectors, threshold=DUPLICATE_THRESHOLD):
+    """Group row indices whose vectors are within the cosine threshold"""
+    n = len(vectors)
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    lims, _, neighbours = index.range_search(vectors, threshold)
+    for i in range(n):
+        for j in neighbours[lims[i]:lims[i + 1]]:
+            root_i, root_j = find(i), find(int(j))
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters = {}
+    for i in range(n):
+        clusters.setdefault(find(i), []).append(i)
+    return list(clusters.values())
+
+
+def build_stories(articles, embedder=None):
+    """Deduplicate articles into stories, most widely covered first"""
+    articles = [a for a in articles if a.get('title') and a.get('title') != '[Removed]']
+    if not articles:
+        return Stories([], np.zeros((0, 1), dtype='float32'))
+    embedder = embedder or get_embedding_service()
+    vectors = embedder.encode([article_text(a) for a in articles])
+
+    # Larger clusters first; ties keep the upstream (most recent first) order
+    clusters = sorted(cluster_duplicates(vectors), key=lambda c: (-len(c), c[0]))
+    stories = []
+    for members in clusters:
+        representative = dict(articles[members[0]])
+        sources = {articles[i].get('source', {}).get('name') for i in members[1:]}
+        sources.discard(None)
+        sources.discard(representative.get('source', {}).get('name'))
+        representative['related_sources'] = sorted(sources)
+        stories.append(representative)
+    centroids = _normalize(np.vstack([vectors[members].mean(axis=0) for members in clusters]))
+    return Stories(stories, centroids.astype('float32'))
+
+
+"""##Interest Profiles"""
+
+def init_news_db():
+    """Initialize the interest profile table"""
+    conn = sqlite3.connect(NEWS_DB)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS interest_profiles
+                 (user_id TEXT PRIMARY KEY,
+                  vector BLOB NOT NULL,
+                  updates INTEGER DEFAULT 0,
+                  updated_at TEXT NOT NULL)''')
+    conn.commit()
+    conn.close()
+
+
+def get_interest_profile(user_id):
+    """A user's normalized profile vector, or None before their first news request"""
+    init_news_db()
+    conn = sqlite3.connect(NEWS_DB)
+    row = conn.execute('SELECT vector FROM interest_profiles WHERE user_id = ?', (user_id,)).fetchone()
+    conn.close()
+    return np.frombuffer(row[0], dtype='float32') if row else None
+
+
+def update_interest_profile(user_id, text, embedder=None):
+    """Move a user's profile towards the embedding of a news request"""
+    embedder = embedder or get_embedding_service()
+    vector = embedder.encode([text])[0]
+    profile = get_interest_profile(user_id)
+    if profile is not None and profile.shape == vector.shape:
+        vector = PROFILE_DECAY * profile + (1 - PROFILE_DECAY) * vector
+    vector = _normalize(vector).astype('float32')
+    conn = sqlite3.connect(NEWS_DB)
+    conn.execute('''INSERT INTO interest_profiles (user_id, vector, updates, updated_at)
+                    VALUES (?, ?, 1, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET vector = excluded.vector,
+                        updates = updates + 1, updated_at = excluded.updated_at''',
+                 (user_id, vector.tobytes(), datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+    return vector
+
+
+def _report_failure(future):
+    if future.exception() is not None:
+        print(f"Interest profile update failed: {future.exception()}")
+
+
+def queue_profile_update(user_id, text):
+    """Update a user's profile on the shared background thread"""
+    future = _profile_executor.submit(update_interest_profile, user_id, text)
+    future.add_done_callback(_report_failure)
+    return future
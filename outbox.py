@@ -0,0 +1,247 @@
+"""Persistent outbox for emails sent from the assistant.
+
+Emails are queued in SQLite and delivered by a background worker, so the
+webhook returns as soon as the message is stored. The worker respects the
+Gmail sending quota with token buckets and retries transient errors with
+exponential backoff. The buckets live in the outbox database, so workers in
+several processes share one quota instead of each sending at the full rate.
+A worker claims a message before taking a token, so a claim lost to another
+worker costs no quota.
+"""
+import socket
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from ratelimit import SqliteTokenBucket
+
+OUTBOX_DB = 'outbox.db'
+
+MAX_ATTEMPTS = 5
+BASE_BACKOFF = 2  # seconds, doubled on every attempt
+LEASE_SECONDS = 120  # a 'sending' row older than this is assumed abandoned
+QUOTA_WAIT = LEASE_SECONDS / 2  # longest wait for quota while holding a claim
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+# messages.send costs 100 of the 250 per-user quota units per second,
+# and consumer accounts may send about 500 messages a day.
+SEND_RATE = 2
+SEND_BURST = 5
+DAILY_LIMIT = 500
+
+
+def init_outbox_db():
+    """Initialize the outbox table"""
+    conn = sqlite3.connect(OUTBOX_DB)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS outbox
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  recipient TEXT NOT NULL,
+                  subject TEXT NOT NULL,
+                  raw TEXT NOT NULL,
+                  status TEXT NOT NULL DEFAULT 'queued',
+                  attempts INTEGER DEFAULT 0,
+                  last_error TEXT,
+                  created_at TEXT NOT NULL,
+                  next_attempt_at TEXT NOT NULL,
+                  claimed_at TEXT,
+                  sent_at TEXT,
+                  message_id TEXT)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS outbox_pending
+                 ON outbox (status, next_attempt_at)''')
+    conn.commit()
+    conn.close()
+
+
+def enqueue_email(to, subject, raw):
+    """Store an encoded message for delivery and wake the worker"""
+    init_outbox_db()
+    conn = sqlite3.connect(OUTBOX_DB)
+    c = conn.cursor()
+    now = datetime.now().isoformat()
+    c.execute('''INSERT INTO outbox (recipient, subject, raw, created_at, next_attempt_at)
+                 VALUES (?, ?, ?, ?, ?)''',
+              (to, subject, raw, now, now))
+    conn.commit()
+    outbox_id = c.lastrowid
+    conn.close()
+    if _worker is not None:
+        _worker.wake()
+    return outbox_id
+
+
+def get_email_status(outbox_id):
+    """Get the delivery status of a queued email"""
+    init_outbox_db()
+    conn = sqlite3.connect(OUTBOX_DB)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute('''SELECT id, recipient, subject, status, attempts, last_error,
+                        created_at, sent_at
+                 FROM outbox WHERE id = ?''', (outbox_id,))
+    row = c.fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def list_outbox(limit=5):
+    """Get the most recently queued emails"""
+    init_outbox_db()
+    conn = sqlite3.connect(OUTBOX_DB)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute('''SELECT id, recipient, subject, status, attempts, last_error,
+                        created_at, sent_at
+                 FROM outbox ORDER BY id DESC LIMIT ?''', (limit,))
+    rows = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return rows
+
+
+def _has_due():
+    conn = sqlite3.connect(OUTBOX_DB, timeout=30)
+    now = datetime.now()
+    expired = (now - timedelta(seconds=LEASE_SECONDS)).isoformat()
+    row = conn.execute('''SELECT 1 FROM outbox
+                          WHERE (status IN ('queued', 'retrying') AND next_attempt_at <= ?)
+                             OR (status = 'sending' AND claimed_at < ?)
+                          LIMIT 1''', (now.isoformat(), expired)).fetchone()
+    conn.close()
+    return row is not None
+
+
+def _claim_next():
+    """Atomically mark the next due message as 'sending' and return it"""
+    conn = sqlite3.connect(OUTBOX_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    now = datetime.now()
+    expired = (now - timedelta(seconds=LEASE_SECONDS)).isoformat()
+    try:
+        c.execute('BEGIN IMMEDIATE')
+        c.execute('''SELECT * FROM outbox
+                     WHERE (status IN ('queued', 'retrying') AND next_attempt_at <= ?)
+                        OR (status = 'sending' AND claimed_at < ?)
+                     ORDER BY next_attempt_at, id LIMIT 1''',
+                  (now.isoformat(), expired))
+        row = c.fetchone()
+        if row is not None:
+            c.execute('''UPDATE outbox SET status = 'sending', claimed_at = ?,
+                                attempts = attempts + 1
+                         WHERE id = ?''', (now.isoformat(), row['id']))
+        c.execute('COMMIT')
+    except Exception:
+        c.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    claimed = dict(row)
+    claimed['attempts'] += 1
+    return claimed
+
+
+def _release(outbox_id, retry_at):
+    """Give a claimed message back, untried, to be picked up at `retry_at`"""
+    conn = sqlite3.connect(OUTBOX_DB, timeout=30)
+    conn.execute('''UPDATE outbox SET status = CASE WHEN attempts > 1 THEN 'retrying' ELSE 'queued' END,
+                           attempts = attempts - 1, claimed_at = NULL, next_attempt_at = ?
+                    WHERE id = ?''', (retry_at.isoformat(), outbox_id))
+    conn.commit()
+    conn.close()
+
+
+def _mark_sent(outbox_id, message_id):
+    conn = sqlite3.connect(OUTBOX_DB, timeout=30)
+    conn.execute('''UPDATE outbox SET status = 'sent', sent_at = ?, message_id = ?,
+                           last_error = NULL
+                    WHERE id = ?''',
+                 (datetime.now().isoformat(), message_id, outbox_id))
+    conn.commit()
+    conn.close()
+
+
+def _mark_failed(outbox_id, error, retry_at=None):
+    conn = sqlite3.connect(OUTBOX_DB, timeout=30)
+    if retry_at is None:
+        conn.execute('''UPDATE outbox SET status = 'failed', last_error = ?
+                        WHERE id = ?''', (error, outbox_id))
+    else:
+        conn.execute('''UPDATE outbox SET status = 'retrying', last_error = ?,
+                               next_attempt_at = ?
+                        WHERE id = ?''', (error, retry_at.isoformat(), outbox_id))
+    conn.commit()
+    conn.close()
+
+
+def is_transient(error):
+    """True for rate limiting, server side and network errors"""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is not None:
+        return int(status) in TRANSIENT_STATUS
+    return isinstance(error, (ConnectionError, TimeoutError, socket.timeout))
+
+
+class OutboxWorker(threading.Thread):
+    """Deliver queued emails through `send(raw)` within the sending quota"""
+
+    def __init__(self, send, rate_limit=None, daily_limit=None, poll_interval=5.0):
+        super().__init__(name='outbox-worker', daemon=True)
+        self.send = send
+        self.rate_limit = rate_limit or SqliteTokenBucket(OUTBOX_DB, 'send', SEND_RATE, SEND_BURST)
+        self.daily_limit = daily_limit or SqliteTokenBucket(OUTBOX_DB, 'daily', DAILY_LIMIT / 86400, DAILY_LIMIT)
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def run(self):
+        init_outbox_db()
+        while not self._stopped.is_set():
+            if not self.process_one():
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def process_one(self):
+        """Send the next due message; False when nothing was due or the daily quota is used up"""
+        if not _has_due():
+            return False
+        row = _claim_next()
+        if row is None:
+            return False
+        if not self.daily_limit.acquire(timeout=QUOTA_WAIT):
+            _release(row['id'], datetime.now() + timedelta(seconds=self.daily_limit.wait_time()))
+            return False
+        self.rate_limit.acquire()  # a fraction of a second per process sending, well inside the lease
+        try:
+            message_id = self.send(row['raw'])
+        except Exception as e:
+            if is_transient(e) and row['attempts'] < MAX_ATTEMPTS:
+                delay = BASE_BACKOFF * 2 ** (row['attempts'] - 1)
+                _mark_failed(row['id'], str(e), datetime.now() + timedelta(seconds=delay))
+            else:
+                _mark_failed(row['id'], str(e))
+            return True
+        _mark_sent(row['id'], message_id)
+        return True
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_worker(send, **kwargs):
+    """Start the process-wide outbox worker once"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = OutboxWorker(send, **kwargs)
+            _worker.start()
+    return _worker
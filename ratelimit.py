@@ -0,0 +1,106 @@
+"""Token bucket rate limiting"""
+import sqlite3
+import threading
+import time
+
+
+class TokenBucket:
+    """Refill `rate` tokens per second up to `capacity` tokens"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available without waiting"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens=1):
+        """Seconds until `tokens` would be available"""
+        with self.lock:
+            self._refill(time.monotonic())
+            missing = tokens - self.tokens
+            if missing <= 0:
+                return 0.0
+            return missing / self.rate if self.rate > 0 else float('inf')
+
+    def acquire(self, tokens=1, timeout=None):
+        """Block until tokens are available; False if the timeout runs out first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.try_acquire(tokens):
+                return True
+            delay = self.wait_time(tokens)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or delay > remaining:
+                    return False
+                delay = min(delay, remaining)
+            time.sleep(delay)
+
+
+class SqliteTokenBucket(TokenBucket):
+    """A TokenBucket kept in a SQLite table, so every process using `path` shares one budget
+
+    The level is refilled and taken in one BEGIN IMMEDIATE transaction.
+    Time is wall-clock time, which, unlike time.monotonic, processes agree on.
+    """
+
+    def __init__(self, path, name, rate, capacity):
+        super().__init__(rate, capacity)
+        self.path = path
+        self.name = name
+        conn = sqlite3.connect(path, timeout=30)
+        conn.execute('''CREATE TABLE IF NOT EXISTS token_buckets
+                        (name TEXT PRIMARY KEY,
+                         tokens REAL NOT NULL,
+                         updated REAL NOT NULL)''')
+        conn.execute('INSERT OR IGNORE INTO token_buckets (name, tokens, updated) VALUES (?, ?, ?)',
+                     (name, self.capacity, time.time()))
+        conn.commit()
+        conn.close()
+
+    def _take(self, tokens):
+        """Refill, then take `tokens` if there are enough; (taken, level afterwards)"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            level, updated = conn.execute('SELECT tokens, updated FROM token_buckets WHERE name = ?',
+                                          (self.name,)).fetchone()
+            now = time.time()
+            level = min(self.capacity, level + max(0.0, now - updated) * self.rate)
+            taken = 0 < tokens <= level
+            if taken:
+                level -= tokens
+            conn.execute('UPDATE token_buckets SET tokens = ?, updated = ? WHERE name = ?',
+                         (level, max(now, updated), self.name))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return taken, level
+
+    def try_acquire(self, tokens=1):
+        return self._take(tokens)[0]
+
+    def wait_time(self, tokens=1):
+        missing = tokens - self._take(0)[1]
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float('inf')
@@ -0,0 +1,396 @@
+"""Reminders derived from calendar events, kept up to date incrementally.
+
+Every event starting within the next `LOOKAHEAD_DAYS` gets linked reminders
+at fixed offsets before its start (a day and an hour by default, see
+`REMINDER_OFFSETS`). Two cheap queries keep them current:
+- Change detection. The first run lists the calendar once without
+  expanding recurring series and stores the `nextSyncToken`. Every later
+  run passes that token, so Google returns only the events created, moved,
+  renamed or cancelled since. A changed single event costs one indexed
+  lookup in the `event_reminders` link table. A changed recurring series
+  has its instances inside the window listed again.
+- A rolling window. The end of the window (`horizon`) is stored, and each
+  run lists only the slice of time that has newly entered it, so a
+  term-long timetable yields reminders for the coming week, not for every
+  class until the end of term.
+
+Reminders of events that have started are marked completed and unlinked.
+When the token expires (HTTP 410) the next run is a full sync again, and
+links for events that no longer exist are dropped. Several workers may run
+the sync; a lease row in `sync_locks` lets only one of them sync at a time.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from googleapiclient.errors import HttpError
+
+from timerange import user_timezone
+from tracing import metrics, span
+
+REMINDER_DB = 'reminders.db'
+REMINDER_OFFSETS = [int(m) for m in os.environ.get('REMINDER_OFFSETS', '1440,60').split(',') if m.strip()]
+LOOKAHEAD_DAYS = int(os.environ.get('REMINDER_LOOKAHEAD_DAYS', '7'))
+SYNC_INTERVAL = 120   # seconds between incremental syncs
+LOCK_LEASE = 600      # seconds before a lock left by a crashed worker is taken over
+ALL_DAY_HOUR = 9      # all-day events are treated as starting at this hour
+
+
+def _local(moment):
+    """Reminder due dates are stored as naive local 'YYYY-MM-DDTHH:MM' strings"""
+    return moment.strftime("%Y-%m-%dT%H:%M")
+
+
+def _add_column(c, table, column, declaration):
+    if column not in [row[1] for row in c.execute(f'PRAGMA table_info({table})')]:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+
+def init_sync_db():
+    """Initialize the link, sync state and lock tables next to the reminders table"""
+    conn = sqlite3.connect(REMINDER_DB, timeout=30)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS event_reminders
+                 (event_id TEXT NOT NULL,
+                  offset_minutes INTEGER NOT NULL,
+                  reminder_id INTEGER NOT NULL,
+                  series_id TEXT,
+                  event_start TEXT,
+                  PRIMARY KEY (event_id, offset_minutes))''')
+    _add_column(c, 'event_reminders', 'series_id', 'TEXT')
+    _add_column(c, 'event_reminders', 'event_start', 'TEXT')
+    c.execute('CREATE INDEX IF NOT EXISTS event_reminders_series ON event_reminders (series_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS event_reminders_start ON event_reminders (event_start)')
+    c.execute('''CREATE TABLE IF NOT EXISTS calendar_sync
+                 (calendar_id TEXT PRIMARY KEY,
+                  sync_token TEXT,
+                  synced_at TEXT,
+                  horizon TEXT)''')
+    _add_column(c, 'calendar_sync', 'horizon', 'TEXT')
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_locks
+                 (name TEXT PRIMARY KEY,
+                  owner TEXT NOT NULL,
+                  expires_at REAL NOT NULL)''')
+    conn.commit()
+    conn.close()
+
+
+def get_sync_state(calendar_id='primary'):
+    """(sync token, horizon) for a calendar; (None, None) before the first sync"""
+    conn = sqlite3.connect(REMINDER_DB, timeout=30)
+    row = conn.execute('SELECT sync_token, horizon FROM calendar_sync WHERE calendar_id = ?',
+                       (calendar_id,)).fetchone()
+    conn.close()
+    if row is None:
+        return None, None
+    return row[0], datetime.fromisoformat(row[1]) if row[1] else None
+
+
+def save_sync_state(calendar_id, token, horizon):
+    conn = sqlite3.connect(REMINDER_DB, timeout=30)
+    conn.execute('''INSERT OR REPLACE INTO calendar_sync (calendar_id, sync_token, synced_at, horizon)
+                    VALUES (?, ?, ?, ?)''',
+                 (calendar_id, token, datetime.now().isoformat(), horizon.isoformat() if horizon else None))
+    conn.commit()
+    conn.close()
+
+
+def acquire_lock(name, owner, lease=LOCK_LEASE):
+    """Take the named lock unless another owner holds an unexpired lease"""
+    conn = sqlite3.connect(REMINDER_DB, timeout=30, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT owner, expires_at FROM sync_locks WHERE name = ?', (name,)).fetchone()
+        if row is not None and row[0] != owner and row[1] > time.time():
+            conn.execute('ROLLBACK')
+            return False
+        conn.execute('INSERT OR REPLACE INTO sync_locks (name, owner, expires_at) VALUES (?, ?, ?)',
+                     (name, owner, time.time() + lease))
+        conn.execute('COMMIT')
+        return True
+    finally:
+        conn.close()
+
+
+def release_lock(name, owner):
+    conn = sqlite3.connect(REMINDER_DB, timeout=30)
+    conn.execute('DELETE FROM sync_locks WHERE name = ? AND owner = ?', (name, owner))
+    conn.commit()
+    conn.close()
+
+
+"""##Deriving Reminders"""
+
+def event_start(event, tz=None):
+    """Local start of an event, or None for events without one"""
+    tz = tz or user_timezone()
+    start = event.get('start') or {}
+    if 'dateTime' in start:
+        return datetime.fromisoformat(start['dateTime'].replace('Z', '+00:00')).astimezone(tz)
+    if 'date' in start:
+        return datetime.fromisoformat(start['date']).replace(hour=ALL_DAY_HOUR, tzinfo=tz)
+    return None
+
+
+def derived_reminders(event, now, horizon, offsets=None):
+    """{offset_minutes: (text, due_date)} for the reminders an event should have
+
+    Empty for cancelled events and events beyond the horizon; None for events
+    that have already started, which `expire_started` takes care of.
+    """
+    if event.get('status') == 'cancelled':
+        return {}
+    start = event_start(event, now.tzinfo)
+    if start is None or start <= now:
+        return None
+    if start > horizon:
+        return {}
+    text = f"{event.get('summary') or 'Event'} ({start.strftime('%a %d %b %H:%M')})"
+    return {offset: (text, _local(start - timedelta(minutes=offset))) for offset in offsets or REMINDER_OFFSETS}
+
+
+def apply_changes(events, now, horizon, offsets=None):
+    """Upsert or delete the linked reminders of changed events; (upserted, deleted) counts"""
+    offsets = offsets or REMINDER_OFFSETS
+    upserted = deleted = 0
+    conn = sqlite3.connect(REMINDER_DB, timeout=30)
+    c = conn.cursor()
+    for event in events:
+        wanted = derived_reminders(event, now, horizon, offsets)
+        if wanted is None:
+            continue
+        links = dict(c.execute('SELECT offset_minutes, reminder_id FROM event_reminders WHERE event_id = ?',
+                               (event['id'],)).fetchall())
+
+        for offset, reminder_id in links.items():
+            if offset not in wanted:
+                c.execute('DELETE FROM reminders WHERE id = ? AND completed = 0', (reminder_id,))
+                c.execute('DELETE FROM event_reminders WHERE event_id = ? AND offset_minutes = ?',
+                          (event['id'], offset))
+                deleted += 1
+        if not wanted:
+            continue
+
+        start = _local(event_start(event, now.tzinfo))
+        for offset, (text, due_date) in wanted.items():
+            if offset in links:
+                c.execute('UPDATE event_reminders SET event_start = ? WHERE event_id = ? AND offset_minutes = ?',
+                          (start, event['id'], offset))
+                # A moved event reopens reminders that were already done
+                c.execute('''UPDATE reminders SET text = ?,
+                                    completed = CASE WHEN due_date = ? THEN completed ELSE 0 END,
+                                    due_date = ?
+                             WHERE id = ? AND (text != ? OR due_date != ?)''',
+                          (text, due_date, due_date, links[offset], text, due_date))
+                if not c.rowcount:
+                    continue
+            elif due_date > _local(now):
+                c.execute('''INSERT INTO reminders (text, due_date, priority, created_at)
+                             VALUES (?, ?, 'medium', ?)''', (text, due_date, datetime.now().isoformat()))
+                c.execute('''INSERT INTO event_reminders (event_id, offset_minutes, reminder_id, series_id, event_start)
+                             VALUES (?, ?, ?, ?, ?)''',
+                          (event['id'], offset, c.lastrowid, event.get('recurringEventId'), start))
+            else:
+                continue
+            upserted += 1
+    conn.commit()
+    conn.close()
+    metrics.incr('reminder_sync_reminders_total', upserted, change='upserted')
+    metrics.incr('reminder_sync_reminders_total', deleted, change='deleted')
+    return upserted, deleted
+
+
+def _delete_links(c, rows):
+    for event_id, reminder_id in rows:
+        c.execute('DELETE FROM reminders WHERE id = ? AND completed = 0', (reminder_id,))
+        c.execute('DELETE FROM event_reminders WHERE event_id = ? AND reminder_id = ?', (event_id, reminder_id))
+    return len(rows)
+
+
+def drop_series(series_id, keep_ids=()):
+    """Delete the open reminders of a series' instances, except those in `keep_ids`"""
+    conn = sqlite3.connect(REMINDER_DB, timeout=30)
+    c = conn.cursor()
+    rows = [row for row in c.execute('SELECT event_id, reminder_id FROM event_reminders WHERE series_id = ?',
+                                     (series_id,)).fetchall()
+            if row[0] not in keep_ids]
+    deleted = _delete_links(c, rows)
+    conn.commit()
+    conn.close()
+    return deleted
+
+
+def expire_started(now):
+    """Complete and unlink the reminders of events that have started"""
+    conn = sqlite3.connect(REMINDER_DB, timeout=30)
+    c = conn.cursor()
+    cutoff = _local(now)
+    c.execute('''UPDATE reminders SET completed = 1, completed_at = ?
+                 WHERE completed = 0
+                   AND id IN (SELECT reminder_id FROM event_reminders WHERE event_start <= ?)''',
+              (datetime.now().isoformat(), cutoff))
+    c.execute('DELETE FROM event_reminders WHERE event_start <= ?', (cutoff,))
+    expired = c.rowcount
+    conn.commit()
+    conn.close()
+    metrics.incr('reminder_sync_reminders_total', expired, change='expired')
+    return expired
+
+
+def drop_missing(seen_ids):
+    """After a full sync, delete the open reminders of events that no longer exist"""
+    conn = sqlite3.connect(REMINDER_DB, timeout=30)
+    c = conn.cursor()
+    rows = [(event_id, reminder_id) for event_id, reminder_id, series_id
+            in c.execute('SELECT event_id, reminder_id, series_id FROM event_reminders').fetchall()
+            if event_id not in seen_ids and series_id not in seen_ids]
+    deleted = _delete_links(c, rows)
+    conn.commit()
+    conn.close()
+    return deleted
+
+
+"""##Incremental Sync"""
+
+def _paged(method, **params):
+    """Items of a paged list call, page by page, with the next sync token of the last page"""
+    page_token = None
+    while True:
+        response = method(pageToken=page_token, **params).execute()
+        yield response.get('items', []), response.get('nextSyncToken')
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return
+
+
+class ReminderSync:
+    """Keeps event reminders in step with the calendar from a background thread"""
+
+    def __init__(self, calendar_pool, calendar_id='primary', offsets=None, on_change=None,
+                 interval=SYNC_INTERVAL, lookahead=timedelta(days=LOOKAHEAD_DAYS)):
+        self.calendar_pool = calendar_pool
+        self.calendar_id = calendar_id
+        self.offsets = offsets or REMINDER_OFFSETS
+        self.on_change = on_change
+        self.interval = interval
+        self.lookahead = lookahead
+        self.owner = f"{os.getpid()}:{id(self)}"
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        init_sync_db()
+
+    def _window(self, calendar_service, start, end):
+        """Every event and recurring instance starting between two times"""
+        for events, _ in _paged(calendar_service.events().list, calendarId=self.calendar_id,
+                                singleEvents=True, timeMin=start.isoformat(), timeMax=end.isoformat(),
+                                maxResults=250):
+            yield from events
+
+    def _sync_series(self, calendar_service, series_id, now, horizon):
+        """Re-derive a changed series from its instances inside the window"""
+        instances = []
+        for events, _ in _paged(calendar_service.events().instances, calendarId=self.calendar_id,
+                                eventId=series_id, timeMin=now.isoformat(), timeMax=horizon.isoformat()):
+            instances.extend(events)
+        upserted, deleted = apply_changes(instances, now, horizon, self.offsets)
+        return upserted, deleted + drop_series(series_id, {event['id'] for event in instances})
+
+    def _sync(self, calendar_service, now):
+        token, horizon = get_sync_state(self.calendar_id)
+        mode = 'incremental' if token else 'full'
+        new_horizon = now + self.lookahead
+        seen, series, singles, changed = set(), set(), [], 0
+
+        params = {'calendarId': self.calendar_id, 'maxResults': 250}
+        if token:
+            params['syncToken'] = token
+        # Series are not expanded: instances are only listed inside the window
+        for events, next_token in _paged(calendar_service.events().list, **params):
+            changed += len(events)
+            for event in events:
+                seen.add(event['id'])
+                if mode == 'full':
+                    continue
+                if event.get('recurrence') or event.get('recurringEventId'):
+                    series.add(event.get('recurringEventId') or event['id'])
+                if event.get('status') == 'cancelled' or not event.get('recurrence'):
+                    singles.append(event)
+            token = next_token or token
+
+        upserted = deleted = 0
+        if mode == 'full':
+            deleted += drop_missing(seen)
+            horizon = None  # derive the whole window again
+        else:
+            counts = apply_changes(singles, now, new_horizon, self.offsets)
+            upserted, deleted = upserted + counts[0], deleted + counts[1]
+            for event in singles:
+                if event.get('status') == 'cancelled':
+                    deleted += drop_series(event['id'])  # a cancelled series arrives as a bare id
+            for series_id in series:
+                counts = self._sync_series(calendar_service, series_id, now, new_horizon)
+                upserted, deleted = upserted + counts[0], deleted + counts[1]
+
+        # Only the time that has entered the window since the last run is listed
+        window_start = max(horizon, now) if horizon else now
+        if window_start < new_horizon:
+            counts = apply_changes(list(self._window(calendar_service, window_start, new_horizon)),
+                                   now, new_horizon, self.offsets)
+            upserted, deleted = upserted + counts[0], deleted + counts[1]
+
+        save_sync_state(self.calendar_id, token, new_horizon)
+        metrics.incr('reminder_sync_runs_total', mode=mode)
+        metrics.incr('reminder_sync_events_total', changed)
+        return changed, upserted + deleted
+
+    def run_once(self, now=None):
+        """One sync pass; the number of changed events, or None when another worker is syncing"""
+        now = now or datetime.now(user_timezone())
+        lock = f"reminders:{self.calendar_id}"
+        if not acquire_lock(lock, self.owner):
+            metrics.incr('reminder_sync_runs_total', mode='skipped')
+            return None
+        try:
+            updates = expire_started(now)
+            with span('google.calendar.events.sync'):
+                with self.calendar_pool.checkout() as calendar_service:
+                    try:
+                        changed, count = self._sync(calendar_service, now)
+                    except HttpError as e:
+                        if e.resp.status != 410:
+                            raise
+                        # The sync token expired; start over with a full sync
+                        metrics.incr('reminder_sync_runs_total', mode='expired')
+                        save_sync_state(self.calendar_id, None, None)
+                        changed, count = self._sync(calendar_service, now)
+        finally:
+            release_lock(lock, self.owner)
+        if (updates or count) and self.on_change is not None:
+            self.on_change()
+        return changed
+
+    def poke(self):
+        """Sync soon, e.g. right after the assistant created an event"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Reminder sync failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='reminder-sync', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
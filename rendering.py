@@ -0,0 +1,197 @@
+"""Reply rendering for events, emails, news and reminders.
+
+Every item kind has one template, bound once at import (`str.format`), and
+a reply is the header plus the rendered items joined in a single pass, so
+rendering stays linear in the number of items. The templates follow the
+prompt's formatting rules: plain text, no **bold** markup.
+
+WhatsApp rejects text messages longer than 4096 characters. `segment`
+splits a reply into messages under that limit, breaking only between items
+(blank lines), then between lines, and only mid-line as a last resort.
+
+    python rendering.py    # benchmark over large event lists
+"""
+import time
+from datetime import datetime
+
+WHATSAPP_LIMIT = 4096
+ITEM_SEPARATOR = "\n\n"
+
+_EVENT = ("{}. Event: {}\n"
+          "   Time: {}\n"
+          "   Location: {}\n"
+          "   Video Link: {}\n"
+          "   Participants:{}").format
+_PARTICIPANT = "\n   - {}".format
+_EMAIL = "{subject}\n   {sender}".format
+_ARTICLE = ("{n}. {title} - {source}\n"
+            "   • {description}\n"
+            "   • Read more: {url}").format
+_REMINDER = ("{status} [{id}] {text}\n"
+             "   Due: {due}\n"
+             "   Priority: {priority}").format
+_DUE_REMINDER = "◻ [{}] {} (due {}, {} priority)".format
+
+
+def _render(header, items):
+    if header:
+        return ITEM_SEPARATOR.join([header, *items])
+    return ITEM_SEPARATOR.join(items)
+
+
+"""##Items"""
+
+# Name tables instead of strftime, which dominates rendering time on long lists
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def _moment(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _day(moment):
+    return f"{DAY_NAMES[moment.weekday()]} {moment.day:02d} {MONTH_NAMES[moment.month - 1]}"
+
+
+def event_time(event):
+    """'Mon 26 Oct 09:00 - 10:00', or the dates of an all-day event"""
+    start, end = event['start'], event['end']
+    if 'dateTime' not in start:
+        return f"{start.get('date')} (all day)"
+    first, last = _moment(start['dateTime']), _moment(end['dateTime'])
+    until = f"{last.hour:02d}:{last.minute:02d}"
+    if first.date() != last.date():
+        until = f"{_day(last)} {until}"
+    return f"{_day(first)} {first.hour:02d}:{first.minute:02d} - {until}"
+
+
+def render_event(n, event):
+    attendees = event.get('attendees') or []
+    return _EVENT(
+        n,
+        event.get('summary', '(No title)'),
+        event_time(event),
+        event.get('location', 'No location'),
+        event.get('hangoutLink') or event.get('htmlLink', 'No link'),
+        "".join([_PARTICIPANT(_participant(a)) for a in attendees]) or " none",
+    )
+
+
+def _participant(attendee):
+    if attendee.get('displayName'):
+        return f"{attendee['displayName']}: ({attendee.get('email', '')})"
+    return attendee.get('email', '')
+
+
+def render_email(subject, sender):
+    return _EMAIL(subject=subject, sender=sender)
+
+
+def render_article(n, article):
+    return _ARTICLE(
+        n=n,
+        title=article.get('title', 'No title'),
+        source=(article.get('source') or {}).get('name', 'Unknown source'),
+        description=article.get('description') or 'No description available',
+        url=article.get('url', '#'),
+    )
+
+
+def render_reminder(reminder):
+    """A reminders row: (id, text, due_date, priority, created_at, completed, completed_at)"""
+    return _REMINDER(status="✓" if reminder[5] else "◻", id=reminder[0], text=reminder[1],
+                     due=reminder[2], priority=reminder[3])
+
+
+"""##Replies"""
+
+def render_events(events, title="Your Events"):
+    if not events:
+        return "No events found."
+    return _render(f"{title}:", [render_event(n, event) for n, event in enumerate(events, 1)])
+
+
+def render_news(articles, limit=5):
+    if isinstance(articles, str):
+        return articles  # an error message
+    return _render("Latest News:", [render_article(n, article) for n, article in enumerate(articles[:limit], 1)])
+
+
+def render_reminders(reminders):
+    if not reminders:
+        return "No reminders found."
+    return _render("Your Reminders:", [render_reminder(reminder) for reminder in reminders])
+
+
+def render_due_reminders(reminders):
+    return "\n".join([_DUE_REMINDER(r[0], r[1], r[2], r[3]) for r in reminders])
+
+
+"""##Segmentation"""
+
+def _split(text, separator, limit):
+    """Pack the parts of `text` between separators into chunks of at most `limit`"""
+    chunks, current, size = [], [], 0
+    for part in text.split(separator):
+        extra = len(part) + (len(separator) if current else 0)
+        if current and size + extra > limit:
+            chunks.append(separator.join(current))
+            current, size = [], 0
+            extra = len(part)
+        current.append(part)
+        size += extra
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def segment(text, limit=WHATSAPP_LIMIT):
+    """WhatsApp messages of at most `limit` characters, split at item boundaries where possible"""
+    if len(text) <= limit:
+        return [text]
+    segments = []
+    for chunk in _split(text, ITEM_SEPARATOR, limit):
+        if len(chunk) <= limit:
+            segments.append(chunk)
+            continue
+        # One item longer than a message: split between its lines, then anywhere
+        for line_chunk in _split(chunk, "\n", limit):
+            segments.extend(line_chunk[i:i + limit] for i in range(0, len(line_chunk), limit))
+    return [s.strip("\n") for s in segments if s.strip()]
+
+
+"""##Benchmark"""
+
+def _concatenated_events(events, title="Your Events"):
+    """The same items assembled with repeated `+=`, as the old formatters did"""
+    formatted = f"{title}:"
+    for n, event in enumerate(events, 1):
+        formatted += ITEM_SEPARATOR + render_event(n, event)
+    return formatted
+
+
+def benchmark(sizes=(10, 100, 1000, 10000), runs=20):
+    """{size: (concatenation ms, rendering ms, rendering + segmentation ms, segments)}"""
+    results = {}
+    for size in sizes:
+        events = [{"id": f"evt{i}", "summary": f"Meeting {i}", "location": "Room 1",
+                   "htmlLink": f"https://calendar.example.com/{i}",
+                   "start": {"dateTime": f"2026-10-26T{9 + i % 8:02d}:00:00+03:00"},
+                   "end": {"dateTime": f"2026-10-26T{9 + i % 8:02d}:30:00+03:00"},
+                   "attendees": [{"email": "sarah@example.com"}, {"email": "john@example.com"}]}
+                  for i in range(size)]
+        timings = []
+        for render in (_concatenated_events, render_events, lambda e: segment(render_events(e))):
+            started = time.perf_counter()
+            for _ in range(runs):
+                output = render(events)
+            timings.append((time.perf_counter() - started) / runs * 1000)
+        results[size] = (*timings, len(output))
+    return results
+
+
+if __name__ == '__main__':
+    print(f"{'events':>8} {'+= ms':>10} {'join ms':>10} {'+segment':>10} {'messages':>9}")
+    for size, (concat, joined, segmented, count) in benchmark().items():
+        print(f"{size:>8} {concat:>10.3f} {joined:>10.3f} {segmented:>10.3f} {count:>9}")
@@ -0,0 +1,45 @@
+"""Local parsing and caching of extractions: python -m pytest test_extraction.py"""
+import json
+import re
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from extraction import extract, local_extract
+
+NOW = datetime(2026, 10, 19, 9, 30)  # a Monday
+
+
+@pytest.mark.parametrize("text, title, attendees", [
+    ("remind me to chat with the team tomorrow at 10am", "Chat with the team", []),
+    ("meeting with Sarah and John Doe", "Meeting", ["Sarah", "John Doe"]),
+    ("schedule a call with Anna, Ben and carl@example.com on Friday at 3pm", "Call",
+     ["Anna", "Ben", "carl@example.com"]),
+    ("lunch with John Monday at noon", "Lunch", ["John"]),
+])
+def test_attendees(text, title, attendees):
+    result = local_extract(text, NOW)
+    assert (result.title, result.attendees) == (title, attendees)
+
+
+class InTwoHoursClient:
+    """Answers every extraction with two hours after the time in the prompt"""
+
+    def __init__(self):
+        self.models = self
+
+    def generate_content(self, model, config, contents):
+        now = re.search(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}", contents[0]["parts"][0]["text"]).group(0)
+        moment = datetime.fromisoformat(now) + timedelta(hours=2)
+        return SimpleNamespace(text=json.dumps({"intent": "add_reminder", "title": "Stretch",
+                                                "datetime": moment.isoformat(), "attendees": [],
+                                                "priority": "medium"}))
+
+
+def test_relative_times_are_not_served_stale():
+    client = InTwoHoursClient()
+    first = extract("remind me in 2 hours to stretch", client, NOW)
+    later = extract("remind me in 2 hours to stretch", client, NOW + timedelta(minutes=20))
+    assert (first.datetime, later.datetime) == ("2026-10-19T11:30", "2026-10-19T11:50")
+    assert extract("remind me in 2 hours to stretch", client, NOW).source == "cache"
@@ -0,0 +1,43 @@
+"""The timerange corpus as assertions: python -m pytest test_timerange.py"""
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import timerange
+from timerange import CORPUS, parse_time_range, user_timezone
+
+TZ = user_timezone('UTC')
+NOW = datetime(2026, 10, 19, 9, 30, tzinfo=TZ)  # a Monday, as in the corpus
+
+
+@pytest.mark.parametrize("text, start, end", CORPUS, ids=[text for text, _, _ in CORPUS])
+def test_corpus(text, start, end):
+    result = parse_time_range(text, NOW, TZ)
+    if start is None:
+        assert result is None
+    else:
+        assert result is not None
+        assert (result.start[:19], result.end[:19]) == (start, end)
+
+
+@pytest.mark.parametrize("text", ["I sat with John", "sun cream", "we wed in June", "fri-day feeling"])
+def test_abbreviations_need_a_modifier(text):
+    assert parse_time_range(text, NOW, TZ) is None
+
+
+@pytest.mark.parametrize("text, day", [("this fri", "2026-10-23"), ("on sun", "2026-10-25"),
+                                       ("last tue", "2026-10-13"), ("next thurs", "2026-10-22")])
+def test_abbreviations_after_a_modifier(text, day):
+    assert parse_time_range(text, NOW, TZ).start[:10] == day
+
+
+def test_ranges_across_a_dst_change_keep_each_offset():
+    london = user_timezone('Europe/London')  # clocks go back on 25 October 2026
+    result = parse_time_range("this week", NOW.replace(tzinfo=london), london)
+    assert (result.start[19:], result.end[19:]) == ("+01:00", "+00:00")
+
+
+def test_unknown_zone_falls_back_to_utc_not_a_fixed_offset(monkeypatch):
+    monkeypatch.setattr(timerange, 'user_timezone_name', lambda: None)
+    assert user_timezone() == ZoneInfo('UTC')
@@ -0,0 +1,306 @@
+"""Time ranges for calendar reads, parsed locally.
+
+"today's events", "tomorrow morning", "this week", "next friday", "the next
+3 days", "12 march" or "any off days" only need a `timeMin`/`timeMax` pair
+for `get_calendar_events`, not a model call. `parse_time_range` matches one
+precompiled pattern against the request and returns the range as RFC3339
+timestamps in the user's timezone, or None when the request names no range
+it understands.
+
+Run the module to check the test corpus and time the parser:
+
+    python timerange.py
+"""
+import functools
+import os
+import re
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+# IANA name of the user's timezone; the server's zone when unset, else DEFAULT_TIMEZONE
+USER_TIMEZONE = os.getenv('ASSISTANT_TIMEZONE')
+DEFAULT_TIMEZONE = 'UTC'
+
+TimeRange = namedtuple("TimeRange", "start end label free_days")
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august",
+          "september", "october", "november", "december"]
+NUMBERS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+           "eight": 8, "nine": 9, "ten": 10, "fourteen": 14, "thirty": 30, "a couple of": 2, "a few": 3}
+PERIODS = {"morning": (6, 12), "afternoon": (12, 17), "evening": (17, 22), "night": (17, 24)}
+
+# Abbreviations only count after a modifier ("on sat", "next wed"), since
+# "sat", "sun" or "wed" on their own are usually ordinary words
+_weekday = r"monday|tuesday|wednesday|thursday|friday|saturday|sunday"
+_weekday_short = r"mon|tue|tues|wed|weds|thu|thur|thurs|fri|sat|sun"
+_weekday_mod = r"this|next|coming|on|last"
+_month = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*"
+_number = r"\d+|" + "|".join(sorted(map(re.escape, NUMBERS), key=len, reverse=True))
+_period = r"morning|afternoon|evening|night"
+
+RANGE_PATTERN = re.compile(r"\b(?:" + "|".join([
+    rf"(?P<next_days>(?:the\s+)?(?:next|coming|following)\s+(?P<n_days>{_number})\s+days)",
+    r"(?P<rest_week>rest\s+of\s+(?:the|this)\s+week)",
+    r"(?P<week>(?P<week_mod>this|next|last|coming)\s+week)",
+    r"(?P<weekend>(?P<weekend_mod>this|next|the)?\s*weekend)",
+    r"(?P<month>(?P<month_mod>this|next|last)\s+month)",
+    rf"(?P<tonight>tonight)",
+    rf"(?P<today>today|this\s+(?P<today_period>{_period}))",
+    rf"(?P<tomorrow>tomorrow(?:\s+(?P<tomorrow_period>{_period}))?)",
+    r"(?P<yesterday>yesterday)",
+    rf"(?P<date>(?P<date_day>\d{{1,2}})(?:st|nd|rd|th)?(?:\s+of)?\s+(?P<date_month>{_month})"
+    rf"|(?P<date_month2>{_month})\s+(?P<date_day2>\d{{1,2}})(?:st|nd|rd|th)?)",
+    rf"(?P<weekday>(?:(?P<weekday_mod>{_weekday_mod})\s+)?(?P<weekday_name>{_weekday})"
+    rf"|(?P<short_mod>{_weekday_mod})\s+(?P<short_name>{_weekday_short}))",
+]) + r")\b")
+
+FREE_DAYS_PATTERN = re.compile(r"\b(?:off|free)\s+days?\b|\bdays?\s+off\b|\bfree\s+(?:time|slots?)\b")
+
+
+def user_timezone(name=None):
+    """The user's zone, by IANA name so ranges that cross a DST change keep the right offsets
+
+    Falls back to DEFAULT_TIMEZONE when no name is known. Only Pythons
+    without zoneinfo use the host's current, fixed, UTC offset.
+    """
+    if ZoneInfo is not None:
+        return ZoneInfo(name or user_timezone_name() or DEFAULT_TIMEZONE)
+    return datetime.now().astimezone().tzinfo
+
+
+def user_timezone_name():
+    """IANA name of the user's timezone: ASSISTANT_TIMEZONE, else the server's if it can be found, else None"""
+    return USER_TIMEZONE or _server_timezone_name()
+
+
+@functools.lru_cache(maxsize=None)
+def _server_timezone_name():
+    name = os.getenv('TZ', '').lstrip(':') or os.path.realpath('/etc/localtime').partition('zoneinfo/')[2]
+    if not name or ZoneInfo is None:
+        return None
+    try:
+        ZoneInfo(name)
+    except (KeyError, ValueError, OSError):  # ZoneInfoNotFoundError is a KeyError
+        return None
+    return name
+
+
+def calendar_time(moment, tz=None):
+    """A Calendar API start or end for a local time
+
+    Naive times are taken to be in the user's timezone. The dateTime always
+    carries its UTC offset, so it is right even when no IANA zone name is
+    configured.
+    """
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=tz or user_timezone())
+    value = {'dateTime': moment.isoformat()}
+    if USER_TIMEZONE:
+        value['timeZone'] = USER_TIMEZONE
+    return value
+
+
+def _day(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _number_value(text):
+    return int(text) if text.isdigit() else NUMBERS[text]
+
+
+def _weekday_index(name):
+    return next(i for i, day in enumerate(WEEKDAYS) if day.startswith(name[:3]))
+
+
+def _month_index(name):
+    return next(i for i, month in enumerate(MONTHS) if month.startswith(name[:3])) + 1
+
+
+def _month_start(moment, offset):
+    month = moment.month - 1 + offset
+    return _day(moment).replace(year=moment.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def _range(match, now):
+    """(start, end, label) for the named group that matched"""
+    kind = match.lastgroup
+    group = match.group
+    today = _day(now)
+    week_start = today - timedelta(days=today.weekday())
+
+    if kind == 'next_days':
+        days = _number_value(group('n_days'))
+        return today, today + timedelta(days=days + 1), f"the next {days} days"
+    if kind == 'rest_week':
+        return now, week_start + timedelta(days=7), "the rest of the week"
+    if kind == 'week':
+        offset = {'last': -1, 'next': 1, 'coming': 1}.get(group('week_mod'), 0)
+        start = week_start + timedelta(weeks=offset)
+        return start, start + timedelta(days=7), f"{group('week_mod')} week"
+    if kind == 'weekend':
+        saturday = week_start + timedelta(days=5)
+        if group('weekend_mod') == 'next' or today >= saturday + timedelta(days=2):
+            saturday += timedelta(weeks=1)
+        return saturday, saturday + timedelta(days=2), f"{group('weekend_mod') or 'this'} weekend"
+    if kind == 'month':
+        offset = {'last': -1, 'next': 1}.get(group('month_mod'), 0)
+        return _month_start(now, offset), _month_start(now, offset + 1), f"{group('month_mod')} month"
+    if kind == 'tonight':
+        return today.replace(hour=17), today + timedelta(days=1), "tonight"
+    if kind in ('today', 'tomorrow'):
+        day = today if kind == 'today' else today + timedelta(days=1)
+        period = group(f'{kind}_period')
+        if period:
+            first, last = PERIODS[period]
+            label = f"this {period}" if kind == 'today' else f"tomorrow {period}"
+            return day.replace(hour=first), day + timedelta(hours=last), label
+        return day, day + timedelta(days=1), kind
+    if kind == 'yesterday':
+        return today - timedelta(days=1), today, "yesterday"
+    if kind == 'date':
+        month = _month_index(group('date_month') or group('date_month2'))
+        day_number = int(group('date_day') or group('date_day2'))
+        try:
+            day = today.replace(month=month, day=day_number)
+        except ValueError:
+            return None  # e.g. 31 june
+        if day < today - timedelta(days=180):
+            day = day.replace(year=day.year + 1)  # "3 january" asked in december
+        return day, day + timedelta(days=1), day.strftime("%A %d %B")
+    if kind == 'weekday':
+        index = _weekday_index(group('weekday_name') or group('short_name'))
+        modifier = group('weekday_mod') or group('short_mod')
+        if modifier == 'last':
+            days = (today.weekday() - index) % 7 or 7
+            day = today - timedelta(days=days)
+        else:
+            days = (index - today.weekday()) % 7
+            if modifier == 'next' and days == 0:
+                days = 7
+            day = today + timedelta(days=days)
+        return day, day + timedelta(days=1), day.strftime("%A %d %B")
+    return None
+
+
+def parse_time_range(text, now=None, tz=None):
+    """A TimeRange for the first time expression in `text`, or None
+
+    Requests for off days or free days without their own range cover the
+    rest of the current week.
+    """
+    tz = tz or user_timezone()
+    now = now.astimezone(tz) if now is not None else datetime.now(tz)
+    text = text.lower()
+    free_days = FREE_DAYS_PATTERN.search(text) is not None
+
+    match = RANGE_PATTERN.search(text)
+    result = _range(match, now) if match else None
+    if result is None:
+        if not free_days:
+            return None
+        week_end = _day(now) + timedelta(days=7 - now.weekday())
+        result = _day(now), week_end, "the rest of the week"
+    start, end, label = result
+    return TimeRange(start.isoformat(), end.isoformat(), label, free_days)
+
+
+def free_days(events, time_range):
+    """Dates in the range, as 'Monday 19 October' strings, that have no events"""
+    start = datetime.fromisoformat(time_range.start)
+    end = datetime.fromisoformat(time_range.end)
+    busy = set()
+    for event in events:
+        all_day = 'dateTime' not in event['start']
+        first = datetime.fromisoformat(event['start'].get('dateTime', event['start'].get('date')).replace('Z', '+00:00'))
+        last = datetime.fromisoformat(event['end'].get('dateTime', event['end'].get('date')).replace('Z', '+00:00'))
+        if not all_day:
+            first, last = first.astimezone(start.tzinfo), last.astimezone(start.tzinfo)
+        # End dates are exclusive: all-day events end on the following date
+        last_day = (last - timedelta(microseconds=1)).date() if last > first else first.date()
+        day = first.date()
+        while day <= last_day:
+            busy.add(day)
+            day += timedelta(days=1)
+    days = []
+    day = _day(start)
+    while day < end:
+        if day.date() not in busy:
+            days.append(day.strftime("%A %d %B"))
+        day += timedelta(days=1)
+    return days
+
+
+"""##Test Corpus and Benchmark"""
+
+# Relative to Monday 19 October 2026, 09:30
+CORPUS = [
+    ("Retrieve today's events", "2026-10-19T00:00:00", "2026-10-20T00:00:00"),
+    ("What's on this afternoon?", "2026-10-19T12:00:00", "2026-10-19T17:00:00"),
+    ("Any meetings tonight?", "2026-10-19T17:00:00", "2026-10-20T00:00:00"),
+    ("Show tomorrow's meetings", "2026-10-20T00:00:00", "2026-10-21T00:00:00"),
+    ("tomorrow morning schedule", "2026-10-20T06:00:00", "2026-10-20T12:00:00"),
+    ("What did I have yesterday", "2026-10-18T00:00:00", "2026-10-19T00:00:00"),
+    ("How busy am I this week?", "2026-10-19T00:00:00", "2026-10-26T00:00:00"),
+    ("Events next week", "2026-10-26T00:00:00", "2026-11-02T00:00:00"),
+    ("meetings last week", "2026-10-12T00:00:00", "2026-10-19T00:00:00"),
+    ("the rest of the week", "2026-10-19T09:30:00", "2026-10-26T00:00:00"),
+    ("Anything this weekend?", "2026-10-24T00:00:00", "2026-10-26T00:00:00"),
+    ("plans for next weekend", "2026-10-31T00:00:00", "2026-11-02T00:00:00"),
+    ("my calendar this month", "2026-10-01T00:00:00", "2026-11-01T00:00:00"),
+    ("next month's events", "2026-11-01T00:00:00", "2026-12-01T00:00:00"),
+    ("events for the next 3 days", "2026-10-19T00:00:00", "2026-10-23T00:00:00"),
+    ("meetings in the coming two days", "2026-10-19T00:00:00", "2026-10-22T00:00:00"),
+    ("What's on Friday?", "2026-10-23T00:00:00", "2026-10-24T00:00:00"),
+    ("any meetings on wed", "2026-10-21T00:00:00", "2026-10-22T00:00:00"),
+    ("next monday's schedule", "2026-10-26T00:00:00", "2026-10-27T00:00:00"),
+    ("what happened last thursday", "2026-10-15T00:00:00", "2026-10-16T00:00:00"),
+    ("events on 12 November", "2026-11-12T00:00:00", "2026-11-13T00:00:00"),
+    ("meetings on march 3rd", "2027-03-03T00:00:00", "2027-03-04T00:00:00"),
+    ("Do I have any off days?", "2026-10-19T00:00:00", "2026-10-26T00:00:00"),
+    ("free days next week", "2026-10-26T00:00:00", "2026-11-02T00:00:00"),
+    ("when is my dentist appointment", None, None),
+    ("I sat with John yesterday", "2026-10-18T00:00:00", "2026-10-19T00:00:00"),
+    ("lunch in the sun with Wed", None, None),
+    ("see you on sat", "2026-10-24T00:00:00", "2026-10-25T00:00:00"),
+    ("next wed's meetings", "2026-10-21T00:00:00", "2026-10-22T00:00:00"),
+]
+
+
+def check_corpus(tz=None):
+    tz = tz or user_timezone('UTC')
+    now = datetime(2026, 10, 19, 9, 30, tzinfo=tz)
+    failures = []
+    for text, start, end in CORPUS:
+        result = parse_time_range(text, now, tz)
+        got = (result.start[:19], result.end[:19]) if result else (None, None)
+        if got != (start, end):
+            failures.append(f"{text!r}: expected {start} - {end}, got {got[0]} - {got[1]}")
+    return failures
+
+
+def benchmark(iterations=20000):
+    """Parses per second over the corpus"""
+    tz = user_timezone('UTC')
+    now = datetime(2026, 10, 19, 9, 30, tzinfo=tz)
+    texts = [text for text, _, _ in CORPUS]
+    start = time.perf_counter()
+    for i in range(iterations):
+        parse_time_range(texts[i % len(texts)], now, tz)
+    return iterations / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    failures = check_corpus()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{len(CORPUS) - len(failures)}/{len(CORPUS)} corpus phrases parsed as expected")
+    print(f"{benchmark():,.0f} parses per second")
@@ -0,0 +1,189 @@
+"""Per-request tracing and process metrics.
+
+`trace_request` binds a request id for the duration of a webhook call and
+`span` times a block inside it (handlers and every outbound call). Span
+durations feed latency histograms, errors feed per-span error counters, and
+`render_metrics` exposes everything in the Prometheus text format for the
+`/metrics` endpoint. Set `TRACE_FILE` to also append one JSON line per
+request with all of its spans, for offline analysis.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+TRACE_FILE = os.getenv('TRACE_FILE')
+
+# Seconds; covers cache hits through slow model calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+_spans = contextvars.ContextVar('spans', default=None)
+_parent = contextvars.ContextVar('parent_span', default=None)
+
+
+"""##Metrics"""
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.collectors = []  # callables returning {name: value} gauges
+        self.lock = threading.Lock()
+
+    def incr(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def register_collector(self, collector, prefix=''):
+        """Add a callable whose {name: value} result is exported as gauges on every scrape"""
+        with self.lock:
+            self.collectors.append((prefix, collector))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            collectors = list(self.collectors)
+
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {name} counter")
+                seen.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+        for prefix, collector in collectors:
+            try:
+                gauges = collector()
+            except Exception:
+                continue
+            for name, value in sorted(gauges.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {prefix}{name} gauge")
+                    lines.append(f"{prefix}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+metrics = MetricsRegistry()
+
+
+def render_metrics():
+    return metrics.render()
+
+
+"""##Tracing"""
+
+def current_request_id():
+    return _request_id.get()
+
+
+@contextmanager
+def trace_request(request_id=None, **attrs):
+    """Bind a request id and collect the spans of one request"""
+    request_id = request_id or uuid.uuid4().hex
+    spans = []
+    tokens = (_request_id.set(request_id), _spans.set(spans), _parent.set(None))
+    start = time.time()
+    try:
+        with span('request', **attrs):
+            yield request_id
+    finally:
+        _parent.reset(tokens[2])
+        _spans.reset(tokens[1])
+        _request_id.reset(tokens[0])
+        if TRACE_FILE:
+            _dump(request_id, start, spans)
+
+
+_dump_lock = threading.Lock()
+
+
+def _dump(request_id, start, spans):
+    line = json.dumps({'request_id': request_id, 'start': start, 'spans': spans}, default=str)
+    with _dump_lock:
+        with open(TRACE_FILE, 'a') as f:
+            f.write(line + "\n")
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a block; the duration goes to the span_seconds histogram and the request trace"""
+    span_id = uuid.uuid4().hex[:16]
+    record = {'span_id': span_id, 'parent_id': _parent.get(), 'name': name,
+              'start': time.time(), **attrs}
+    parent = _parent.set(span_id)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+        metrics.incr('span_errors_total', span=name)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _parent.reset(parent)
+        record['duration_ms'] = duration * 1000
+        metrics.observe('span_seconds', duration, span=name)
+        metrics.incr('span_calls_total', span=name)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append(record)
+
+
+def traced(name):
+    """Decorator form of `span`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator